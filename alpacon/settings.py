@@ -103,6 +103,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.humanize',
+    'django.contrib.postgres',
 ]
 
 REST_API_APPS = [
@@ -196,6 +197,13 @@ CHANNEL_LAYERS = {
     },
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://%s:%d/1' % (REDIS_HOST, REDIS_PORT),
+    },
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES':[
         'rest_framework.authentication.SessionAuthentication',
@@ -208,8 +216,8 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
-        'rest_framework.filters.SearchFilter',
         'rest_framework.filters.OrderingFilter',
+        'api.filters.IndexedSearchFilter',
     ],
     'DEFAULT_PAGINATION_CLASS': 'api.pagination.MyPageNumberPagination',
     'PAGE_SIZE': 15,
@@ -263,6 +271,33 @@ PASSWORD_RESET_TIMEOUT = 6*60*60 # in seconds
 
 WEBSH_SESSION_SHARE_TIMEOUT = timedelta(minutes=30)
 
+# Websh output is recorded in chunks of this many bytes, or at least every interval (in seconds).
+WEBSH_RECORD_CHUNK_SIZE = int(os.getenv('ALPACON_WEBSH_RECORD_CHUNK_SIZE', str(64*1024)))
+WEBSH_RECORD_FLUSH_INTERVAL = int(os.getenv('ALPACON_WEBSH_RECORD_FLUSH_INTERVAL', '10'))
+# Maximum characters of output events returned by a request for records.
+WEBSH_RECORD_PAGE_SIZE = 1024*1024
+
+# PTY output is batched for this many seconds or bytes before being sent to viewers,
+# and limited to a rate in bytes per second (0 for no limit). (See `websh.buffers.OutputCoalescer`.)
+WEBSH_OUTPUT_DELAY = float(os.getenv('ALPACON_WEBSH_OUTPUT_DELAY', '0.01'))
+WEBSH_OUTPUT_MAX_SIZE = int(os.getenv('ALPACON_WEBSH_OUTPUT_MAX_SIZE', str(16*1024)))
+WEBSH_OUTPUT_MAX_RATE = int(os.getenv('ALPACON_WEBSH_OUTPUT_MAX_RATE', str(4*1024*1024)))
+
+# Output to each viewer of a session is queued up to this many bytes. On overflow, the policy
+# (drop-oldest, resync or disconnect) is applied. (See `websh.buffers.ViewerQueue`.)
+WEBSH_VIEWER_QUEUE_SIZE = int(os.getenv('ALPACON_WEBSH_VIEWER_QUEUE_SIZE', str(1024*1024)))
+WEBSH_VIEWER_POLICY = os.getenv('ALPACON_WEBSH_VIEWER_POLICY', 'drop-oldest')
+# Recent output sent to viewers on resync.
+WEBSH_VIEWER_RESYNC_SIZE = 64*1024
+WEBSH_VIEWER_METRICS_TIMEOUT = 60  # in seconds
+
+# Offer agents to carry PTY streams over the backhaul connection. (See `websh.multiplex`.)
+WEBSH_MULTIPLEX = bool(strtobool(os.getenv('ALPACON_WEBSH_MULTIPLEX', 'false')))
+# Bytes of data that can be in flight per stream and direction.
+WEBSH_STREAM_WINDOW = 256*1024
+
+SERVER_OVERVIEW_CACHE_TIMEOUT = int(os.getenv('ALPACON_SERVER_OVERVIEW_CACHE_TIMEOUT', '5')) # in seconds
+
 EMAIL_BACKEND = os.getenv('ALPACON_EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
 EMAIL_FROM = os.getenv('ALPACON_EMAIL_FROM', 'no-reply@alpacon.io')
 EMAIL_SUBJECT_PREFIX = os.getenv('ALPACON_EMAIL_SUBJECT_PREFIX', '[alpacon] ')
@@ -277,6 +312,15 @@ EMAIL_USE_TLS = bool(strtobool(os.getenv('ALPACON_EMAIL_USE_TLS', 'true')))
 
 WEEKDAYS = 'mon,tue,wed,thu,fri'
 
+WATCHDOG_SHARDS = int(os.getenv('ALPACON_WATCHDOG_SHARDS', '16'))
+WATCHDOG_LOCK_TIMEOUT = timedelta(minutes=5)
+
+# IAM users and groups are added to servers in a batch this many seconds after memberships change.
+SERVER_PROVISION_DELAY = int(os.getenv('ALPACON_SERVER_PROVISION_DELAY', '5'))
+
+# Accept commits of servers with 202 and apply them in the background on the `ingest` queue.
+ASYNC_COMMIT = bool(strtobool(os.getenv('ALPACON_ASYNC_COMMIT', 'false')))
+
 CELERY_BROKER_URL = 'redis://%s:%d' % (REDIS_HOST, REDIS_PORT)
 CELERY_RESULT_BACKEND = CELERY_BROKER_URL
 CELERY_ACCEPT_CONTENT = ['application/json']
@@ -292,6 +336,10 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'servers.tasks.ping_all_servers',
         'schedule': crontab(minute='*/5'),
     },
+    'apply_pending_commits': {
+        'task': 'servers.tasks.apply_pending_commits',
+        'schedule': crontab(),
+    },
     'cleanup_installers': {
         'task': 'servers.tasks.cleanup_installers',
         'schedule': crontab('*/10'),
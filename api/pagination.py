@@ -1,10 +1,124 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+import logging
+from base64 import b64encode
+from urllib import parse
+
+from django.db import connections
+
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import PageNumberPagination, CursorPagination
 from rest_framework.response import Response
 
 
+logger = logging.getLogger(__name__)
+
+
+class MyCursorPagination(CursorPagination):
+    """
+    Keyset pagination on the ordering of viewsets. Pages are fetched with
+    `WHERE <ordering field> < <position> LIMIT <page size>`, so response
+    time does not depend on the page depth. Instead of an exact COUNT, the
+    row estimate of the query planner is returned as `count`.
+    """
+
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = '-added_at'
+
+    @classmethod
+    def get_view_ordering(cls, request, queryset, view):
+        ordering = None
+        for backend in getattr(view, 'filter_backends', []):
+            if issubclass(backend, OrderingFilter):
+                ordering = backend().get_ordering(request, queryset, view)
+                break
+        if not ordering:
+            ordering = getattr(view, 'ordering', None) or queryset.query.order_by or cls.ordering
+        if isinstance(ordering, str):
+            return (ordering,)
+        return tuple(ordering)
+
+    @classmethod
+    def is_supported(cls, request, queryset, view):
+        """
+        Return whether the requested ordering can be used for cursors.
+        Positions are read from a model attribute, so lookups are not allowed.
+        """
+        ordering = cls.get_view_ordering(request, queryset, view)
+        return '__' not in ordering[0] and '?' not in ordering[0]
+
+    def get_ordering(self, request, queryset, view):
+        return self.get_view_ordering(request, queryset, view)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = self.get_approximate_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_approximate_count(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        try:
+            sql, params = queryset.order_by().query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN (FORMAT JSON) %s' % sql, params)
+                plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return plan[0]['Plan']['Plan Rows']
+        except Exception as e:
+            logger.exception(e)
+            return None
+
+    def encode_cursor(self, cursor):
+        # Return the cursor itself rather than an URL, as page numbers are returned for page-based pagination.
+        tokens = {}
+        if cursor.offset != 0:
+            tokens['o'] = str(cursor.offset)
+        if cursor.reverse:
+            tokens['r'] = '1'
+        if cursor.position is not None:
+            tokens['p'] = cursor.position
+        return b64encode(parse.urlencode(tokens, doseq=True).encode('ascii')).decode('ascii')
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'approximate': True,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
 class MyPageNumberPagination(PageNumberPagination):
+    """
+    Page-based pagination, which switches to `MyCursorPagination` if the
+    request has `cursor` or `pagination=cursor` parameters, or the viewset
+    sets `cursor_pagination = True`.
+    """
+
     page_size_query_param = 'page_size'
     max_page_size = 100
+    cursor_paginator = None
+
+    def use_cursor(self, request, queryset, view):
+        if request.query_params.get('pagination', None) == 'page':
+            return False
+        return (
+            (
+                MyCursorPagination.cursor_query_param in request.query_params
+                or request.query_params.get('pagination', None) == 'cursor'
+                or getattr(view, 'cursor_pagination', False)
+            )
+            and MyCursorPagination.is_supported(request, queryset, view)
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_cursor(request, queryset, view):
+            self.cursor_paginator = MyCursorPagination()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
 
     def get_next_link(self):
         if not self.page.has_next():
@@ -17,6 +131,8 @@ class MyPageNumberPagination(PageNumberPagination):
         return self.page.previous_page_number()
 
     def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
         return Response({
             'count': self.page.paginator.count,
             'current': self.page.number,
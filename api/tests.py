@@ -0,0 +1,70 @@
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.filters import IndexedSearchFilter
+from events.models import Command
+from iam.models import Group
+from servers.models import Server
+
+
+User = get_user_model()
+
+
+class ServerSearchView:
+    search_fields = ['name', 'owner__username', 'groups__name']
+
+
+class CommandSearchView:
+    search_fields = ['line', 'server__name']
+    search_rank_fields = ['line']
+
+
+class IndexedSearchFilterTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser')
+        self.server = Server.objects.create(name='testing', owner=self.user)
+        self.server.groups.add(
+            Group.objects.create(name='web-a', display_name='Web A'),
+            Group.objects.create(name='web-b', display_name='Web B'),
+        )
+        Server.objects.create(name='other', owner=self.user)
+
+    def search(self, view, queryset, params):
+        request = Request(APIRequestFactory().get('/', params))
+        return IndexedSearchFilter().filter_queryset(request, queryset, view)
+
+    def test_relations(self):
+        # The server is in two matching groups, but it is returned once without DISTINCT.
+        queryset = self.search(ServerSearchView(), Server.objects.all(), {'search': 'web'})
+        self.assertFalse(queryset.query.distinct)
+        self.assertEqual(list(queryset), [self.server])
+
+        queryset = self.search(ServerSearchView(), Server.objects.order_by('name'), {'search': 'testuser'})
+        self.assertEqual([obj.name for obj in queryset], ['other', 'testing'])
+
+        queryset = self.search(ServerSearchView(), Server.objects.all(), {'search': 'web testing'})
+        self.assertEqual(list(queryset), [self.server])
+        queryset = self.search(ServerSearchView(), Server.objects.all(), {'search': 'web other'})
+        self.assertEqual(list(queryset), [])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Ranking requires PostgreSQL.')
+    def test_ranking(self):
+        for line in ['ls -al /var/log', 'lsblk', 'ls']:
+            Command.objects.create(server=self.server, line=line)
+
+        queryset = self.search(CommandSearchView(), Command.objects.order_by('line'), {'search': 'ls'})
+        self.assertEqual([obj.line for obj in queryset], ['ls', 'lsblk', 'ls -al /var/log'])
+
+        # An explicit ordering is kept as is.
+        queryset = self.search(
+            CommandSearchView(), Command.objects.order_by('line'),
+            {'search': 'ls', 'ordering': 'line'},
+        )
+        self.assertNotIn('search_rank', queryset.query.annotations)
+        self.assertEqual([obj.line for obj in queryset], ['ls', 'ls -al /var/log', 'lsblk'])
@@ -12,6 +12,7 @@ from api.apitoken.models import APIToken
 from events.models import Event, Command
 from security.models import CommandACL
 from websh.mixins import WebshValidationSerializer
+from utils.api.serializers import SparseFieldsetsMixin
 
 
 class EventSerializer(serializers.ModelSerializer):
@@ -54,7 +55,7 @@ class EventListSerializer(EventSerializer):
         fields = ['server', 'record', 'count', 'reporter', 'description']
 
 
-class CommandSerializer(serializers.ModelSerializer):
+class CommandSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     scheduled_at = serializers.DateTimeField(
         required=False, allow_null=True,
         label=_('Scheduled at')
@@ -69,11 +70,21 @@ class CommandSerializer(serializers.ModelSerializer):
             'server', 'server_name', 'requested_by', 'requested_by_name', 'run_after'
         ]
         read_only_fields = ['id']
+        select_related_fields = {
+            'server_name': ['server'],
+            'requested_by_name': ['requested_by'],
+        }
+        prefetch_related_fields = {
+            'run_after': ['run_after'],
+        }
+        deferrable_fields = {
+            'data': ['data'],
+            'result': ['result'],
+        }
 
 
 class CommandListSerializer(CommandSerializer):
-    class Meta:
-        model = Command
+    class Meta(CommandSerializer.Meta):
         fields = [
             'id', 'shell', 'line', 'success', 'result', 'status',
             'response_delay', 'elapsed_time', 'added_at', 'server',
@@ -16,6 +16,7 @@ from events.api.serializers import (
     CommandCreateSerializer, CommandUpdateSerializer, CommandResultSerializer
 )
 from servers.api.mixins import ServerObjectMixin, ServerDataViewSet
+from utils.api.mixins import ConditionalGetMixin, SparseFieldsetsMixin
 
 
 logger = logging.getLogger(__name__)
@@ -26,6 +27,8 @@ class EventViewSet(ServerDataViewSet):
     serializer_class = EventSerializer
     filterset_fields = ['server', 'reporter']
     search_fields = ['server__id', 'server__name', 'reporter', 'record', 'description']
+    search_rank_fields = ['record', 'description']
+    conditional_fields = ['updated_at']
 
     def get_serializer_class(self):
         if self.action == 'list':
@@ -34,7 +37,7 @@ class EventViewSet(ServerDataViewSet):
             return super().get_serializer_class()
 
 
-class CommandViewSet(ServerObjectMixin, viewsets.ModelViewSet):
+class CommandViewSet(ServerObjectMixin, SparseFieldsetsMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Command.objects.all()
     serializer_class = CommandSerializer
     filterset_fields = ['server', 'requested_by']
@@ -42,7 +45,10 @@ class CommandViewSet(ServerObjectMixin, viewsets.ModelViewSet):
         'server__id', 'server__name', 'line', 'result',
         'requested_by__username', 'requested_by__first_name', 'requested_by__last_name'
     ]
+    search_rank_fields = ['line']
     ordering = ['-scheduled_at']
+    # State changes of commands are saved without touching updated_at.
+    conditional_fields = ['updated_at', 'delivered_at', 'acked_at', 'handled_at']
 
     def get_queryset(self):
         queryset = super().get_queryset()
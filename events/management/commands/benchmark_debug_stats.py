@@ -0,0 +1,122 @@
+import json
+import time
+import random
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from events.models import Command as ServerCommand
+from history.models import RequestStat
+from servers.models import Server
+
+
+User = get_user_model()
+
+
+def legacy_record_debug_stats(command):
+    """
+    Previous implementation of debug ingestion: a query and an insert per reporter.
+    """
+    data = json.loads(command.result)
+    command.server.debugrecord_set.create(content=data)
+    for i in range(len(data['reporters'])):
+        stats = data['reporters'][i]
+        prev = command.server.requeststat_set.filter(
+            index=i,
+        ).order_by('-date').first()
+        cur = RequestStat(
+            server=command.server,
+            index=i,
+            date=command.handled_at,
+            cum_success=stats['success'],
+            cum_failure=stats['failure'],
+            cum_ignored=stats['ignored'],
+            delay=stats['delay'],
+            latency=stats['latency'],
+        )
+        if prev and prev.date > command.server.started_at:
+            cur.success = cur.cum_success - prev.cum_success
+            cur.failure = cur.cum_failure - prev.cum_failure
+            cur.ignored = cur.cum_ignored - prev.cum_ignored
+        else:
+            cur.success = cur.cum_success
+            cur.failure = cur.cum_failure
+            cur.ignored = cur.cum_ignored
+        cur.save()
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark debug result ingestion (RequestStat) for a synthetic fleet. '
+        'All data is created in a transaction and rolled back at the end.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--servers', type=int, default=2000, help='Number of servers.')
+        parser.add_argument('--reporters', type=int, default=50, help='Number of reporters per server.')
+        parser.add_argument('--sweeps', type=int, default=2, help='Number of debug sweeps.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            servers = self.create_servers(options['servers'])
+            for name, func in (
+                ('legacy', legacy_record_debug_stats),
+                ('batched', ServerCommand.record_debug_stats),
+            ):
+                RequestStat.objects.filter(server__in=servers).delete()
+                for sweep in range(options['sweeps']):
+                    commands = self.create_commands(servers, options['reporters'], sweep)
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        for command in commands:
+                            func(command)
+                        elapsed = time.perf_counter() - started
+                    self.stdout.write(
+                        '%(name)-8s sweep %(sweep)d: %(elapsed).2fs total, '
+                        '%(per_server).2fms/server, %(queries).1f queries/server' % {
+                            'name': name,
+                            'sweep': sweep + 1,
+                            'elapsed': elapsed,
+                            'per_server': elapsed * 1000 / len(commands),
+                            'queries': len(queries) / len(commands),
+                        }
+                    )
+            transaction.set_rollback(True)
+
+    def create_servers(self, count):
+        owner = User.objects.create_user(username='benchmark-%d' % int(time.time()))
+        started_at = timezone.now() - timedelta(days=1)
+        return [
+            Server.objects.create(
+                name='bench-%05d' % i,
+                owner=owner,
+                commissioned=True,
+                started_at=started_at,
+            ) for i in range(count)
+        ]
+
+    def create_commands(self, servers, reporters, sweep):
+        handled_at = timezone.now()
+        commands = ServerCommand.objects.bulk_create([
+            ServerCommand(
+                server=server,
+                shell='internal',
+                line='debug',
+                success=True,
+                handled_at=handled_at,
+                result=json.dumps({
+                    'reporters': [{
+                        'success': (sweep + 1) * random.randint(100, 1000),
+                        'failure': sweep * random.randint(0, 10),
+                        'ignored': sweep * random.randint(0, 10),
+                        'delay': random.random(),
+                        'latency': random.random(),
+                    } for _ in range(reporters)],
+                }),
+            ) for server in servers
+        ])
+        return commands
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.9 on 2024-02-13 10:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0004_command_groupname_command_username'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='command',
+            index=models.Index(condition=models.Q(('handled_at__isnull', True)), fields=['delivered_at', 'acked_at'], name='events_command_unhandled_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.9 on 2024-02-16 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0005_command_events_command_unhandled_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['-added_at'], name='events_event_added_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='command',
+            index=models.Index(fields=['-scheduled_at'], name='events_command_scheduled_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.9 on 2024-02-19 11:30
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0006_event_events_event_added_at_idx_and_more'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='event',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('record'), name='gin_trgm_ops'), name='events_event_record_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('description'), name='gin_trgm_ops'), name='events_event_desc_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='command',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('line'), name='gin_trgm_ops'), name='events_command_line_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='command',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('result'), name='gin_trgm_ops'), name='events_command_result_trgm'),
+        ),
+    ]
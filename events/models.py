@@ -4,6 +4,9 @@ import logging
 from datetime import timedelta
 
 from django.db import models, transaction
+from django.db.models import Q
+from django.db.models.functions import Upper
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.urls import reverse
 from django.conf import settings
 from django.utils import timezone
@@ -32,6 +35,12 @@ class Event(UUIDBaseModel):
         verbose_name = _('event')
         verbose_name_plural = _('events')
         get_latest_by = 'updated_at'
+        indexes = [
+            models.Index(fields=['-added_at'], name='events_event_added_at_idx'),
+            # Trigram indexes for `icontains` lookups. (See `api.filters.IndexedSearchFilter`.)
+            GinIndex(OpClass(Upper('record'), name='gin_trgm_ops'), name='events_event_record_trgm'),
+            GinIndex(OpClass(Upper('description'), name='gin_trgm_ops'), name='events_event_desc_trgm'),
+        ]
 
     def __str__(self):
         return '[%(server)s] %(record)s' % {
@@ -104,6 +113,16 @@ class Command(UUIDBaseModel):
         verbose_name = _('command')
         verbose_name_plural = _('commands')
         get_latest_by = 'added_at'
+        indexes = [
+            models.Index(fields=['-scheduled_at'], name='events_command_scheduled_idx'),
+            GinIndex(OpClass(Upper('line'), name='gin_trgm_ops'), name='events_command_line_trgm'),
+            GinIndex(OpClass(Upper('result'), name='gin_trgm_ops'), name='events_command_result_trgm'),
+            models.Index(
+                fields=['delivered_at', 'acked_at'],
+                condition=Q(handled_at__isnull=True),
+                name='events_command_unhandled_idx',
+            ),
+        ]
 
     def __str__(self):
         return '%s %s> %s' % (self.server, self.shell, self.line)
@@ -262,9 +281,58 @@ class Command(UUIDBaseModel):
         self.acked_at = timezone.now()
         super().save(update_fields=['acked_at'])
 
+    def record_debug_stats(self):
+        """
+        Store the debug result reported by alpamon and derive request
+        statistics for each reporter. Previous statistics of all reporters
+        are fetched with a single query and new rows are inserted in bulk.
+        """
+        try:
+            data = json.loads(self.result)
+            self.server.debugrecord_set.create(
+                content=data,
+            )
+            reporters = data['reporters']
+            prevs = {
+                obj.index: obj for obj in RequestStat.objects.filter(
+                    server__pk=self.server.pk,
+                    index__lt=len(reporters),
+                ).order_by('index', '-date').distinct('index')
+            }
+            started_at = self.server.started_at
+
+            stats = []
+            for i, item in enumerate(reporters):
+                prev = prevs.get(i)
+                cur = RequestStat(
+                    server=self.server,
+                    index=i,
+                    date=self.handled_at,
+                    cum_success=item['success'],
+                    cum_failure=item['failure'],
+                    cum_ignored=item['ignored'],
+                    delay=item['delay'],
+                    latency=item['latency'],
+                )
+                if prev and started_at and prev.date > started_at:
+                    cur.success = cur.cum_success - prev.cum_success
+                    cur.failure = cur.cum_failure - prev.cum_failure
+                    cur.ignored = cur.cum_ignored - prev.cum_ignored
+                else:
+                    cur.success = cur.cum_success
+                    cur.failure = cur.cum_failure
+                    cur.ignored = cur.cum_ignored
+                stats.append(cur)
+            RequestStat.objects.bulk_create(stats)
+            return len(stats)
+        except Exception as e:
+            logger.exception(e)
+            return 0
+
     def fin(self, success, result):
-        from events.tasks import execute_scheduled_commands
+        from events.tasks import execute_scheduled_commands, record_debug_stats
         from servers.tasks import check_server_status
+        from servers.provisioning import invalidate_provisioning_state
 
         if self.handled_at is not None:
             return
@@ -284,38 +352,11 @@ class Command(UUIDBaseModel):
             self.server.timerecord_set.create(system_time=result)
 
         elif self.shell == 'internal' and self.line == 'debug' and success and self.requested_by is None:
-            try:
-                data = json.loads(result)
-                self.server.debugrecord_set.create(
-                    content=data,
-                )
-                for i in range(len(data['reporters'])):
-                    stats = data['reporters'][i]
-                    prev = self.server.requeststat_set.filter(
-                        index=i,
-                    ).order_by('-date').first()
-                    cur = RequestStat(
-                        server=self.server,
-                        index=i,
-                        date=self.handled_at,
-                        cum_success=stats['success'],
-                        cum_failure=stats['failure'],
-                        cum_ignored=stats['ignored'],
-                        delay=stats['delay'],
-                        latency=stats['latency'],
-                    )
-                    if prev and prev.date > self.server.started_at:
-                        cur.success = cur.cum_success - prev.cum_success
-                        cur.failure = cur.cum_failure - prev.cum_failure
-                        cur.ignored = cur.cum_ignored - prev.cum_ignored
-                    else:
-                        cur.success = cur.cum_success
-                        cur.failure = cur.cum_failure
-                        cur.ignored = cur.cum_ignored
-                    cur.save()
-
-            except Exception as e:
-                logger.exception(e)
+            record_debug_stats.delay(self.pk)
+
+        elif self.shell == 'internal' and self.line.split(' ', 1)[0] in ('adduser', 'addgroup') and not success:
+            # Pending users and groups of the server are retried instead of being waited for.
+            invalidate_provisioning_state(self.server_id)
 
         if self.run_before.filter(handled_at__isnull=True).exists():
             execute_scheduled_commands.delay(self.server.pk)
@@ -15,6 +15,20 @@ def execute_scheduled_commands(server_pk=None):
     return Command.execute_all_scheduled(server_pk)
 
 
+@shared_task(ignore_result=True, queue='celery')
+def record_debug_stats(command_pk):
+    """
+    Ingest the debug result of a command off the request path so that
+    acknowledging and finishing commands stay fast.
+    """
+    try:
+        command = Command.objects.select_related('server').get(pk=command_pk)
+    except Command.DoesNotExist:
+        logger.debug('Command %s does not exist.', command_pk)
+        return 0
+    return command.record_debug_stats()
+
+
 @shared_task(ignore_result=True, queue='cleanup')
 def delete_old_events():
     return Event.objects.filter(
@@ -1,4 +1,8 @@
+import json
+from datetime import timedelta
+
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.utils.crypto import get_random_string
 from rest_framework import status
@@ -6,6 +10,7 @@ from rest_framework import status
 from rest_framework.test import APITestCase
 
 from events.models import Command
+from history.models import RequestStat
 from iam.models import Group
 from iam.test_user import get_random_username
 from proc.models import SystemGroup, SystemUser
@@ -116,6 +121,29 @@ class CommandTestCase(APITestCase):
         self.assertEqual(cmd.username, self.username)
         self.assertEqual(cmd.groupname, 'docker')
 
+    def test_list_commands_with_cursor(self):
+        now = timezone.now()
+        for i in range(5):
+            Command.objects.create(
+                server=self.server,
+                line='echo %d' % i,
+                requested_by=self.user,
+                scheduled_at=now - timedelta(minutes=i),
+            )
+
+        lines = []
+        params = {'pagination': 'cursor', 'page_size': 2}
+        while True:
+            response = self.client.get(reverse('api:events:command-list'), params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('last', response.data)
+            lines += [item['line'] for item in response.data['results']]
+            if response.data['next'] is None:
+                break
+            params['cursor'] = response.data['next']
+        self.assertEqual(lines, ['echo %d' % i for i in range(5)])
+
+
 class CommandPermissionTestCase(APITestCase):
     def setUp(self):
         self.password = get_random_string(16)
@@ -234,3 +262,39 @@ class CommandPermissionTestCase(APITestCase):
             }
         )
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class DebugStatsTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username=get_random_username())
+        self.server = Server.objects.create(
+            name='testing', owner=self.user, commissioned=True,
+            started_at=timezone.now() - timedelta(hours=1),
+        )
+
+    def debug(self, reporters):
+        return Command.objects.create(
+            server=self.server,
+            shell='internal',
+            line='debug',
+            success=True,
+            result=json.dumps({'reporters': reporters}),
+            handled_at=timezone.now(),
+        )
+
+    def reporter(self, success, failure=0, ignored=0):
+        return {'success': success, 'failure': failure, 'ignored': ignored, 'delay': 0.1, 'latency': 0.2}
+
+    def test_record_debug_stats(self):
+        count = self.debug([self.reporter(10), self.reporter(5, 1)]).record_debug_stats()
+        self.assertEqual(count, 2)
+        self.assertEqual(RequestStat.objects.filter(server=self.server).count(), 2)
+
+        cmd = self.debug([self.reporter(15), self.reporter(8, 3), self.reporter(1)])
+        with self.assertNumQueries(3):
+            self.assertEqual(cmd.record_debug_stats(), 3)
+
+        stats = RequestStat.objects.filter(server=self.server, date=cmd.handled_at).order_by('index')
+        self.assertEqual([obj.success for obj in stats], [5, 3, 1])
+        self.assertEqual([obj.failure for obj in stats], [0, 2, 0])
+        self.assertEqual([obj.cum_success for obj in stats], [15, 8, 1])
@@ -50,7 +50,8 @@ class InterfaceAddressAdmin(admin.ModelAdmin):
 @admin.register(SystemPackage)
 class InstalledSystemPackageAdmin(admin.ModelAdmin):
     list_display = ('server', 'name', 'version', 'source', 'arch', 'added_at')
-    search_fields = ('name',)
+    list_select_related = ('server', 'release')
+    search_fields = ('release__name',)
     actions = ['uninstall_selected']
 
     def get_actions(self, request):
@@ -69,7 +70,8 @@ class InstalledSystemPackageAdmin(admin.ModelAdmin):
 @admin.register(PythonPackage)
 class InstalledPythonPackageAdmin(admin.ModelAdmin):
     list_display = ('server', 'name', 'version', 'added_at')
-    search_fields = ('name',)
+    list_select_related = ('server', 'release')
+    search_fields = ('release__name',)
     actions = ['uninstall_selected']
 
     def get_actions(self, request):
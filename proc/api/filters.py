@@ -0,0 +1,20 @@
+from django_filters import rest_framework as filters
+
+from proc.models import SystemPackage, PythonPackage
+
+
+class SystemPackageFilter(filters.FilterSet):
+    name = filters.CharFilter(field_name='release__name')
+    arch = filters.CharFilter(field_name='release__arch')
+
+    class Meta:
+        model = SystemPackage
+        fields = ['server', 'name', 'arch']
+
+
+class PythonPackageFilter(filters.FilterSet):
+    name = filters.CharFilter(field_name='release__name')
+
+    class Meta:
+        model = PythonPackage
+        fields = ['server', 'name']
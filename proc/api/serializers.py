@@ -3,6 +3,7 @@ from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
 
 from proc.models import *
+from proc.inventory import GROUP_BY_CHOICES
 
 
 class SystemInfoSerializer(serializers.ModelSerializer):
@@ -43,7 +44,7 @@ class OsVersionSerializer(serializers.ModelSerializer):
 class SystemTimeSerializer(serializers.ModelSerializer):
     class Meta:
         model = SystemTime
-        fields = ['datetime', 'uptime', 'timezone', 'boot_time', 'added_at']
+        fields = ['datetime', 'uptime', 'timezone', 'boot_time', 'added_at', 'valid_to', 'updated_at']
         read_only_fields = ['boot_time']
         extra_kwargs = {
             'datetime': {'write_only': True},
@@ -125,13 +126,57 @@ class PythonVersionSerializer(serializers.ModelSerializer):
         exclude = ['current', 'server']
 
 
-class SystemPackageSerializer(serializers.ModelSerializer):
+class InstalledPackageSerializer(serializers.ModelSerializer):
+    """
+    Serialize installed packages with the fields of their releases, which
+    are interned on creation. (See `proc.models.PackageRelease`.)
+    """
+
+    def create(self, validated_data):
+        release_model = self.Meta.model._meta.get_field('release').related_model
+        release = list(release_model.intern([{
+            field: validated_data.pop(field, None) for field in release_model.RELEASE_FIELDS
+        }]).values())[0]
+        return self.Meta.model.objects.create(release=release, **validated_data)
+
+
+class SystemPackageSerializer(InstalledPackageSerializer):
+    name = serializers.CharField(max_length=128, label=_('name'))
+    version = serializers.CharField(max_length=128, label=_('version'))
+    source = serializers.CharField(max_length=512, required=False, allow_blank=True, allow_null=True, label=_('source'))
+    arch = serializers.CharField(max_length=16, required=False, allow_blank=True, allow_null=True, label=_('arch'))
+
     class Meta:
         model = SystemPackage
-        exclude = ['current', 'server']
+        fields = ['id', 'name', 'version', 'source', 'arch', 'added_at']
+        read_only_fields = ['id']
 
 
-class PythonPackageSerializer(serializers.ModelSerializer):
+class PythonPackageSerializer(InstalledPackageSerializer):
+    name = serializers.CharField(max_length=128, label=_('name'))
+    version = serializers.CharField(max_length=64, label=_('version'))
+
     class Meta:
         model = PythonPackage
-        exclude = ['current', 'server']
+        fields = ['id', 'name', 'version', 'added_at']
+        read_only_fields = ['id']
+
+
+class PackageInventoryQuerySerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=128, required=False, label=_('name'))
+    prefix = serializers.CharField(max_length=128, required=False, label=_('name prefix'))
+    version = serializers.CharField(max_length=128, required=False, label=_('version'))
+    version_lt = serializers.CharField(max_length=128, required=False, label=_('version less than'))
+    version_lte = serializers.CharField(max_length=128, required=False, label=_('version less than or equal to'))
+    version_gt = serializers.CharField(max_length=128, required=False, label=_('version greater than'))
+    version_gte = serializers.CharField(max_length=128, required=False, label=_('version greater than or equal to'))
+    arch = serializers.CharField(max_length=16, required=False, label=_('arch'))
+    group_by = serializers.ChoiceField(
+        choices=GROUP_BY_CHOICES, default='version',
+        label=_('group by')
+    )
+
+    def validate(self, attrs):
+        if not (attrs.get('name', None) or attrs.get('prefix', None)):
+            raise serializers.ValidationError(_('Either name or prefix is required.'))
+        return attrs
@@ -1,8 +1,14 @@
 import logging
 
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
 from servers.api.mixins import ServerDataViewSet, ServerMultiDataViewSet
 from proc.models import *
 from proc.api.serializers import *
+from proc.api.filters import SystemPackageFilter, PythonPackageFilter
+from proc.inventory import query_inventory
 
 
 logger = logging.getLogger(__name__)
@@ -13,6 +19,8 @@ class SystemInfoViewSet(ServerDataViewSet):
     serializer_class = SystemInfoSerializer
     filterset_fields = ['server', 'cpu_type', 'cpu_subtype', 'cpu_brand']
     serach_fields = ['uuid', 'cpu_type', 'cpu_subtype', 'cpu_brand', 'hardware_vendor', 'hardware_serial', 'hostname', 'local_hostname']
+    # Current rows are updated in place by unchanged commits. (See `proc.models.ServerSnapshot`.)
+    conditional_fields = ['updated_at']
 
 
 class OsVersionViewSet(ServerDataViewSet):
@@ -20,12 +28,14 @@ class OsVersionViewSet(ServerDataViewSet):
     serializer_class = OsVersionSerializer
     filterset_fields = ['server', 'name', 'version', 'platform', 'platform_like']
     search_fields = ['name', 'version', 'platform', 'platform_like']
+    conditional_fields = ['updated_at']
 
 
 class SystemTimeViewSet(ServerDataViewSet):
     queryset = SystemTime.objects.order_by('-added_at')
     serializer_class = SystemTimeSerializer
     filterset_fields = ['server', 'timezone']
+    conditional_fields = ['updated_at']
 
 
 class SystemUserViewSet(ServerMultiDataViewSet):
@@ -36,6 +46,8 @@ class SystemUserViewSet(ServerMultiDataViewSet):
         'uid', 'gid', 'username', 'description', 'directory', 'shell',
         'group__groupname',
     ]
+    # Rows are updated in place by commits. (See `proc.utils.sync_objects`.)
+    conditional_fields = ['updated_at']
 
     def get_queryset(self):
         return super().get_queryset().filter(
@@ -48,6 +60,7 @@ class SystemGroupViewSet(ServerMultiDataViewSet):
     serializer_class = SystemGroupSerializer
     filterset_fields = ['server', 'iam_group']
     search_fields = ['gid', 'groupname']
+    conditional_fields = ['updated_at']
 
     def get_queryset(self):
         return super().get_queryset().filter(
@@ -60,17 +73,34 @@ class InterfaceViewSet(ServerMultiDataViewSet):
     serializer_class = InterfaceSerializer
     filterset_fields = ['server', 'type']
     search_fields = ['name', 'mac', 'address__address']
-
-
-class SystemPackageViewSet(ServerMultiDataViewSet):
-    queryset = SystemPackage.objects.order_by('name')
+    conditional_fields = ['updated_at', 'address__updated_at']
+
+
+class PackageInventoryMixin:
+    @action(detail=False, methods=['get'])
+    def inventory(self, request):
+        serializer = PackageInventoryQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        queryset = query_inventory(
+            self.queryset.model,
+            installations=self.get_queryset(),
+            **serializer.validated_data
+        )
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(list(queryset), status=status.HTTP_200_OK)
+
+
+class SystemPackageViewSet(PackageInventoryMixin, ServerMultiDataViewSet):
+    queryset = SystemPackage.objects.select_related('release').order_by('release__name')
     serializer_class = SystemPackageSerializer
-    filterset_fields = ['server', 'name', 'arch']
-    search_fields = ['name', 'version', 'source', 'arch']
+    filterset_class = SystemPackageFilter
+    search_fields = ['release__name', 'release__version', 'release__source', 'release__arch']
 
 
-class PythonPackageViewSet(ServerMultiDataViewSet):
-    queryset = PythonPackage.objects.order_by('name')
+class PythonPackageViewSet(PackageInventoryMixin, ServerMultiDataViewSet):
+    queryset = PythonPackage.objects.select_related('release').order_by('release__name')
     serializer_class = PythonPackageSerializer
-    filterset_fields = ['server', 'name']
-    search_fields = ['name', 'version']
+    filterset_class = PythonPackageFilter
+    search_fields = ['release__name', 'release__version']
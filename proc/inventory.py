@@ -0,0 +1,87 @@
+import logging
+
+from django.db.models import F, Count
+
+from utils.versions import get_version_key
+
+
+logger = logging.getLogger(__name__)
+
+VERSION_LOOKUPS = {
+    'version_lt': 'lt',
+    'version_lte': 'lte',
+    'version_gt': 'gt',
+    'version_gte': 'gte',
+}
+
+GROUP_BY_CHOICES = ['version', 'name', 'server']
+
+
+def filter_releases(release_model, name=None, prefix=None, version=None, arch=None, **ranges):
+    """
+    Return releases that match the predicates. Version ranges are compared
+    with parsed versions, e.g., `version_lt='3.0.7'`. (See `utils.versions`.)
+    """
+    queryset = release_model.objects.all()
+    if name:
+        queryset = queryset.filter(name=name)
+    if prefix:
+        queryset = queryset.filter(name__startswith=prefix)
+    if version:
+        queryset = queryset.filter(version=version)
+    if arch and 'arch' in release_model.RELEASE_FIELDS:
+        queryset = queryset.filter(arch=arch)
+    for (param, lookup) in VERSION_LOOKUPS.items():
+        if ranges.get(param, None):
+            queryset = queryset.filter(**{
+                'version_key__%s' % lookup: get_version_key(ranges[param]),
+            })
+    return queryset
+
+
+def query_inventory(model, installations=None, group_by='version', **predicates):
+    """
+    Query installations of `model` (`SystemPackage` or `PythonPackage`) of
+    which releases match `predicates`. (See `filter_releases`.) Releases are
+    looked up first with indexes on the small catalog, then installations
+    are filtered with a semi-join on them.
+
+    - `group_by='version'`: the number of servers for each release.
+    - `group_by='name'`: the number of servers and releases for each package.
+    - `group_by='server'`: the matching packages of each server.
+
+    `installations` can limit the scope, e.g., to servers visible to a user.
+    """
+    release_model = model._meta.get_field('release').related_model
+    if installations is None:
+        installations = model.objects.all()
+    installations = installations.filter(
+        release__in=filter_releases(release_model, **predicates).values('pk'),
+    ).order_by()
+
+    if group_by == 'version':
+        fields = {
+            'name': F('release__name'),
+            'version': F('release__version'),
+        }
+        if 'arch' in release_model.RELEASE_FIELDS:
+            fields['arch'] = F('release__arch')
+        return installations.values(**fields).annotate(
+            servers=Count('server'),
+        ).order_by('name', F('release__version_key'), *sorted(fields.keys() - {'name'}))
+    elif group_by == 'name':
+        return installations.values(
+            name=F('release__name'),
+        ).annotate(
+            releases=Count('release', distinct=True),
+            servers=Count('server', distinct=True),
+        ).order_by('name')
+    elif group_by == 'server':
+        return installations.values(
+            'server',
+            server_name=F('server__name'),
+            name=F('release__name'),
+            version=F('release__version'),
+        ).order_by('server_name', 'server', 'name', 'version')
+    else:
+        raise ValueError('Unknown group_by: %s' % group_by)
@@ -0,0 +1,90 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from proc.models import SystemInfo, OsVersion, SystemTime
+from servers.models import Server
+
+
+SNAPSHOT_MODELS = {
+    'info': SystemInfo,
+    'os': OsVersion,
+    'time': SystemTime,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Collapse runs of unchanged snapshots (system information, OS versions and system times) '
+        'into single rows and set their validity intervals. Servers are processed in small '
+        'transactions, so that commits of other servers are not blocked.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model', choices=list(SNAPSHOT_MODELS), action='append',
+            help='Snapshots to compact. All snapshots are compacted by default.',
+        )
+        parser.add_argument('--batch-size', type=int, default=20, help='Number of servers in a transaction.')
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds to sleep between transactions.')
+        parser.add_argument('--dry-run', action='store_true', help='Report changes without saving them.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for name in options['model'] or list(SNAPSHOT_MODELS):
+            model = SNAPSHOT_MODELS[name]
+            server_pks = list(model.objects.order_by().values_list('server', flat=True).distinct())
+            num_deleted = 0
+            num_updated = 0
+            for i in range(0, len(server_pks), batch_size):
+                with transaction.atomic():
+                    for server_pk in server_pks[i:i + batch_size]:
+                        (deleted, updated) = self.compact(model, server_pk)
+                        num_deleted += deleted
+                        num_updated += updated
+                    if options['dry_run']:
+                        transaction.set_rollback(True)
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+            self.stdout.write(self.style.SUCCESS(
+                '%(model)s: %(verb)s %(deleted)d duplicate rows and updated %(updated)d rows of %(servers)d servers.' % {
+                    'model': model._meta.verbose_name_plural,
+                    'verb': 'would delete' if options['dry_run'] else 'deleted',
+                    'deleted': num_deleted,
+                    'updated': num_updated,
+                    'servers': len(server_pks),
+                }
+            ))
+
+    def compact(self, model, server_pk):
+        # Lock the server as commits do. (See `proc.models.ServerSnapshot.save`.)
+        Server.objects.select_for_update(of=('self',)).filter(pk=server_pk).first()
+
+        runs = []
+        for row in model.objects.filter(server_id=server_pk).order_by('added_at').iterator():
+            if runs and not row.has_changed(runs[-1][0]):
+                runs[-1].append(row)
+            else:
+                runs.append([row])
+
+        duplicates = [row.pk for run in runs for row in run[1:]]
+        for i in range(0, len(duplicates), 1000):
+            model.objects.filter(pk__in=duplicates[i:i + 1000]).delete()
+
+        updated = []
+        for (i, run) in enumerate(runs):
+            (first, last) = (run[0], run[-1])
+            values = {
+                'current': any(row.current for row in run),
+                'valid_to': runs[i + 1][0].added_at if i + 1 < len(runs) else None,
+            }
+            # Keep the latest observation of the run, as commits do.
+            values.update({name: getattr(last, name) for name in model.volatile_fields + ['updated_at']})
+            if any(getattr(first, name) != value for (name, value) in values.items()):
+                for (name, value) in values.items():
+                    setattr(first, name, value)
+                updated.append(first)
+        if updated:
+            model.objects.bulk_update(updated, ['current', 'valid_to', 'updated_at'] + model.volatile_fields, batch_size=1000)
+        return (len(duplicates), len(updated))
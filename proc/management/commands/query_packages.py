@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from proc.models import SystemPackage, PythonPackage
+from proc.inventory import GROUP_BY_CHOICES, VERSION_LOOKUPS, query_inventory
+
+
+class Command(BaseCommand):
+    help = (
+        'Query the package inventory of all servers, '
+        'e.g., --name openssl --version-lt 3.0.7 --group-by server.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--python', action='store_true', help='Query python packages instead of system packages.')
+        parser.add_argument('--name', help='Package name.')
+        parser.add_argument('--prefix', help='Prefix of package names.')
+        parser.add_argument('--exact-version', help='Exact version.')
+        for param in VERSION_LOOKUPS:
+            parser.add_argument('--%s' % param.replace('_', '-'), dest=param, help='Version range (%s).' % param)
+        parser.add_argument('--arch', help='Architecture of system packages.')
+        parser.add_argument('--group-by', choices=GROUP_BY_CHOICES, default='version', help='How to group results.')
+
+    def handle(self, *args, **options):
+        if not (options['name'] or options['prefix']):
+            raise CommandError('Either --name or --prefix is required.')
+
+        started = time.perf_counter()
+        rows = list(query_inventory(
+            PythonPackage if options['python'] else SystemPackage,
+            group_by=options['group_by'],
+            name=options['name'],
+            prefix=options['prefix'],
+            version=options['exact_version'],
+            arch=options['arch'],
+            **{param: options[param] for param in VERSION_LOOKUPS}
+        ))
+        elapsed = time.perf_counter() - started
+
+        if rows:
+            columns = [column for column in rows[0] if column != 'server']
+            widths = {column: max(len(column), *(len(str(row[column])) for row in rows)) for column in columns}
+            self.stdout.write('  '.join(column.ljust(widths[column]) for column in columns))
+            for row in rows:
+                self.stdout.write('  '.join(str(row[column]).ljust(widths[column]) for column in columns))
+        self.stdout.write(self.style.SUCCESS('%d rows in %.1fms.' % (len(rows), elapsed * 1000)))
@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from proc.models import SystemUser, SystemGroup
+from proc.utils import IAMIdentityMap
+from servers.models import Server
+from servers.provisioning import invalidate_provisioning_state
+
+
+class Command(BaseCommand):
+    help = 'Re-link system users and groups of all servers to IAM users and groups.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='Number of servers to process at once.',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report changes without saving them.',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        pks = list(Server.objects.order_by('pk').values_list('pk', flat=True))
+        num_users = 0
+        num_groups = 0
+        for i in range(0, len(pks), batch_size):
+            (users, groups) = self.relink(pks[i:i + batch_size], options['dry_run'])
+            num_users += users
+            num_groups += groups
+            self.stdout.write('Processed %d/%d servers.' % (min(i + batch_size, len(pks)), len(pks)))
+
+        self.stdout.write(self.style.SUCCESS(
+            '%(verb)s %(users)d system users and %(groups)d system groups.' % {
+                'verb': 'Would re-link' if options['dry_run'] else 'Re-linked',
+                'users': num_users,
+                'groups': num_groups,
+            }
+        ))
+
+    def relink(self, server_pks, dry_run):
+        now = timezone.now()
+        users = list(SystemUser.objects.filter(
+            server__pk__in=server_pks,
+        ).only('pk', 'server', 'uid', 'username', 'iam_user'))
+        groups = list(SystemGroup.objects.filter(
+            server__pk__in=server_pks,
+        ).only('pk', 'server', 'gid', 'groupname', 'iam_group'))
+        identity_map = IAMIdentityMap(
+            users=[(obj.uid, obj.username) for obj in users],
+            groups=[(obj.gid, obj.groupname) for obj in groups],
+        )
+
+        changed_users = []
+        for obj in users:
+            iam_user = identity_map.get_user(obj.uid, obj.username)
+            iam_user_id = iam_user.pk if iam_user else None
+            if obj.iam_user_id != iam_user_id:
+                obj.iam_user_id = iam_user_id
+                obj.updated_at = now
+                changed_users.append(obj)
+
+        changed_groups = []
+        for obj in groups:
+            iam_group = identity_map.get_group(obj.gid, obj.groupname)
+            iam_group_id = iam_group.pk if iam_group else None
+            if obj.iam_group_id != iam_group_id:
+                obj.iam_group_id = iam_group_id
+                obj.updated_at = now
+                changed_groups.append(obj)
+
+        if not dry_run:
+            SystemUser.objects.bulk_update(changed_users, ['iam_user', 'updated_at'], batch_size=1000)
+            SystemGroup.objects.bulk_update(changed_groups, ['iam_group', 'updated_at'], batch_size=1000)
+            # Provisioning relies on IAM links of system accounts. (See `servers.provisioning`.)
+            for server_pk in {obj.server_id for obj in changed_users + changed_groups}:
+                invalidate_provisioning_state(server_pk)
+        return (len(changed_users), len(changed_groups))
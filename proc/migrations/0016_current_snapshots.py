@@ -0,0 +1,43 @@
+# Generated by Django 4.2.9 on 2024-02-15 09:42
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+SNAPSHOT_MODELS = ['SystemInfo', 'OsVersion', 'SystemTime']
+
+
+def set_current_snapshots(apps, schema_editor):
+    for model_name in SNAPSHOT_MODELS:
+        model = apps.get_model('proc', model_name)
+        model.objects.filter(current=True).update(current=False)
+        model.objects.filter(
+            pk=Subquery(
+                model.objects.filter(
+                    server=OuterRef('server'),
+                ).order_by('-added_at').values('pk')[:1]
+            ),
+        ).update(current=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proc', '0015_alter_pythonpackage_name_alter_systempackage_name_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_current_snapshots, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='osversion',
+            constraint=models.UniqueConstraint(condition=models.Q(('current', True)), fields=('server',), name='proc_osversion_current'),
+        ),
+        migrations.AddConstraint(
+            model_name='systeminfo',
+            constraint=models.UniqueConstraint(condition=models.Q(('current', True)), fields=('server',), name='proc_systeminfo_current'),
+        ),
+        migrations.AddConstraint(
+            model_name='systemtime',
+            constraint=models.UniqueConstraint(condition=models.Q(('current', True)), fields=('server',), name='proc_systemtime_current'),
+        ),
+    ]
@@ -0,0 +1,136 @@
+# Generated by Django 4.2.9 on 2024-02-28 16:20
+
+import json
+import hashlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+RELEASE_FIELDS = {
+    'SystemPackage': ('SystemPackageRelease', ['name', 'version', 'source', 'arch']),
+    'PythonPackage': ('PythonPackageRelease', ['name', 'version']),
+}
+
+
+def get_digest(values):
+    data = json.dumps(list(values), separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def intern_releases(apps, schema_editor):
+    quote_name = schema_editor.quote_name
+    for (model_name, (release_model_name, fields)) in RELEASE_FIELDS.items():
+        model = apps.get_model('proc', model_name)
+        release_model = apps.get_model('proc', release_model_name)
+        releases = []
+        for values in model.objects.order_by().values_list(*fields).distinct().iterator():
+            releases.append(release_model(digest=get_digest(values), **dict(zip(fields, values))))
+            if len(releases) >= 1000:
+                release_model.objects.bulk_create(releases)
+                releases = []
+        release_model.objects.bulk_create(releases)
+
+        # Assign releases with a single join instead of an update per release.
+        conditions = []
+        for field in fields:
+            column = quote_name(model._meta.get_field(field).column)
+            condition = 'p.%(column)s = r.%(column)s' % {'column': column}
+            if model._meta.get_field(field).null:
+                condition = '(%(condition)s OR (p.%(column)s IS NULL AND r.%(column)s IS NULL))' % {
+                    'condition': condition,
+                    'column': column,
+                }
+            conditions.append(condition)
+        schema_editor.execute(
+            'UPDATE %(table)s AS p SET release_id = r.id FROM %(release_table)s AS r WHERE %(conditions)s' % {
+                'table': quote_name(model._meta.db_table),
+                'release_table': quote_name(release_model._meta.db_table),
+                'conditions': ' AND '.join(conditions),
+            }
+        )
+
+        # Keep a row for each release of a server.
+        schema_editor.execute(
+            'DELETE FROM %(table)s WHERE id IN ('
+            'SELECT id FROM ('
+            'SELECT id, ROW_NUMBER() OVER (PARTITION BY server_id, release_id ORDER BY added_at) AS n '
+            'FROM %(table)s'
+            ') AS ranked WHERE n > 1'
+            ')' % {
+                'table': quote_name(model._meta.db_table),
+            }
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proc', '0016_current_snapshots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SystemPackageRelease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(editable=False, max_length=64, unique=True, verbose_name='digest')),
+                ('name', models.CharField(db_index=True, max_length=128, verbose_name='name')),
+                ('version', models.CharField(max_length=128, verbose_name='version')),
+                ('source', models.CharField(blank=True, max_length=512, null=True, verbose_name='source')),
+                ('arch', models.CharField(blank=True, max_length=16, null=True, verbose_name='arch')),
+            ],
+            options={
+                'verbose_name': 'system package release',
+                'verbose_name_plural': 'system package releases',
+            },
+        ),
+        migrations.CreateModel(
+            name='PythonPackageRelease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(editable=False, max_length=64, unique=True, verbose_name='digest')),
+                ('name', models.CharField(db_index=True, max_length=128, verbose_name='name')),
+                ('version', models.CharField(max_length=64, verbose_name='version')),
+            ],
+            options={
+                'verbose_name': 'python package release',
+                'verbose_name_plural': 'python package releases',
+            },
+        ),
+        migrations.AddField(
+            model_name='systempackage',
+            name='release',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='installations', to='proc.systempackagerelease', verbose_name='release'),
+        ),
+        migrations.AddField(
+            model_name='pythonpackage',
+            name='release',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='installations', to='proc.pythonpackagerelease', verbose_name='release'),
+        ),
+        migrations.RunPython(intern_releases, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='systempackage',
+            name='release',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='installations', to='proc.systempackagerelease', verbose_name='release'),
+        ),
+        migrations.AlterField(
+            model_name='pythonpackage',
+            name='release',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='installations', to='proc.pythonpackagerelease', verbose_name='release'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='systempackage',
+            unique_together={('server', 'release')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='pythonpackage',
+            unique_together={('server', 'release')},
+        ),
+        migrations.RemoveField(model_name='systempackage', name='name'),
+        migrations.RemoveField(model_name='systempackage', name='version'),
+        migrations.RemoveField(model_name='systempackage', name='source'),
+        migrations.RemoveField(model_name='systempackage', name='arch'),
+        migrations.RemoveField(model_name='pythonpackage', name='name'),
+        migrations.RemoveField(model_name='pythonpackage', name='version'),
+    ]
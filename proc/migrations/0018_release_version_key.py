@@ -0,0 +1,67 @@
+# Generated by Django 4.2.9 on 2024-03-04 10:05
+
+from django.db import migrations, models
+
+from utils.versions import get_version_key
+
+
+def set_version_keys(apps, schema_editor):
+    for model_name in ['SystemPackageRelease', 'PythonPackageRelease']:
+        model = apps.get_model('proc', model_name)
+        releases = []
+        for release in model.objects.only('pk', 'version').iterator():
+            release.version_key = get_version_key(release.version)
+            releases.append(release)
+            if len(releases) >= 1000:
+                model.objects.bulk_update(releases, ['version_key'])
+                releases = []
+        model.objects.bulk_update(releases, ['version_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proc', '0017_package_releases'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='systempackagerelease',
+            name='version_key',
+            field=models.CharField(db_collation='C', default='', editable=False, max_length=512, verbose_name='version key'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='pythonpackagerelease',
+            name='version_key',
+            field=models.CharField(db_collation='C', default='', editable=False, max_length=512, verbose_name='version key'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(set_version_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='systempackagerelease',
+            name='name',
+            field=models.CharField(max_length=128, verbose_name='name'),
+        ),
+        migrations.AlterField(
+            model_name='pythonpackagerelease',
+            name='name',
+            field=models.CharField(max_length=128, verbose_name='name'),
+        ),
+        migrations.AddIndex(
+            model_name='systempackagerelease',
+            index=models.Index(fields=['name', 'version_key'], name='proc_sysrelease_version_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='systempackagerelease',
+            index=models.Index(fields=['name'], name='proc_sysrelease_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='pythonpackagerelease',
+            index=models.Index(fields=['name', 'version_key'], name='proc_pyrelease_version_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pythonpackagerelease',
+            index=models.Index(fields=['name'], name='proc_pyrelease_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
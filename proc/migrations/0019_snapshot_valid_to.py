@@ -0,0 +1,28 @@
+# Generated by Django 4.2.9 on 2024-03-06 15:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proc', '0018_release_version_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='systeminfo',
+            name='valid_to',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='valid to'),
+        ),
+        migrations.AddField(
+            model_name='osversion',
+            name='valid_to',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='valid to'),
+        ),
+        migrations.AddField(
+            model_name='systemtime',
+            name='valid_to',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='valid to'),
+        ),
+    ]
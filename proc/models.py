@@ -1,10 +1,16 @@
+import json
 import uuid
+import hashlib
 from datetime import timedelta
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Q
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
 
+from utils.versions import get_version_key
+
 
 class TimestampedServerData(models.Model):
     id = models.UUIDField(_('ID'), default=uuid.uuid4, primary_key=True)
@@ -22,7 +28,97 @@ class TimestampedServerData(models.Model):
         get_latest_by = 'added_at'
 
 
-class SystemInfo(TimestampedServerData):
+class SnapshotQuerySet(models.QuerySet):
+    def as_of(self, when):
+        """
+        Return the snapshot of each server that was in effect at `when`.
+        """
+        latest = self.filter(
+            Q(valid_to__isnull=True) | Q(valid_to__gt=when),
+            added_at__lte=when,
+        ).order_by('server', '-added_at').distinct('server').values('pk')
+        return self.filter(pk__in=latest)
+
+
+class ServerSnapshot(TimestampedServerData):
+    """
+    Server data of which only the latest row is in effect. Saving a new row
+    marks it as the current one and retires the previous current row, so
+    there is exactly one current row per server and it can be looked up by
+    index instead of sorting the history.
+
+    Rows are stored only when their contents change, so that the history is
+    a series of changes valid from `added_at` until `valid_to`. If a new row
+    has the same contents as the current row, `volatile_fields` of the
+    current row are updated instead, and the new row refers to it. Either
+    way, `updated_at` tells when the row was last committed.
+    """
+
+    valid_to = models.DateTimeField(_('valid to'), null=True, editable=False)
+    updated_at = models.DateTimeField(_('updated at'), auto_now=True)
+
+    objects = SnapshotQuerySet.as_manager()
+
+    volatile_fields = []
+
+    class Meta(TimestampedServerData.Meta):
+        abstract = True
+        constraints = [
+            models.UniqueConstraint(
+                fields=['server'],
+                condition=Q(current=True),
+                name='%(app_label)s_%(class)s_current',
+            ),
+        ]
+
+    @property
+    def valid_from(self):
+        return self.added_at
+
+    @classmethod
+    def get_content_fields(cls):
+        return [
+            field.attname for field in cls._meta.concrete_fields
+            if field.name not in ['id', 'server', 'current', 'added_at', 'valid_to', 'updated_at'] + cls.volatile_fields
+        ]
+
+    def has_changed(self, other):
+        return any(getattr(self, name) != getattr(other, name) for name in self.get_content_fields())
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+
+        server_model = self._meta.get_field('server').related_model
+        with transaction.atomic():
+            # Lock the server to serialize concurrent commits of the same server.
+            server_model.objects.select_for_update(of=('self',)).filter(pk=self.server_id).first()
+            current = type(self).objects.filter(
+                server_id=self.server_id,
+                current=True,
+            ).first()
+            if current is not None and not self.has_changed(current):
+                for name in self.volatile_fields:
+                    setattr(current, name, getattr(self, name))
+                current.updated_at = timezone.now()
+                type(self).objects.filter(pk=current.pk).update(**{
+                    name: getattr(current, name) for name in self.volatile_fields + ['updated_at']
+                })
+                # Refer to the current row instead of adding a duplicate.
+                for field in self._meta.concrete_fields:
+                    setattr(self, field.attname, getattr(current, field.attname))
+                self._state.adding = False
+                return
+
+            self.current = True
+            if current is not None:
+                type(self).objects.filter(pk=current.pk).update(current=False)
+            super().save(*args, **kwargs)
+            if current is not None:
+                type(self).objects.filter(pk=current.pk).update(valid_to=self.added_at)
+
+
+class SystemInfo(ServerSnapshot):
     uuid = models.UUIDField(_('UUID'))
     cpu_type = models.CharField(_('CPU type'), max_length=32, blank=True, default='')
     cpu_subtype = models.CharField(_('CPU subtype'), max_length=32, blank=True, default='')
@@ -38,7 +134,7 @@ class SystemInfo(TimestampedServerData):
     hostname = models.CharField(_('hostname'), max_length=128, blank=True, default='')
     local_hostname = models.CharField(_('local hostname'), max_length=128, blank=True, default='')
 
-    class Meta(TimestampedServerData.Meta):
+    class Meta(ServerSnapshot.Meta):
         verbose_name = _('system information')
         verbose_name_plural = _('system information')
 
@@ -46,7 +142,7 @@ class SystemInfo(TimestampedServerData):
         return self.computer_name
 
 
-class OsVersion(TimestampedServerData):
+class OsVersion(ServerSnapshot):
     name = models.CharField(_('name'), max_length=32)
     version = models.CharField(_('version'), max_length=64)
     major = models.SmallIntegerField(_('major'), null=True, blank=True)
@@ -56,7 +152,7 @@ class OsVersion(TimestampedServerData):
     platform = models.CharField(_('platform'), max_length=16)
     platform_like = models.CharField(_('platform like'), max_length=16, blank=True)
 
-    class Meta(TimestampedServerData.Meta):
+    class Meta(ServerSnapshot.Meta):
         verbose_name = _('OS version')
         verbose_name_plural = _('OS versions')
 
@@ -67,13 +163,18 @@ class OsVersion(TimestampedServerData):
         }
 
 
-class SystemTime(TimestampedServerData):
+class SystemTime(ServerSnapshot):
+    # Boot times derived from clocks and uptimes in seconds may differ slightly between commits.
+    BOOT_TIME_TOLERANCE = timedelta(seconds=60)
+
     datetime = models.DateTimeField(_('datetime'))
     boot_time = models.DateTimeField(_('boot time'))
     timezone = models.CharField(_('local timezone'), max_length=16)
     uptime = models.PositiveBigIntegerField(_('uptime'))
 
-    class Meta(TimestampedServerData.Meta):
+    volatile_fields = ['datetime', 'uptime']
+
+    class Meta(ServerSnapshot.Meta):
         verbose_name = _('system time')
         verbose_name_plural = _('system times')
 
@@ -82,6 +183,12 @@ class SystemTime(TimestampedServerData):
             'time': self.datetime
         }
 
+    def has_changed(self, other):
+        return (
+            self.timezone != other.timezone
+            or abs(self.boot_time - other.boot_time) > self.BOOT_TIME_TOLERANCE
+        )
+
     def save(self, *args, **kwargs):
         if not self.boot_time:
             self.boot_time = self.datetime - timedelta(seconds=self.uptime)
@@ -105,6 +212,7 @@ class SystemUser(TimestampedServerData):
         null=True, editable=False,
         verbose_name=_('IAM user')
     )
+    updated_at = models.DateTimeField(_('updated at'), auto_now=True)
 
     class Meta(TimestampedServerData.Meta):
         verbose_name = _('system user')
@@ -133,6 +241,7 @@ class SystemGroup(TimestampedServerData):
         null=True, editable=False,
         verbose_name=_('IAM group')
     )
+    updated_at = models.DateTimeField(_('updated at'), auto_now=True)
 
     class Meta(TimestampedServerData.Meta):
         verbose_name = _('system group')
@@ -158,6 +267,7 @@ class Interface(TimestampedServerData):
     flags = models.PositiveIntegerField(_('flags'))
     mtu = models.PositiveIntegerField(_('MTU'), default=1500)
     link_speed = models.PositiveIntegerField(_('flags'), default=0)
+    updated_at = models.DateTimeField(_('updated at'), auto_now=True)
 
     class Meta(TimestampedServerData.Meta):
         verbose_name = _('interface')
@@ -195,6 +305,7 @@ class InterfaceAddress(models.Model):
     address = models.GenericIPAddressField(_('address'))
     mask = models.GenericIPAddressField(_('mask'))
     broadcast = models.GenericIPAddressField(_('broadcast'), null=True, blank=True)
+    updated_at = models.DateTimeField(_('updated at'), auto_now=True)
 
     class Meta:
         verbose_name = _('interface address')
@@ -214,19 +325,126 @@ class PythonVersion(TimestampedServerData):
         verbose_name_plural = _('python versions')
 
 
-class SystemPackage(TimestampedServerData):
+class PackageRelease(models.Model):
+    """
+    Interned package release shared by all servers that have it installed.
+    Releases are identified by the digest of `RELEASE_FIELDS`. (See `intern`.)
+    """
+
+    RELEASE_FIELDS = []
+
+    digest = models.CharField(_('digest'), max_length=64, unique=True, editable=False)
+    # Sortable form of `version` to filter version ranges with indexes. (See `utils.versions`.)
+    version_key = models.CharField(_('version key'), max_length=512, db_collation='C', editable=False)
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return '%s-%s' % (self.name, self.version)
+
+    def save(self, *args, **kwargs):
+        self.version_key = get_version_key(self.version)
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def get_digest(cls, item):
+        data = json.dumps([item.get(field, None) for field in cls.RELEASE_FIELDS], separators=(',', ':'))
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def intern(cls, items):
+        """
+        Return releases for `items`, dicts of `RELEASE_FIELDS`, keyed by
+        digest. Missing releases are created.
+        """
+        items = {cls.get_digest(item): item for item in items}
+        releases = {obj.digest: obj for obj in cls.objects.filter(digest__in=list(items))}
+        missing = [digest for digest in items if digest not in releases]
+        if missing:
+            cls.objects.bulk_create([
+                cls(
+                    digest=digest,
+                    version_key=get_version_key(items[digest].get('version', None)),
+                    **{field: items[digest].get(field, None) for field in cls.RELEASE_FIELDS}
+                ) for digest in missing
+            ], ignore_conflicts=True)
+            releases.update({obj.digest: obj for obj in cls.objects.filter(digest__in=missing)})
+        return releases
+
+
+class SystemPackageRelease(PackageRelease):
+    RELEASE_FIELDS = ['name', 'version', 'source', 'arch']
+
     name = models.CharField(_('name'), max_length=128)
     version = models.CharField(_('version'), max_length=128)
     source = models.CharField(_('source'), max_length=512, blank=True, null=True)
     arch = models.CharField(_('arch'), max_length=16, blank=True, null=True)
 
+    class Meta:
+        verbose_name = _('system package release')
+        verbose_name_plural = _('system package releases')
+        indexes = [
+            models.Index(fields=['name', 'version_key'], name='proc_sysrelease_version_idx'),
+            models.Index(fields=['name'], opclasses=['varchar_pattern_ops'], name='proc_sysrelease_prefix_idx'),
+        ]
+
+
+class PythonPackageRelease(PackageRelease):
+    RELEASE_FIELDS = ['name', 'version']
+
+    name = models.CharField(_('name'), max_length=128)
+    version = models.CharField(_('version'), max_length=64)
+
+    class Meta:
+        verbose_name = _('python package release')
+        verbose_name_plural = _('python package releases')
+        indexes = [
+            models.Index(fields=['name', 'version_key'], name='proc_pyrelease_version_idx'),
+            models.Index(fields=['name'], opclasses=['varchar_pattern_ops'], name='proc_pyrelease_prefix_idx'),
+        ]
+
+
+class InstalledPackage(TimestampedServerData):
+    """
+    A package installed on a server, which refers to an interned release
+    instead of storing its name and version on every server.
+    """
+
     class Meta(TimestampedServerData.Meta):
+        abstract = True
+        unique_together = ('server', 'release')
+
+    def __str__(self):
+        return str(self.release)
+
+    @property
+    def name(self):
+        return self.release.name
+
+    @property
+    def version(self):
+        return self.release.version
+
+
+class SystemPackage(InstalledPackage):
+    release = models.ForeignKey(
+        SystemPackageRelease, on_delete=models.PROTECT,
+        related_name='installations',
+        verbose_name=_('release')
+    )
+
+    class Meta(InstalledPackage.Meta):
         verbose_name = _('system package')
         verbose_name_plural = _('system packages')
-        unique_together = ('server', 'name', 'added_at')
 
-    def __str__(self):
-        return '%s-%s' % (self.name, self.version)
+    @property
+    def source(self):
+        return self.release.source
+
+    @property
+    def arch(self):
+        return self.release.arch
 
     def uninstall(self, requested_by):
         return self.server.execute(
@@ -235,17 +453,16 @@ class SystemPackage(TimestampedServerData):
         )
 
 
-class PythonPackage(TimestampedServerData):
-    name = models.CharField(_('name'), max_length=128)
-    version = models.CharField(_('version'), max_length=64)
+class PythonPackage(InstalledPackage):
+    release = models.ForeignKey(
+        PythonPackageRelease, on_delete=models.PROTECT,
+        related_name='installations',
+        verbose_name=_('release')
+    )
 
-    class Meta(TimestampedServerData.Meta):
+    class Meta(InstalledPackage.Meta):
         verbose_name = _('python package')
         verbose_name_plural = _('python packages')
-        unique_together = ('server', 'name', 'added_at')
-
-    def __str__(self):
-        return '%s-%s' % (self.name, self.version)
 
     def uninstall(self, requested_by):
         self.server.execute(
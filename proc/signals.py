@@ -0,0 +1,7 @@
+from django.dispatch import Signal
+
+
+# Sent after a commit of a server has changed its inventory.
+# Arguments: `server` and `changes`, a dict of `proc.utils.SyncResult` keyed
+# by section, e.g., 'packages', for sections that have any changes.
+inventory_changed = Signal()
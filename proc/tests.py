@@ -1,3 +1,217 @@
+from datetime import timedelta
+
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from django.contrib.auth import get_user_model
+
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from servers.models import Server
+from iam.models import Group
+from proc.models import OsVersion, SystemTime, SystemGroup, SystemPackage, SystemPackageRelease
+from proc.utils import sync_objects, IAMIdentityMap
+from proc.inventory import query_inventory
+
+
+User = get_user_model()
+
+
+class ServerSnapshotTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser')
+        self.server = Server.objects.create(name='testing', owner=self.user)
+
+    def test_current(self):
+        for version in ['20.04', '22.04']:
+            self.server.osversion_set.create(name='Ubuntu', version=version, platform='ubuntu')
+
+        self.assertEqual(OsVersion.objects.filter(server=self.server).count(), 2)
+        self.assertEqual(OsVersion.objects.filter(server=self.server, current=True).count(), 1)
+        self.assertEqual(self.server.os_info.version, '22.04')
+
+    def test_changes_only(self):
+        versions = [
+            self.server.osversion_set.create(name='Ubuntu', version=version, platform='ubuntu')
+            for version in ['20.04', '20.04', '22.04', '22.04']
+        ]
+        self.assertEqual(OsVersion.objects.filter(server=self.server).count(), 2)
+        self.assertEqual(versions[0].pk, versions[1].pk)
+        self.assertEqual(versions[2].pk, versions[3].pk)
+
+        previous = OsVersion.objects.get(pk=versions[0].pk)
+        self.assertEqual(previous.valid_to, versions[2].added_at)
+        self.assertEqual(OsVersion.objects.as_of(previous.added_at).get().version, '20.04')
+        self.assertEqual(OsVersion.objects.as_of(versions[2].added_at).get().version, '22.04')
+        self.assertFalse(OsVersion.objects.as_of(previous.added_at - timedelta(seconds=1)).exists())
+
+    def test_volatile_fields(self):
+        now = timezone.now()
+        first = self.server.systemtime_set.create(datetime=now, timezone='UTC', uptime=3600)
+        second = self.server.systemtime_set.create(
+            datetime=now + timedelta(seconds=30), timezone='UTC', uptime=3630,
+        )
+        self.assertEqual(first.pk, second.pk)
+
+        current = SystemTime.objects.get(pk=first.pk)
+        self.assertEqual(current.uptime, 3630)
+        self.assertEqual(current.added_at, first.added_at)
+        self.assertGreater(current.updated_at, first.updated_at)
+
+
+class SyncObjectsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser')
+        self.server = Server.objects.create(name='testing', owner=self.user)
+
+    def sync(self, groups):
+        return sync_objects(
+            self.server.systemgroup_set.all(),
+            [SystemGroup(server=self.server, gid=gid, groupname=groupname)
+             for (gid, groupname) in groups.items()],
+            key=lambda obj: obj.gid,
+            fields=['groupname'],
+        )
+
+    def test_sync(self):
+        result = self.sync({1000: 'alice', 1001: 'bob', 1002: 'carol'})
+        self.assertEqual(len(result.created), 3)
+        pks = set(self.server.systemgroup_set.values_list('pk', flat=True))
+
+        result = self.sync({1000: 'alice', 1001: 'bob', 1002: 'carol'})
+        self.assertEqual((len(result.created), len(result.updated), len(result.deleted)), (0, 0, 0))
+        self.assertEqual(set(self.server.systemgroup_set.values_list('pk', flat=True)), pks)
+
+        result = self.sync({1000: 'alicia', 1001: 'bob', 1003: 'dave'})
+        self.assertEqual([obj.gid for obj in result.created], [1003])
+        self.assertEqual([obj.gid for obj in result.updated], [1000])
+        self.assertEqual([obj.gid for obj in result.deleted], [1002])
+        self.assertEqual(
+            dict(self.server.systemgroup_set.values_list('gid', 'groupname')),
+            {1000: 'alicia', 1001: 'bob', 1003: 'dave'}
+        )
+
+    def test_updated_at(self):
+        self.sync({1000: 'alice', 1001: 'bob'})
+        before = dict(self.server.systemgroup_set.values_list('gid', 'updated_at'))
+
+        self.sync({1000: 'alicia', 1001: 'bob'})
+        after = dict(self.server.systemgroup_set.values_list('gid', 'updated_at'))
+        self.assertGreater(after[1000], before[1000])
+        self.assertEqual(after[1001], before[1001])
+
+
+class PackageReleaseTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser')
+        self.servers = [Server.objects.create(name='testing-%d' % i, owner=self.user) for i in range(2)]
+
+    def test_intern(self):
+        items = [
+            {'name': 'bash', 'version': '5.1', 'source': None, 'arch': 'amd64'},
+            {'name': 'curl', 'version': '7.81', 'source': 'curl', 'arch': 'amd64'},
+        ]
+        for server in self.servers:
+            releases = SystemPackageRelease.intern(items)
+            SystemPackage.objects.bulk_create([
+                SystemPackage(server=server, release=release) for release in releases.values()
+            ])
+
+        # Releases are shared by servers.
+        self.assertEqual(SystemPackageRelease.objects.count(), 2)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(SystemPackageRelease.intern(items)), 2)
+
+        package = self.servers[0].systempackage_set.get(release__name='curl')
+        self.assertEqual((package.name, package.version, package.source, package.arch), ('curl', '7.81', 'curl', 'amd64'))
+
+
+class PackageInventoryTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser')
+        for (i, version) in enumerate(['1.1.1f-1ubuntu2', '3.0.2-0ubuntu1', '3.0.2-0ubuntu1', '3.0.7-1']):
+            server = Server.objects.create(name='testing-%d' % i, owner=self.user)
+            releases = SystemPackageRelease.intern([
+                {'name': 'openssl', 'version': version, 'arch': 'amd64'},
+                {'name': 'openssh-server', 'version': '1:8.9p1-3', 'arch': 'amd64'},
+            ])
+            SystemPackage.objects.bulk_create([
+                SystemPackage(server=server, release=release) for release in releases.values()
+            ])
+
+    def test_versions(self):
+        rows = list(query_inventory(SystemPackage, name='openssl', version_lt='3.0.7'))
+        self.assertEqual(
+            [(row['version'], row['servers']) for row in rows],
+            [('1.1.1f-1ubuntu2', 1), ('3.0.2-0ubuntu1', 2)]
+        )
+
+    def test_group_by(self):
+        rows = list(query_inventory(SystemPackage, group_by='name', prefix='open'))
+        self.assertEqual(
+            [(row['name'], row['releases'], row['servers']) for row in rows],
+            [('openssh-server', 1, 4), ('openssl', 3, 4)]
+        )
+        rows = list(query_inventory(SystemPackage, group_by='server', name='openssl', version_gte='3.0.7'))
+        self.assertEqual([row['server_name'] for row in rows], ['testing-3'])
+
+
+class IAMIdentityMapTestCase(TestCase):
+    def setUp(self):
+        for i in range(5):
+            User.objects.create_user(username='testuser%d' % i, uid=20000 + i)
+            Group.objects.create(name='testgroup%d' % i, display_name='Test group %d' % i, gid=20000 + i)
+
+    def test_resolve(self):
+        with self.assertNumQueries(2):
+            identity_map = IAMIdentityMap(
+                users=[(20000 + i, 'testuser%d' % i) for i in range(10)],
+                groups=[(20000 + i, 'testgroup%d' % i) for i in range(10)],
+            )
+        self.assertEqual(identity_map.get_user(20001, 'testuser1').username, 'testuser1')
+        self.assertEqual(identity_map.get_group(20001, 'testgroup1').name, 'testgroup1')
+        self.assertIsNone(identity_map.get_user(20001, 'testuser2'))
+        self.assertIsNone(identity_map.get_group(20009, 'testgroup9'))
+
+
+class ServerDataAPITestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword', is_staff=True)
+        self.server = Server.objects.create(name='testing', owner=self.user)
+        self.group = Group.objects.create(name='testgroup', display_name='Test group')
+        self.client.login(username='testuser', password='testpassword')
+
+    def assertModified(self, url, update):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        update()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_in_place_update(self):
+        def sync(groupname):
+            sync_objects(
+                self.server.systemgroup_set.all(),
+                [SystemGroup(server=self.server, gid=2000, groupname=groupname, iam_group=self.group)],
+                key=lambda obj: obj.gid,
+                fields=['groupname'],
+            )
+
+        sync('testgroup')
+        response = self.assertModified(reverse('api:proc:systemgroup-list'), lambda: sync('renamed'))
+        self.assertEqual(response.data['results'][0]['groupname'], 'renamed')
 
-# Create your tests here.
+    def test_volatile_update(self):
+        now = timezone.now()
+        self.server.systemtime_set.create(datetime=now, timezone='UTC', uptime=3600)
+        self.assertModified(
+            reverse('api:proc:systemtime-list'),
+            lambda: self.server.systemtime_set.create(
+                datetime=now + timedelta(seconds=30), timezone='UTC', uptime=3630,
+            ),
+        )
+        self.assertEqual(SystemTime.objects.filter(server=self.server).count(), 1)
@@ -0,0 +1,106 @@
+import json
+import hashlib
+import logging
+from collections import namedtuple
+
+from iam.models import User, Group
+
+
+logger = logging.getLogger(__name__)
+
+
+SyncResult = namedtuple('SyncResult', ['objects', 'created', 'updated', 'deleted'])
+
+# Sections of commits that are hashed to skip unchanged ones. (See `get_section_hash`.)
+COMMIT_SECTIONS = ['users', 'groups', 'interfaces', 'addresses', 'packages', 'pypackages']
+
+
+def get_section_hash(value):
+    """
+    Return the SHA-256 hex digest of a commit section, serialized as JSON
+    with sorted keys and without whitespace. Agents can compute the same
+    hash to omit sections that the server already has.
+    """
+    data = json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def sync_objects(queryset, objects, key, fields):
+    """
+    Synchronize rows of `queryset` with `objects`, a list of unsaved model
+    instances, by comparing rows and instances with the same `key(obj)`.
+
+    - Instances without a matching row are inserted.
+    - Matching rows are updated only if any of `fields` has changed, and
+      `auto_now` fields (e.g., `updated_at`) of them are set as `save()` does.
+    - Rows without a matching instance are deleted.
+
+    Returns a `SyncResult` of which `objects` are the persisted rows in the
+    order of `objects`, and `created`, `updated` and `deleted` are changed rows.
+    Call this in a transaction.
+    """
+    model = queryset.model
+    existing = {}
+    for row in queryset.order_by('pk'):
+        existing.setdefault(key(row), []).append(row)
+
+    results = []
+    created = []
+    updated = []
+    update_fields = set()
+    for obj in objects:
+        rows = existing.get(key(obj), None)
+        if not rows:
+            created.append(obj)
+            results.append(obj)
+            continue
+        row = rows.pop(0)
+        changed = [field for field in fields if getattr(row, field) != getattr(obj, field)]
+        if changed:
+            for field in changed:
+                setattr(row, field, getattr(obj, field))
+            update_fields.update(changed)
+            updated.append(row)
+        results.append(row)
+
+    deleted = [row for rows in existing.values() for row in rows]
+    if deleted:
+        model.objects.filter(pk__in=[row.pk for row in deleted]).delete()
+    if updated:
+        for field in model._meta.concrete_fields:
+            if getattr(field, 'auto_now', False):
+                for row in updated:
+                    field.pre_save(row, False)
+                update_fields.add(field.name)
+        model.objects.bulk_update(updated, sorted(update_fields))
+    if created:
+        model.objects.bulk_create(created)
+    return SyncResult(results, created, updated, deleted)
+
+
+class IAMIdentityMap:
+    """
+    Resolve system accounts to IAM users and groups by (uid, username) and
+    (gid, name) with a query for each, instead of a query per account.
+    """
+
+    def __init__(self, users=(), groups=()):
+        """
+        `users` are (uid, username) pairs and `groups` are (gid, name) pairs to resolve.
+        """
+        self.users = {}
+        self.groups = {}
+        uids = {uid for (uid, username) in users}
+        gids = {gid for (gid, name) in groups}
+        if uids:
+            for obj in User.objects.filter(uid__in=uids):
+                self.users.setdefault((obj.uid, obj.username), obj)
+        if gids:
+            for obj in Group.objects.filter(gid__in=gids):
+                self.groups.setdefault((obj.gid, obj.name), obj)
+
+    def get_user(self, uid, username):
+        return self.users.get((uid, username), None)
+
+    def get_group(self, gid, name):
+        return self.groups.get((gid, name), None)
@@ -0,0 +1,132 @@
+import logging
+from collections import defaultdict
+
+from iam.models import User, Group
+from proc.models import SystemUser, SystemGroup
+
+
+logger = logging.getLogger(__name__)
+
+
+class AccessEvaluator:
+    """
+    Decide whether a user can access servers as (username, groupname) for many
+    servers at once. Roles of the user are loaded once, and IAM accounts,
+    system accounts and groups of servers are loaded in bulk for each batch,
+    so a batch costs a constant number of queries. Results are memoized, so
+    an evaluator attached to a request (See `for_request()`) can be shared by
+    serializers and validators handling the same request.
+
+    The rules are the same as `Server.has_access()`.
+    """
+
+    def __init__(self, user: User):
+        self.user = user
+        self._roles = None
+        self._memo = {}
+
+    @classmethod
+    def for_request(cls, request):
+        evaluator = getattr(request, '_access_evaluator', None)
+        if evaluator is None or evaluator.user.pk != request.user.pk:
+            evaluator = cls(request.user)
+            request._access_evaluator = evaluator
+        return evaluator
+
+    @property
+    def is_privileged(self):
+        return self.user.is_superuser or self.user.is_staff
+
+    @property
+    def roles(self):
+        """
+        Roles of the user for each group, keyed by group pk.
+        """
+        if self._roles is None:
+            self._roles = {
+                group_pk: role for (group_pk, role) in Group.objects.filter(
+                    membership__user__pk=self.user.pk,
+                ).values_list('pk', 'membership__role')
+            }
+        return self._roles
+
+    def has_access(self, server, username, groupname, batch=None):
+        """
+        Return whether the user has access to `server`. If `batch` is given,
+        access to all servers in `batch` is evaluated together on a miss.
+        """
+        key = (server.pk, username, groupname)
+        if key not in self._memo:
+            servers = list(batch) if batch is not None else []
+            if server not in servers:
+                servers.append(server)
+            self.evaluate([(obj, username, groupname) for obj in servers])
+        return self._memo[key]
+
+    def evaluate(self, requests):
+        """
+        Evaluate access for `requests`, an iterable of (server, username,
+        groupname) tuples, and return the results keyed by (server.pk,
+        username, groupname).
+        """
+        requests = [
+            (server, username, groupname) for (server, username, groupname) in requests
+            if (server.pk, username, groupname) not in self._memo
+        ]
+        if requests:
+            self._evaluate(requests)
+        return self._memo
+
+    def _evaluate(self, requests):
+        server_pks = {server.pk for (server, username, groupname) in requests}
+        usernames = {username for (server, username, groupname) in requests}
+        groupnames = {groupname for (server, username, groupname) in requests}
+
+        # Check if the user and group are valid, either as IAM accounts or system accounts.
+        iam_usernames = set(User.objects.filter(
+            username__in=usernames,
+        ).values_list('username', flat=True))
+        iam_groupnames = set(Group.objects.filter(
+            name__in=groupnames,
+        ).values_list('name', flat=True))
+
+        sys_users = set()
+        if usernames - iam_usernames:
+            sys_users = set(SystemUser.objects.filter(
+                server__pk__in=server_pks,
+                username__in=usernames - iam_usernames,
+            ).values_list('server_id', 'username'))
+        sys_groups = set()
+        if groupnames - iam_groupnames:
+            sys_groups = set(SystemGroup.objects.filter(
+                server__pk__in=server_pks,
+                groupname__in=groupnames - iam_groupnames,
+            ).values_list('server_id', 'groupname'))
+
+        server_groups = defaultdict(set)
+        if not self.is_privileged and self.roles:
+            for (server_pk, group_pk) in Group.objects.filter(
+                server__pk__in=server_pks,
+                pk__in=self.roles.keys(),
+            ).values_list('server', 'pk'):
+                server_groups[server_pk].add(group_pk)
+
+        for (server, username, groupname) in requests:
+            self._memo[(server.pk, username, groupname)] = (
+                (username in iam_usernames or (server.pk, username) in sys_users)
+                and (groupname in iam_groupnames or (server.pk, groupname) in sys_groups)
+                and self._has_role(server, username, server_groups[server.pk])
+            )
+
+    def _has_role(self, server, username, group_pks):
+        # Grant access if the user is a superuser, staff, or the owner.
+        if self.is_privileged or server.owner_id == self.user.pk:
+            return True
+
+        # Grant access if the user has a manager or owner role in the group.
+        roles = [self.roles[group_pk] for group_pk in group_pks]
+        if 'owner' in roles or 'manager' in roles:
+            return True
+
+        # Allow access only if it's the user's own account and not a higher privilege request, e.g., accessing root.
+        return username == self.user.username and len(roles) > 0
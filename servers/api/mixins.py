@@ -5,8 +5,11 @@ from django.utils.translation import gettext_lazy as _
 
 from rest_framework.exceptions import ValidationError
 
+from utils.api.mixins import ConditionalGetMixin
 from utils.api.viewsets import CreateListRetrieveViewSet
-from servers.models import Server
+from servers.models import Server, ServerVisibility
+from servers.provisioning import invalidate_provisioning_state
+from proc.models import SystemUser, SystemGroup
 
 
 logger = logging.getLogger(__name__)
@@ -25,12 +28,14 @@ class ServerObjectMixin:
         else:
             if not (self.request.user.is_staff or self.request.user.is_superuser):
                 queryset = queryset.filter(
-                    server__groups__membership__user__pk=self.request.user.pk
-                ).distinct()
+                    server__pk__in=ServerVisibility.get_server_pks(self.request.user)
+                )
             return queryset
 
 
-class ServerDataViewSet(ServerObjectMixin, CreateListRetrieveViewSet):
+class ServerDataViewSet(ServerObjectMixin, ConditionalGetMixin, CreateListRetrieveViewSet):
+    conditional_fields = ['added_at']
+
     def perform_create(self, serializer):
         if hasattr(self.request, 'server'):
             serializer.save(server=self.request.server)
@@ -38,10 +43,16 @@ class ServerDataViewSet(ServerObjectMixin, CreateListRetrieveViewSet):
             raise ValidationError(_('Server not identified.'))
 
 
-class ServerMultiDataViewSet(ServerObjectMixin, CreateListRetrieveViewSet):
+class ServerMultiDataViewSet(ServerObjectMixin, ConditionalGetMixin, CreateListRetrieveViewSet):
+    conditional_fields = ['added_at']
+
     def perform_create(self, serializer):
         if hasattr(self.request, 'server'):
             self.get_queryset().delete()
             serializer.save(server=self.request.server)
+            # Rows have been replaced outside commits, so the next commit should be applied in full.
+            Server.objects.filter(pk=self.request.server.pk).update(commit_hashes={})
+            if self.get_queryset().model in (SystemUser, SystemGroup):
+                invalidate_provisioning_state(self.request.server.pk)
         else:
             raise ValidationError(_('Server not identified.'))
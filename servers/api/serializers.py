@@ -1,19 +1,23 @@
 import logging
 
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from django.core.exceptions import ObjectDoesNotExist
 from django.template.loader import render_to_string
 from django.conf import settings
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Q, Exists, OuterRef
 
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from servers.models import Server, Installer, Note
-from iam.models import User, Group
+from servers.models import Server, ServerVisibility, Installer, Note
+from servers.access import AccessEvaluator
+from utils.api.serializers import SparseFieldsetsMixin
 from profiles.models import StarredServer
 from packages.models import PythonPackageEntry
 from proc.api.serializers import *
+from proc.signals import inventory_changed
+from proc.utils import COMMIT_SECTIONS, SyncResult, sync_objects, get_section_hash, IAMIdentityMap
 
 logger = logging.getLogger(__name__)
 
@@ -31,7 +35,7 @@ ALPAMON_REQUIRED_PACKAGES = [
 ]
 
 
-class ServerSerializer(serializers.ModelSerializer):
+class ServerSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     starred = serializers.SerializerMethodField()
     is_root = serializers.SerializerMethodField()
 
@@ -49,22 +53,60 @@ class ServerSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             'key': {'write_only': True, 'required': False},
         }
+        select_related_fields = {
+            'owner_name': ['owner'],
+        }
+        prefetch_related_fields = {
+            'groups': ['groups'],
+            'groups_name': ['groups'],
+        }
+        deferrable_fields = {
+            'status': ['status'],
+        }
 
     def __init__(self, instance=None, *args, **kwargs):
         self._user = kwargs.pop('user', None)
         super().__init__(instance, *args, **kwargs)
 
+    @classmethod
+    def prune_queryset(cls, queryset, request, fields=None):
+        """
+        Annotate and prefetch everything needed to serialize `fields` of
+        servers, so that the number of queries does not grow with the number
+        of servers.
+        """
+        queryset = super().prune_queryset(queryset, request, fields)
+        if fields is None:
+            fields = set(cls.Meta.fields)
+        if 'uptime' in fields:
+            fields = fields | {'boot_time'}
+
+        queryset = queryset.with_session(*fields).with_snapshots(*fields)
+        if 'starred' in fields:
+            queryset = queryset.annotate(
+                _starred=Exists(StarredServer.objects.filter(
+                    server=OuterRef('pk'),
+                    user__pk=request.user.pk,
+                )),
+            )
+        return queryset
+
     def get_starred(self, obj):
+        if hasattr(obj, '_starred'):
+            return obj._starred
         return StarredServer.objects.filter(
             server__pk=obj.pk,
             user__pk=self._user.pk,
         ).exists()
 
     def get_is_root(self, obj):
-        return obj.has_access(
-            user=self.context['request'].user,
-            username='root',
-            groupname='alpacon',
+        # Evaluate all servers of a list at once on the first row.
+        if isinstance(self.parent, serializers.ListSerializer):
+            batch = self.parent.instance
+        else:
+            batch = None
+        return AccessEvaluator.for_request(self.context['request']).has_access(
+            obj, 'root', 'alpacon', batch=batch,
         )
 
     def update(self, instance, validated_data):
@@ -204,66 +246,169 @@ class ServerMetaSerializer(serializers.ModelSerializer):
         if 'time' in self.validated_data:
             self.instance.systemtime_set.create(**self.validated_data['time'])
 
-        if 'groups' in self.validated_data and 'users' in self.validated_data:
-            self.instance.systemuser_set.all().delete()
-            self.instance.systemgroup_set.all().delete()
-
-            groups = []
-            for item in self.validated_data['groups']:
-                try:
-                    iam_group = Group.objects.get(gid=item['gid'], name=item['groupname'])
-                except ObjectDoesNotExist:
-                    iam_group = None
-                groups.append(SystemGroup(server=self.instance, iam_group=iam_group, **item))
-            SystemGroup.objects.bulk_create(groups)
-
-            users = []
-            for item in self.validated_data['users']:
-                try:
-                    iam_user = User.objects.get(uid=item['uid'], username=item['username'])
-                except:
-                    iam_user = None
-                systemgroup = None
-                for group in groups:
-                    if group.gid == item['gid']:
-                        systemgroup = group
-                        break
-                users.append(SystemUser(
-                    server=self.instance,
-                    iam_user=iam_user,
-                    group=systemgroup,
-                    **item
+        # Apply only the differences from the current rows instead of replacing all of them.
+        changes = {}
+        with transaction.atomic():
+            # Lock the server to serialize concurrent commits of the same server.
+            hashes = dict(Server.objects.select_for_update(of=('self',)).only('commit_hashes').get(
+                pk=self.instance.pk,
+            ).commit_hashes or {})
+            sections = self.get_changed_sections(hashes)
+
+            if 'groups' in sections:
+                changes['groups'] = self.sync_groups(self.validated_data['groups'])
+            if 'users' in sections:
+                changes['users'] = self.sync_users(self.validated_data['users'])
+            elif 'groups' in changes:
+                changes['users'] = self.relink_user_groups()
+
+            if 'interfaces' in sections:
+                changes['interfaces'] = self.sync_interfaces(self.validated_data['interfaces'])
+            if 'addresses' in sections:
+                changes['addresses'] = self.sync_addresses(self.validated_data['addresses'])
+
+            if 'packages' in sections:
+                changes['packages'] = self.sync_packages(SystemPackage, self.validated_data['packages'])
+            if 'pypackages' in sections:
+                changes['pypackages'] = self.sync_packages(PythonPackage, self.validated_data['pypackages'])
+
+            if sections:
+                self.instance.commit_hashes = hashes
+                Server.objects.filter(pk=self.instance.pk).update(commit_hashes=hashes)
+
+            changes = {
+                section: result for (section, result) in changes.items()
+                if result.created or result.updated or result.deleted
+            }
+            if changes:
+                logger.debug('Inventory of server %s changed: %s', self.instance.pk, ', '.join(
+                    '%s (+%d ~%d -%d)' % (section, len(result.created), len(result.updated), len(result.deleted))
+                    for (section, result) in changes.items()
                 ))
-            SystemUser.objects.bulk_create(users)
-
-        if 'interfaces' in self.validated_data and 'addresses' in self.validated_data:
-            self.instance.interface_set.all().delete()
-            interfaces = Interface.objects.bulk_create(
-                [Interface(server=self.instance, **item) for item in self.validated_data['interfaces']]
-            )
-            interface_map = {}
-            for obj in interfaces:
-                interface_map[obj.name] = obj
-            InterfaceAddress.objects.bulk_create(
-                [InterfaceAddress(
-                    interface=interface_map[item['interface_name']],
-                    address=item['address'],
-                    mask=item['mask'],
-                    broadcast=item['broadcast'],
-                ) for item in self.validated_data['addresses']]
+                server = self.instance
+                transaction.on_commit(lambda: inventory_changed.send(
+                    sender=Server, server=server, changes=changes,
+                ))
+        self.changes = changes
+
+    def get_changed_sections(self, hashes):
+        """
+        Return the sections of which contents differ from the last commit,
+        and update `hashes` with hashes of the sections.
+        """
+        sections = set()
+        for section in COMMIT_SECTIONS:
+            if section not in self.validated_data:
+                continue
+            value = get_section_hash(self.initial_data[section])
+            if hashes.get(section, None) != value:
+                hashes[section] = value
+                sections.add(section)
+        return sections
+
+    @staticmethod
+    def get_item(item):
+        # Rows are matched by their natural keys, so IDs sent by clients are ignored.
+        return {key: value for (key, value) in item.items() if key != 'id'}
+
+    def get_identity_map(self):
+        if not hasattr(self, '_identity_map'):
+            self._identity_map = IAMIdentityMap(
+                users=[(item['uid'], item['username']) for item in self.validated_data.get('users', [])],
+                groups=[(item['gid'], item['groupname']) for item in self.validated_data.get('groups', [])],
             )
+        return self._identity_map
+
+    def sync_groups(self, items):
+        identity_map = self.get_identity_map()
+        groups = [
+            SystemGroup(
+                server=self.instance,
+                iam_group=identity_map.get_group(item['gid'], item['groupname']),
+                **self.get_item(item)
+            ) for item in items
+        ]
+        return sync_objects(
+            self.instance.systemgroup_set.all(), groups,
+            key=lambda obj: obj.gid,
+            fields=['groupname', 'iam_group_id'],
+        )
 
-        if 'packages' in self.validated_data:
-            self.instance.systempackage_set.all().delete()
-            SystemPackage.objects.bulk_create(
-                [SystemPackage(server=self.instance, **item) for item in self.validated_data['packages']]
-            )
+    def get_group_map(self):
+        group_map = {}
+        for group in self.instance.systemgroup_set.order_by('pk'):
+            group_map.setdefault(group.gid, group)
+        return group_map
+
+    def sync_users(self, items):
+        group_map = self.get_group_map()
+        identity_map = self.get_identity_map()
+        users = [
+            SystemUser(
+                server=self.instance,
+                iam_user=identity_map.get_user(item['uid'], item['username']),
+                group=group_map.get(item['gid'], None),
+                **self.get_item(item)
+            ) for item in items
+        ]
+        return sync_objects(
+            self.instance.systemuser_set.all(), users,
+            key=lambda obj: (obj.uid, obj.username),
+            fields=['gid', 'description', 'directory', 'shell', 'group_id', 'iam_user_id'],
+        )
 
-        if 'pypackages' in self.validated_data:
-            self.instance.pythonpackage_set.all().delete()
-            PythonPackage.objects.bulk_create(
-                [PythonPackage(server=self.instance, **item) for item in self.validated_data['pypackages']]
-            )
+    def relink_user_groups(self):
+        # Users are not changed, but their primary groups may have been added or removed.
+        group_map = self.get_group_map()
+        users = list(self.instance.systemuser_set.all())
+        updated = []
+        for user in users:
+            group = group_map.get(user.gid, None)
+            if user.group_id != (group.pk if group else None):
+                user.group = group
+                user.updated_at = timezone.now()
+                updated.append(user)
+        if updated:
+            SystemUser.objects.bulk_update(updated, ['group', 'updated_at'])
+        return SyncResult(users, [], updated, [])
+
+    def sync_packages(self, model, items):
+        # Packages refer to interned releases, so an upgrade replaces the row of the old release.
+        releases = model._meta.get_field('release').related_model.intern(items)
+        return sync_objects(
+            model.objects.filter(server=self.instance).select_related('release'),
+            [model(server=self.instance, release=release) for release in releases.values()],
+            key=lambda obj: obj.release_id,
+            fields=[],
+        )
+
+    def sync_interfaces(self, items):
+        return sync_objects(
+            self.instance.interface_set.all(),
+            [Interface(server=self.instance, **self.get_item(item)) for item in items],
+            key=lambda obj: obj.name,
+            fields=['mac', 'type', 'flags', 'mtu', 'link_speed'],
+        )
+
+    def sync_addresses(self, items):
+        interface_map = {obj.name: obj for obj in self.instance.interface_set.all()}
+        addresses = []
+        for item in items:
+            interface = interface_map.get(item['interface_name'], None)
+            if interface is None:
+                logger.warning('Ignored address %s of unknown interface %s.', item['address'], item['interface_name'])
+                continue
+            addresses.append(InterfaceAddress(
+                interface=interface,
+                address=item['address'],
+                mask=item['mask'],
+                broadcast=item['broadcast'],
+            ))
+        return sync_objects(
+            InterfaceAddress.objects.filter(interface__server=self.instance), addresses,
+            key=lambda obj: (obj.interface_id, obj.address),
+            fields=['mask', 'broadcast'],
+        )
 
 
 class ServerActionSerializer(serializers.Serializer):
@@ -352,9 +497,9 @@ class RelatedServerField(serializers.PrimaryKeyRelatedField):
             return Server.objects.all()
         else:
             return Server.objects.filter(
-                Q(groups__membership__user__pk=self.context['request'].user.pk)
+                Q(pk__in=ServerVisibility.get_server_pks(self.context['request'].user))
                 | Q(owner__pk=self.context['request'].user.pk)
-            ).distinct()
+            )
 
 
 class InstallerSerializer(serializers.ModelSerializer):
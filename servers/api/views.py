@@ -1,27 +1,38 @@
 import logging
 
+from django.conf import settings
 from django.http.response import FileResponse
-from django.db.models import Q
+from django.db.models import Q, Max, Count
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.utils.translation import gettext_lazy as _
 from django.core.exceptions import ObjectDoesNotExist
 
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, PermissionDenied
 from rest_framework.response import Response
 from rest_framework.generics import RetrieveAPIView
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.authentication import SessionAuthentication
 
 from api.apitoken.auth import APITokenAuthentication
+from utils.api.mixins import ConditionalGetMixin, SparseFieldsetsMixin
+from utils.watchdog import get_shard_stats
 
-from servers.models import Server, Installer, Note
+from servers.models import Server, ServerVisibility, Installer, Note
 from servers.api.serializers import (
     ServerSerializer, ServerListSerializer, ServerCreateSerializer,
     ServerMetaSerializer, ServerActionSerializer, ServerStarStatusSerializer,
     InstallerSerializer, NoteSerializer, NoteCreateSerializer
 )
 from servers.api.permissions import ServerObjectPermission, NoteObjectPermission
+from servers.overview import get_fleet_overview
+from servers.ingest import enqueue_commit, get_commit_stats
+from servers.tasks import apply_pending_commit
 from events.api.serializers import CommandSerializer
+from iam.models import Membership
+from profiles.models import StarredServer
 from proc.api.serializers import (
     SystemInfoSerializer, OsVersionSerializer, SystemTimeSerializer,
     SystemUserSerializer, SystemGroupSerializer, InterfaceSerializer, SystemPackageSerializer
@@ -30,8 +41,11 @@ from proc.api.serializers import (
 
 logger = logging.getLogger(__name__)
 
+# Sharded watchdogs of servers and their sessions. (See `servers.tasks` and `wsutils.tasks`.)
+WATCHDOG_NAMES = ['ping_servers', 'debug_servers', 'check_server_status', 'clear_stale_sessions']
 
-class ServerViewSet(viewsets.ModelViewSet):
+
+class ServerViewSet(SparseFieldsetsMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Server.objects.all()
     serializer_class = ServerSerializer
     filterset_fields = ['name', 'version', 'enabled', 'commissioned', 'owner', 'groups']
@@ -41,6 +55,10 @@ class ServerViewSet(viewsets.ModelViewSet):
     ]
     ordering_fields = ['name', 'commissioned', 'version', 'osquery_version', 'load', 'started_at', 'owner']
     ordering = ['name']
+    conditional_fields = [
+        'updated_at', 'session__updated_at', 'owner__updated_at', 'groups__updated_at',
+        'systeminfo__updated_at', 'osversion__updated_at', 'systemtime__added_at',
+    ]
 
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -49,8 +67,8 @@ class ServerViewSet(viewsets.ModelViewSet):
         else:
             if not (self.request.user.is_staff or self.request.user.is_superuser):
                 queryset = queryset.filter(
-                    groups__membership__user__pk=self.request.user.pk
-                ).distinct()
+                    pk__in=ServerVisibility.get_server_pks(self.request.user)
+                )
 
             if self.request.query_params.get('starred', None) == 'true':
                 return queryset.filter(
@@ -63,6 +81,33 @@ class ServerViewSet(viewsets.ModelViewSet):
             else:
                 return queryset
 
+    def is_conditional(self, request):
+        # `uptime` is derived from the wall clock, so representations with it are not validated.
+        # Clients that revalidate servers should omit it and compute it from `boot_time`.
+        fields = self.get_requested_fields()
+        if fields is None:
+            fields = self.get_serializer_class().Meta.fields
+        return 'uptime' not in fields
+
+    def get_conditional_dependencies(self, request):
+        # Visibility, `is_root` and `starred` depend on the requesting user.
+        if hasattr(request, 'client'):
+            return []
+        user = request.user
+        memberships = Membership.objects.filter(user__pk=user.pk).aggregate(
+            updated_at=Max('updated_at'),
+            count=Count('pk'),
+        )
+        return [
+            user.is_staff,
+            user.is_superuser,
+            memberships['updated_at'],
+            memberships['count'],
+            list(StarredServer.objects.filter(
+                user__pk=user.pk,
+            ).order_by('server').values_list('server', 'ordering')),
+        ]
+
     def get_object(self):
         if self.kwargs['pk'] == '-' and hasattr(self.request, 'client'):
             return Server.objects.get(pk=self.request.client.pk)
@@ -107,11 +152,59 @@ class ServerViewSet(viewsets.ModelViewSet):
             return Response(data={
                 'non_field_errors': [_('This action is only for alpamon.')]
             }, status=status.HTTP_400_BAD_REQUEST)
+        if settings.ASYNC_COMMIT:
+            server = self.get_object()
+            if enqueue_commit(server, request.data):
+                apply_pending_commit.delay(str(server.pk))
+            return Response(status=status.HTTP_202_ACCEPTED)
         serializer = self.get_serializer(instance=self.get_object(), data=request.data)
         serializer.is_valid(raise_exception=True)
         serializer.save()
         return Response(status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=['get'], url_path='commit-stats')
+    def commit_stats(self, request):
+        if not (request.user.is_staff or request.user.is_superuser):
+            raise PermissionDenied
+        try:
+            minutes = min(max(int(request.query_params.get('minutes', 5)), 1), 60)
+        except ValueError:
+            return Response(data={
+                'minutes': [_('A valid integer is required.')]
+            }, status=status.HTTP_400_BAD_REQUEST)
+        return Response(data=get_commit_stats(minutes), status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], url_path='watchdog-stats')
+    def watchdog_stats(self, request):
+        if not (request.user.is_staff or request.user.is_superuser):
+            raise PermissionDenied
+        return Response(data={
+            name: get_shard_stats(name) for name in WATCHDOG_NAMES
+        }, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def overview(self, request):
+        if hasattr(request, 'client'):
+            scope = 'client-%s' % request.client.pk
+        elif request.user.is_staff or request.user.is_superuser:
+            scope = 'staff'
+        else:
+            scope = 'user-%s' % request.user.pk
+        if request.query_params.get('starred', None) in ['true', 'false']:
+            scope += '-starred-%s' % request.query_params['starred']
+
+        try:
+            top = min(max(int(request.query_params.get('top', 5)), 0), 50)
+        except ValueError:
+            return Response(data={
+                'top': [_('A valid integer is required.')]
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(
+            data=get_fleet_overview(self.get_queryset(), scope, top=top),
+            status=status.HTTP_200_OK
+        )
+
     @action(detail=True, methods=['post'], serializer_class=ServerActionSerializer)
     def actions(self, request, pk=None):
         serializer = self.get_serializer(instance=self.get_object(), data=request.data)
@@ -147,61 +240,95 @@ class ServerViewSet(viewsets.ModelViewSet):
             )
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    def get_snapshot_response(self, request, queryset):
+        """
+        Return the current snapshot, or the one in effect at `?as_of=<datetime>`.
+        """
+        if 'as_of' in request.query_params:
+            try:
+                as_of = parse_datetime(request.query_params['as_of'])
+            except ValueError:
+                as_of = None
+            if as_of is None:
+                return Response(data={
+                    'as_of': [_('A valid datetime is required.')]
+                }, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(as_of):
+                as_of = timezone.make_aware(as_of)
+            queryset = queryset.as_of(as_of)
+        else:
+            queryset = queryset.filter(current=True)
+        response = self.get_conditional_response(request, queryset, fields=['updated_at', 'valid_to'])
+        if response is not None:
+            return response
+        instance = queryset.first()
+        if instance is None:
+            raise NotFound
+        serializer = self.get_serializer(instance=instance)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
     @action(detail=True, methods=['get'], serializer_class=SystemInfoSerializer)
     def info(self, request, pk=None):
-        serializer = self.get_serializer(
-            instance=self.get_object().systeminfo_set.latest()
-        )
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self.get_snapshot_response(request, self.get_object().systeminfo_set.all())
 
     @action(detail=True, methods=['get'], serializer_class=OsVersionSerializer)
     def os(self, request, pk=None):
-        serializer = self.get_serializer(
-            instance=self.get_object().osversion_set.latest()
-        )
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self.get_snapshot_response(request, self.get_object().osversion_set.all())
 
     @action(detail=True, methods=['get'], serializer_class=SystemTimeSerializer)
     def time(self, request, pk=None):
-        serializer = self.get_serializer(
-            instance=self.get_object().systemtime_set.latest()
-        )
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self.get_snapshot_response(request, self.get_object().systemtime_set.all())
 
     @action(detail=True, methods=['get'], serializer_class=SystemUserSerializer)
     def users(self, request, pk=None):
+        queryset = self.get_object().systemuser_set.filter(
+            iam_user__isnull=False
+        ).order_by('uid')
+        response = self.get_conditional_response(request, queryset, fields=['updated_at'])
+        if response is not None:
+            return response
         serializer = self.get_serializer(
-            instance=self.get_object().systemuser_set.filter(
-                iam_user__isnull=False
-            ).order_by('uid'),
+            instance=queryset,
             many=True,
         )
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['get'], serializer_class=SystemGroupSerializer)
     def groups(self, request, pk=None):
+        queryset = self.get_object().systemgroup_set.filter(
+            iam_group__isnull=False,
+        ).order_by('gid')
+        response = self.get_conditional_response(request, queryset, fields=['updated_at'])
+        if response is not None:
+            return response
         serializer = self.get_serializer(
-            instance=self.get_object().systemgroup_set.filter(
-                iam_group__isnull=False,
-            ).order_by('gid'),
+            instance=queryset,
             many=True,
         )
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['get'], serializer_class=InterfaceSerializer)
     def interfaces(self, request, pk=None):
+        queryset = self.get_object().interface_set.exclude(
+            address__isnull=True
+        ).order_by('name')
+        response = self.get_conditional_response(request, queryset, fields=['updated_at', 'address__updated_at'])
+        if response is not None:
+            return response
         serializer = self.get_serializer(
-            instance=self.get_object().interface_set.exclude(
-                address__isnull=True
-            ).order_by('name'),
+            instance=queryset,
             many=True,
         )
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['get'], serializer_class=SystemPackageSerializer)
     def packages(self, request, pk=None):
+        queryset = self.get_object().systempackage_set.select_related('release').order_by('release__name')
+        response = self.get_conditional_response(request, queryset, fields=['added_at'])
+        if response is not None:
+            return response
         serializer = self.get_serializer(
-            instance=self.get_object().systempackage_set.all(),
+            instance=queryset,
             many=True,
         )
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -221,7 +348,7 @@ class RetrieveInstallerView(RetrieveAPIView):
         )
 
 
-class NoteViewSet(viewsets.ModelViewSet):
+class NoteViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Note.objects.all()
     serializer_class = NoteSerializer
     authentication_classes = [SessionAuthentication, APITokenAuthentication]
@@ -241,9 +368,9 @@ class NoteViewSet(viewsets.ModelViewSet):
         )
         if not (self.request.user.is_staff or self.request.user.is_superuser):
             queryset = queryset.filter(
-                Q(server__groups__membership__user__pk=self.request.user.pk)
+                Q(server__pk__in=ServerVisibility.get_server_pks(self.request.user))
                 | Q(server__owner__pk=self.request.user.pk)
-            ).distinct()
+            )
         return queryset
 
     def get_serializer_class(self):
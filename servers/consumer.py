@@ -1,19 +1,57 @@
 import logging
 
+from channels.db import database_sync_to_async
+
 from wsutils.consumer import APIClientAsyncConsumer
+from servers.models import Server
+from websh.multiplex import StreamMultiplexer
 
 
 logger = logging.getLogger(__name__)
 
 
 class BackhaulConsumer(APIClientAsyncConsumer):
+    @database_sync_to_async
+    def get_commit_hashes(self):
+        return Server.objects.filter(
+            pk=self.scope['wsclient'].pk,
+        ).values_list('commit_hashes', flat=True).first() or {}
+
     async def connect(self):
         if await super().connect():
+            # Agents may omit sections of which hashes are the same as these.
             await self.send_json({
-                'query': 'commit'
+                'query': 'commit',
+                'hashes': await self.get_commit_hashes(),
             })
         else:
             await self.send_json({
                 'query': 'quit',
                 'reason': 'Permission denied. Please check your id and key again.'
             })
+
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        # Binary frames carry websh PTY streams. (See `websh.multiplex`.)
+        if bytes_data is not None:
+            if not hasattr(self, 'session'):
+                return await self.close(code=400)
+            if not hasattr(self, 'multiplexer'):
+                self.multiplexer = StreamMultiplexer(self)
+            return await self.multiplexer.receive(bytes_data)
+        return await super().receive(text_data=text_data, bytes_data=bytes_data, **kwargs)
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'multiplexer'):
+            await self.multiplexer.close_all()
+        await super().disconnect(close_code)
+
+    async def user_message(self, event):
+        if hasattr(self, 'multiplexer'):
+            await self.multiplexer.user_message(event)
+
+    async def leave_message(self, event):
+        if hasattr(self, 'multiplexer'):
+            await self.multiplexer.leave_message(event)
+
+    async def pty_message(self, event):
+        pass
@@ -0,0 +1,195 @@
+import json
+import zlib
+import logging
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction, IntegrityError
+from django.db.models import F, Count, Min
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.serializers import ListSerializer, Serializer
+
+from servers.models import PendingCommit
+from servers.api.serializers import ServerMetaSerializer
+
+
+logger = logging.getLogger(__name__)
+
+STATS_KEY = 'servers:commit:%(name)s:%(minute)d'
+STATS_TIMEOUT = 60*60
+LOCK_KEY = 'servers:commit:lock:%s'
+LOCK_TIMEOUT = 5*60
+
+# Pending commits older than this are dispatched again. (See `servers.tasks.apply_pending_commits`.)
+STALE_COMMIT_PERIOD = timedelta(minutes=1)
+
+
+def incr_stats(name, value=1):
+    key = STATS_KEY % {
+        'name': name,
+        'minute': int(timezone.now().timestamp()) // 60,
+    }
+    if not cache.add(key, value, STATS_TIMEOUT):
+        cache.incr(key, value)
+
+
+def get_commit_stats(minutes=5):
+    """
+    Return the backlog, throughput (per second) and lag (in seconds) of
+    commit ingestion for the last `minutes`.
+    """
+    current = int(timezone.now().timestamp()) // 60
+    names = ['received', 'coalesced', 'applied', 'failed', 'lag_ms']
+    keys = {
+        STATS_KEY % {'name': name, 'minute': minute}: name
+        for name in names for minute in range(current - minutes + 1, current + 1)
+    }
+    totals = dict.fromkeys(names, 0)
+    for (key, value) in cache.get_many(list(keys)).items():
+        totals[keys[key]] += value
+
+    pending = PendingCommit.objects.aggregate(count=Count('pk'), oldest=Min('first_received_at'))
+    period = minutes * 60
+    return {
+        'pending': pending['count'],
+        'oldest_pending_at': pending['oldest'],
+        'received': totals['received'] / period,
+        'coalesced': totals['coalesced'] / period,
+        'applied': totals['applied'] / period,
+        'failed': totals['failed'] / period,
+        'lag': totals['lag_ms'] / totals['applied'] / 1000 if totals['applied'] else None,
+        'period': period,
+    }
+
+
+def validate_payload(data):
+    """
+    Check only the shape of a commit. Values are validated when the commit is applied.
+    """
+    if not isinstance(data, dict):
+        raise ValidationError({
+            'non_field_errors': [_('Invalid data. Expected a dictionary.')]
+        })
+    errors = {}
+    for (name, field) in ServerMetaSerializer().fields.items():
+        if name not in data:
+            continue
+        if isinstance(field, ListSerializer) and not isinstance(data[name], list):
+            errors[name] = [_('Expected a list of items.')]
+        elif isinstance(field, Serializer) and not isinstance(data[name], dict):
+            errors[name] = [_('Invalid data. Expected a dictionary.')]
+    if errors:
+        raise ValidationError(errors)
+
+
+def enqueue_commit(server, data):
+    """
+    Validate and store a commit of `server` to be applied later. If the
+    server has a pending commit, it is replaced with this one.
+    Returns True if a new pending commit has been created, which needs to be
+    dispatched, or False if it has been coalesced into the pending one.
+    """
+    validate_payload(data)
+    payload = zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+    now = timezone.now()
+    incr_stats('received')
+
+    with transaction.atomic():
+        if PendingCommit.objects.filter(server__pk=server.pk).update(
+            payload=payload,
+            received_at=now,
+            coalesced=F('coalesced') + 1,
+            failed_at=None,
+            error='',
+        ):
+            incr_stats('coalesced')
+            return False
+        try:
+            with transaction.atomic():
+                PendingCommit.objects.create(
+                    server=server,
+                    payload=payload,
+                    received_at=now,
+                    first_received_at=now,
+                )
+            return True
+        except IntegrityError:
+            # Created by a concurrent request in the meantime.
+            PendingCommit.objects.filter(server__pk=server.pk).update(
+                payload=payload,
+                received_at=now,
+                coalesced=F('coalesced') + 1,
+                failed_at=None,
+                error='',
+            )
+            incr_stats('coalesced')
+            return False
+
+
+def apply_commit(server_pk):
+    """
+    Apply the pending commit of a server. Returns True if a commit has been
+    applied, False if there was none or it has failed, or None if another
+    commit of the server is being applied, in which case it should be retried.
+
+    The pending commit is deleted in the same transaction as it is applied,
+    so that it is kept for `apply_pending_commits` if anything goes wrong.
+    Invalid commits are marked as failed and are not retried until the
+    server sends a new one.
+    """
+    lock_key = LOCK_KEY % server_pk
+    if not cache.add(lock_key, timezone.now(), LOCK_TIMEOUT):
+        return None
+
+    pending = None
+    try:
+        with transaction.atomic():
+            pending = PendingCommit.objects.select_for_update().select_related('server').filter(
+                server__pk=server_pk,
+                failed_at__isnull=True,
+            ).first()
+            if pending is None:
+                return False
+
+            data = json.loads(zlib.decompress(bytes(pending.payload)).decode('utf-8'))
+            serializer = ServerMetaSerializer(instance=pending.server, data=data)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            PendingCommit.objects.filter(
+                server__pk=server_pk,
+                received_at=pending.received_at,
+            ).delete()
+    except (ValidationError, ValueError, zlib.error) as e:
+        logger.warning('Invalid commit of server %s: %s', server_pk, e)
+        PendingCommit.objects.filter(
+            server__pk=server_pk,
+            received_at=pending.received_at,
+        ).update(failed_at=timezone.now(), error=str(e)[:1024])
+        incr_stats('failed')
+        return False
+    except Exception as e:
+        # Left pending to be retried.
+        logger.exception(e)
+        incr_stats('failed')
+        return False
+    finally:
+        cache.delete(lock_key)
+
+    lag = timezone.now() - pending.first_received_at
+    incr_stats('applied')
+    incr_stats('lag_ms', int(lag.total_seconds() * 1000))
+    logger.debug(
+        'Applied commit of server %s (%d coalesced, %.3fs lag).',
+        server_pk, pending.coalesced, lag.total_seconds()
+    )
+    return True
+
+
+def get_stale_commits():
+    return PendingCommit.objects.filter(
+        first_received_at__lt=timezone.now() - STALE_COMMIT_PERIOD,
+        failed_at__isnull=True,
+    ).values_list('server', flat=True)
@@ -0,0 +1,134 @@
+import time
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from proc.models import SystemPackage, PythonPackage
+from servers.models import Server
+from servers.api.serializers import ServerMetaSerializer
+
+
+User = get_user_model()
+
+
+def legacy_save(server, serializer):
+    """
+    Previous implementation of package ingestion: all rows are deleted and inserted again.
+    """
+    validated_data = serializer.validated_data
+    for (model, section) in ((SystemPackage, 'packages'), (PythonPackage, 'pypackages')):
+        releases = model._meta.get_field('release').related_model.intern(validated_data[section])
+        model.objects.filter(server=server).delete()
+        model.objects.bulk_create([model(server=server, release=release) for release in releases.values()])
+
+
+def diff_save(server, serializer):
+    serializer.save()
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark package ingestion of commits for unchanged, small-change and full-change '
+        'inventories, reporting time and WAL bytes. '
+        'All data is created in a transaction and rolled back at the end.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--packages', type=int, default=3000, help='Number of system packages.')
+        parser.add_argument('--pypackages', type=int, default=300, help='Number of python packages.')
+        parser.add_argument('--small-ratio', type=float, default=0.01, help='Ratio of changed packages.')
+        parser.add_argument('--rounds', type=int, default=5, help='Number of commits per scenario.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('WAL statistics are available only on PostgreSQL.')
+
+        with transaction.atomic():
+            owner = User.objects.create_user(username='benchmark-%d' % int(time.time()))
+            server = Server.objects.create(name='bench-commit', owner=owner, commissioned=True)
+            base = self.make_inventory(options['packages'], options['pypackages'])
+
+            for (name, func) in (
+                ('legacy', legacy_save),
+                ('diff', diff_save),
+            ):
+                self.restore(server, base)
+                for (scenario, ratio) in (
+                    ('unchanged', 0),
+                    ('small-change', options['small_ratio']),
+                    ('full-change', 1),
+                ):
+                    elapsed = 0
+                    wal_bytes = 0
+                    num_queries = 0
+                    for i in range(options['rounds']):
+                        serializer = self.validate(server, self.change_inventory(base, ratio, i))
+                        start_lsn = self.get_wal_lsn()
+                        with CaptureQueriesContext(connection) as queries:
+                            started = time.perf_counter()
+                            func(server, serializer)
+                            elapsed += time.perf_counter() - started
+                        wal_bytes += self.get_wal_bytes(start_lsn)
+                        num_queries += len(queries)
+                        if ratio:
+                            self.restore(server, base)
+                    self.stdout.write(
+                        '%(name)-8s %(scenario)-13s %(elapsed)8.2fms/commit %(wal)10.1fKiB WAL/commit '
+                        '%(queries)6.1f queries/commit' % {
+                            'name': name,
+                            'scenario': scenario,
+                            'elapsed': elapsed * 1000 / options['rounds'],
+                            'wal': wal_bytes / 1024 / options['rounds'],
+                            'queries': num_queries / options['rounds'],
+                        }
+                    )
+            transaction.set_rollback(True)
+
+    def make_inventory(self, packages, pypackages):
+        return {
+            'packages': [{
+                'name': 'package-%05d' % i,
+                'version': '1.%d.%d' % (random.randint(0, 20), random.randint(0, 100)),
+                'source': 'package-%05d' % i,
+                'arch': 'amd64',
+            } for i in range(packages)],
+            'pypackages': [{
+                'name': 'pypackage-%04d' % i,
+                'version': '2.%d.%d' % (random.randint(0, 20), random.randint(0, 100)),
+            } for i in range(pypackages)],
+        }
+
+    def change_inventory(self, base, ratio, seed):
+        rand = random.Random(seed)
+        data = {}
+        for (section, items) in base.items():
+            data[section] = []
+            for item in items:
+                item = dict(item)
+                if ratio and rand.random() < ratio:
+                    item['version'] += '-%d' % (seed + 1)
+                data[section].append(item)
+        return data
+
+    def validate(self, server, data):
+        serializer = ServerMetaSerializer(instance=server, data=data)
+        serializer.is_valid(raise_exception=True)
+        return serializer
+
+    def restore(self, server, base):
+        # Restore the base inventory and forget section hashes, so that the next commit is compared with it.
+        legacy_save(server, self.validate(server, base))
+        Server.objects.filter(pk=server.pk).update(commit_hashes={})
+
+    def get_wal_lsn(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_current_wal_insert_lsn()')
+            return cursor.fetchone()[0]
+
+    def get_wal_bytes(self, start_lsn):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_wal_lsn_diff(pg_current_wal_insert_lsn(), %s)', [start_lsn])
+            return int(cursor.fetchone()[0])
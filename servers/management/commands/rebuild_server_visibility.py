@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from servers.models import Server, ServerVisibility
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized server visibility of users from memberships.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of servers to rebuild in a transaction.',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        pks = list(Server.objects.order_by('pk').values_list('pk', flat=True))
+        for i in range(0, len(pks), batch_size):
+            ServerVisibility.refresh(servers=pks[i:i + batch_size])
+        # Remove rows of servers that no longer exist, if any.
+        ServerVisibility.objects.exclude(server__pk__in=pks).delete()
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt visibility of %d servers (%d rows).' % (len(pks), ServerVisibility.objects.count())
+        ))
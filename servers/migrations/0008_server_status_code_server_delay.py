@@ -0,0 +1,34 @@
+# Generated by Django 4.2.9 on 2024-02-13 10:21
+
+from django.db import migrations, models
+
+
+def backfill_status(apps, schema_editor):
+    Server = apps.get_model('servers', 'Server')
+    for server in Server.objects.filter(status__isnull=False).only('pk', 'status').iterator():
+        status = server.status or {}
+        Server.objects.filter(pk=server.pk).update(
+            status_code=status.get('code', None),
+            delay=status.get('meta', {}).get('delay_now', None),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('servers', '0007_alter_server_groups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='server',
+            name='status_code',
+            field=models.CharField(db_index=True, editable=False, max_length=8, null=True, verbose_name='status code'),
+        ),
+        migrations.AddField(
+            model_name='server',
+            name='delay',
+            field=models.FloatField(db_index=True, editable=False, null=True, verbose_name='response delay'),
+        ),
+        migrations.RunPython(backfill_status, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 4.2.9 on 2024-02-20 09:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+ROLE_RANKS = {
+    'member': 0,
+    'manager': 1,
+    'owner': 2,
+}
+
+
+def populate_visibility(apps, schema_editor):
+    Membership = apps.get_model('iam', 'Membership')
+    ServerVisibility = apps.get_model('servers', 'ServerVisibility')
+
+    roles = {}
+    memberships = Membership.objects.filter(
+        deleted_at__isnull=True,
+        group__deleted_at__isnull=True,
+        user__deleted_at__isnull=True,
+        group__server__isnull=False,
+    ).values_list('user', 'group__server', 'role')
+    for (user_pk, server_pk, role) in memberships.iterator():
+        key = (user_pk, server_pk)
+        if key not in roles or ROLE_RANKS[role] > ROLE_RANKS[roles[key]]:
+            roles[key] = role
+
+    ServerVisibility.objects.bulk_create([
+        ServerVisibility(user_id=user_pk, server_id=server_pk, role=role)
+        for ((user_pk, server_pk), role) in roles.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('iam', '0004_user_phone'),
+        ('servers', '0008_server_status_code_server_delay'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServerVisibility',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('member', 'Member'), ('manager', 'Manager'), ('owner', 'Owner')], max_length=16, verbose_name='role')),
+                ('server', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='visibilities', to='servers.server', verbose_name='server')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+            options={
+                'verbose_name': 'server visibility',
+                'verbose_name_plural': 'server visibilities',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='servervisibility',
+            constraint=models.UniqueConstraint(fields=('user', 'server'), name='servers_visibility_user_server'),
+        ),
+        migrations.RunPython(populate_visibility, migrations.RunPython.noop),
+    ]
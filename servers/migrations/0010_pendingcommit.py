@@ -0,0 +1,28 @@
+# Generated by Django 4.2.9 on 2024-02-22 14:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('servers', '0009_servervisibility'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingCommit',
+            fields=[
+                ('server', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='pending_commit', serialize=False, to='servers.server', verbose_name='server')),
+                ('payload', models.BinaryField(verbose_name='payload')),
+                ('received_at', models.DateTimeField(verbose_name='received at')),
+                ('first_received_at', models.DateTimeField(verbose_name='first received at')),
+                ('coalesced', models.PositiveIntegerField(default=0, verbose_name='coalesced commits')),
+            ],
+            options={
+                'verbose_name': 'pending commit',
+                'verbose_name_plural': 'pending commits',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.9 on 2024-02-26 11:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('servers', '0010_pendingcommit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='server',
+            name='commit_hashes',
+            field=models.JSONField(default=dict, editable=False, help_text='Hashes of the last committed sections. (See `proc.utils.get_section_hash`.)', verbose_name='commit hashes'),
+        ),
+    ]
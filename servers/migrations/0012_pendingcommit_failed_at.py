@@ -0,0 +1,23 @@
+# Generated by Django 4.2.9 on 2026-10-20 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('servers', '0011_server_commit_hashes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pendingcommit',
+            name='failed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='failed at'),
+        ),
+        migrations.AddField(
+            model_name='pendingcommit',
+            name='error',
+            field=models.TextField(blank=True, default='', verbose_name='error'),
+        ),
+    ]
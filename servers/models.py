@@ -4,7 +4,7 @@ import logging
 from datetime import timedelta
 
 from django.db import models, transaction
-from django.db.models import F, Q, Avg
+from django.db.models import F, Q, Avg, Case, When, Value, Exists, OuterRef, Subquery
 from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.conf import settings
@@ -13,16 +13,69 @@ from django.urls import reverse
 from django.utils.translation import gettext, gettext_lazy as _
 
 # from packages.models import SystemPackage, PythonPackage
-from wsutils.models import WebSocketClient
+from api.apiclient.models import APIClientManager
+from wsutils.models import WebSocketClient, WebSocketSession
 from events.models import Command
+from servers.access import AccessEvaluator
+from servers.provisioning import get_provisioning_state, set_provisioning_state, provision_user, provisioning_lock
+from proc.models import SystemInfo, OsVersion, SystemTime
 from utils.models import UUIDBaseModel
-from iam.models import User, Group
+from iam.models import User, Membership
 
 logger = logging.getLogger(__name__)
 
 STAT_LEVEL_NO = 5
 
 
+class ServerQuerySet(models.QuerySet):
+    def with_session(self, *fields):
+        """
+        Annotate connection status and the last session of servers.
+        (See `WebSocketClient.last_session`.) If `fields` are given, only
+        the matching properties are annotated.
+        """
+        last_session = WebSocketSession.objects.filter(
+            client=OuterRef('pk'),
+        ).order_by(
+            Case(When(deleted_at__isnull=True, then=Value(0)), default=Value(1)),
+            '-updated_at',
+        )
+        return self.annotate_properties(fields, {
+            'is_connected': Exists(WebSocketSession.objects.filter(
+                client=OuterRef('pk'),
+                deleted_at__isnull=True,
+            )),
+            'remote_ip': Subquery(last_session.values('remote_ip')[:1]),
+            'last_connectivity': Subquery(last_session.values('updated_at')[:1]),
+        })
+
+    def with_snapshots(self, *fields):
+        """
+        Annotate fields of the current system information, OS version, and
+        system time of servers. If `fields` are given, only the matching
+        properties are annotated.
+        """
+        info = SystemInfo.objects.filter(server=OuterRef('pk'), current=True)
+        os = OsVersion.objects.filter(server=OuterRef('pk'), current=True)
+        time = SystemTime.objects.filter(server=OuterRef('pk'), current=True)
+        return self.annotate_properties(fields, {
+            'cpu_physical_cores': Subquery(info.values('cpu_physical_cores')[:1]),
+            'cpu_logical_cores': Subquery(info.values('cpu_logical_cores')[:1]),
+            'cpu_type': Subquery(info.values('cpu_type')[:1]),
+            'physical_memory': Subquery(info.values('physical_memory')[:1]),
+            'os_name': Subquery(os.values('name')[:1]),
+            'os_version': Subquery(os.values('version')[:1]),
+            'boot_time': Subquery(time.values('boot_time')[:1]),
+        })
+
+    def annotate_properties(self, fields, annotations):
+        # Properties return `_<name>` if annotated. (e.g., `Server.cpu_type`)
+        return self.annotate(**{
+            '_%s' % name: value for (name, value) in annotations.items()
+            if not fields or name in fields
+        })
+
+
 class Server(WebSocketClient):
     name = models.SlugField(
         max_length=16, unique=True,
@@ -33,12 +86,18 @@ class Server(WebSocketClient):
         )
     )
     status = models.JSONField(_('status'), null=True)
+    status_code = models.CharField(_('status code'), max_length=8, null=True, editable=False, db_index=True)
+    delay = models.FloatField(_('response delay'), null=True, editable=False, db_index=True)
     commissioned = models.BooleanField(_('commissioned'), default=False)
     version = models.CharField(_('version'), max_length=16, null=True, blank=True)
     osquery_version = models.CharField(max_length=16, null=True, blank=True)
     load = models.FloatField(_('load average (1m)'), null=True, editable=False)
     started_at = models.DateTimeField(_('started at'), null=True, editable=False)
     deleted_at = models.DateTimeField(_('deleted at'), null=True, editable=False)
+    commit_hashes = models.JSONField(
+        _('commit hashes'), default=dict, editable=False,
+        help_text=_('Hashes of the last committed sections. (See `proc.utils.get_section_hash`.)')
+    )
     groups = models.ManyToManyField(
         'iam.Group',
         related_name='servers',
@@ -57,6 +116,8 @@ class Server(WebSocketClient):
     _sys_users = None
     _sys_groups = None
 
+    objects = APIClientManager.from_queryset(ServerQuerySet)()
+
     class Meta:
         verbose_name = _('server')
         verbose_name_plural = _('servers')
@@ -70,19 +131,19 @@ class Server(WebSocketClient):
     @property
     def system_info(self):
         if self._info is None:
-            self._info = self.systeminfo_set.latest()
+            self._info = self.systeminfo_set.get(current=True)
         return self._info
 
     @property
     def os_info(self):
         if self._os_info is None:
-            self._os_info = self.osversion_set.latest()
+            self._os_info = self.osversion_set.get(current=True)
         return self._os_info
 
     @property
     def time(self):
         if self._time is None:
-            self._time = self.systemtime_set.latest()
+            self._time = self.systemtime_set.get(current=True)
         return self._time
 
     @property
@@ -108,42 +169,57 @@ class Server(WebSocketClient):
 
     @property
     def cpu_physical_cores(self):
+        if hasattr(self, '_cpu_physical_cores'):
+            return self._cpu_physical_cores
         return self.system_info.cpu_physical_cores
 
     @property
     def cpu_logical_cores(self):
+        if hasattr(self, '_cpu_logical_cores'):
+            return self._cpu_logical_cores
         return self.system_info.cpu_logical_cores
 
     @property
     def cpu_type(self):
+        if hasattr(self, '_cpu_type'):
+            return self._cpu_type
         return self.system_info.cpu_type
 
     @property
     def physical_memory(self):
+        if hasattr(self, '_physical_memory'):
+            return self._physical_memory
         return self.system_info.physical_memory
 
     @property
     def os_name(self):
+        if hasattr(self, '_os_name'):
+            return self._os_name
         return self.os_info.name
 
     @property
     def os_version(self):
+        if hasattr(self, '_os_version'):
+            return self._os_version
         return self.os_info.version
 
     @property
     def boot_time(self):
+        if hasattr(self, '_boot_time'):
+            return self._boot_time
         return self.time.boot_time
 
     @property
     def uptime(self):
         try:
-            return (timezone.now() - self.time.boot_time).total_seconds()
+            return (timezone.now() - self.boot_time).total_seconds()
         except:
             return None
 
     @property
     def groups_name(self):
-        return self.groups.values_list('display_name', flat=True)
+        # Iterate over `groups.all()` to make use of prefetched groups.
+        return [group.display_name for group in self.groups.all()]
 
     def response_delay(self):
         result = self.command_set.filter(
@@ -242,11 +318,32 @@ class Server(WebSocketClient):
                 'meta': delay,
             }
 
+    def update_status(self):
+        """
+        Refresh the status of this server. The status code and the current
+        response delay are stored in separate columns for aggregation.
+        """
+        from servers.overview import invalidate_fleet_overview
+
+        status = self.get_current_status()
+        update_fields = ['status', 'status_code', 'delay']
+        if self.status is None or any(status[name] != self.status.get(name) for name in ['code', 'messages']):
+            # Bump updated_at so that conditional GET validators change as well. Delays in `meta`
+            # change on every tick, so they are left out not to defeat caching.
+            update_fields.append('updated_at')
+        changed = self.status_code != status['code']
+        self.status = status
+        self.status_code = status['code']
+        self.delay = status['meta']['delay_now']
+        self.save(update_fields=update_fields)
+        if changed:
+            invalidate_fleet_overview()
+
     def get_latest_info(self):
-        return self.systeminfo_set.latest()
+        return self.systeminfo_set.get(current=True)
 
     def get_latest_osinfo(self):
-        return self.osversion_set.latest()
+        return self.osversion_set.get(current=True)
 
     def get_active_users(self):
         return self.systemuser_set.exclude(
@@ -291,6 +388,8 @@ class Server(WebSocketClient):
 
     def update_information(self, requested_by=None):
         logger.info('Sending commit request to %s.', self.name)
+        # Apply all sections of the next commit, even if they have not changed.
+        Server.objects.filter(pk=self.pk).update(commit_hashes={})
         return self.execute(
             shell='internal',
             cmdline='commit',
@@ -346,32 +445,11 @@ class Server(WebSocketClient):
         )
 
     def has_access(self, user: User, username, groupname):
-        # Check if the user and group are valid.
-        if not (User.objects.filter(username=username).exists() or self.has_user_by_username(username)):
-            return False
-
-        if not (Group.objects.filter(name=groupname).exists() or self.has_group_by_groupname(groupname)):
-            return False
-
-        # Grant access if the user is a superuser, staff, or the owner.
-        if user.is_superuser or user.is_staff or self.owner.pk == user.pk:
-            return True
-
-        # Grant access if the user has a manager or owner role in the group.
-        if self.groups.filter(
-                membership__user__pk=user.pk,
-                membership__role__in=['owner', 'manager']
-        ).exists():
-            return True
-
-        # Allow access only if it's the user's own account and not a higher privilege request, e.g., accessing root.
-        if username == user.username and self.groups.filter(
-                membership__user__pk=user.pk
-        ).exists():
-            return True
-
-        # Deny access if none of the above conditions are met.
-        return False
+        """
+        Return whether `user` can access this server as `username` and
+        `groupname`. Use `AccessEvaluator` to decide access for many servers.
+        """
+        return AccessEvaluator(user).has_access(self, username, groupname)
 
     def has_user_by_username(self, username):
         return self.systemuser_set.filter(
@@ -447,28 +525,24 @@ class Server(WebSocketClient):
 
     # check and make group that the user is enrolled
     def prepare_user(self, user, group, deps):
-        gids = []
         if self.platform == 'darwin':
             return
 
-        for obj in user.membership_set.all():
-            gids.append(obj.group.gid)
-
-            if not self.has_group(obj.group):
-                cmd = self.add_group(obj.group, requested_by=user)
-                deps.append(cmd)
-
-        if not self.has_user(user):
-            cmd = self.add_user(
-                user,
-                group.gid,
-                group.name,
-                gids,
+        # Users are usually provisioned in the background (See `servers.provisioning`),
+        # so this needs no queries unless the user has not been added yet.
+        if user.pk in get_provisioning_state(self)['users']:
+            return deps
+
+        with provisioning_lock(self):
+            state = get_provisioning_state(self)
+            provision_user(
+                self, state, user,
+                user.membership_set.select_related('group').order_by('group__gid'),
+                group,
                 requested_by=user,
-                run_after=deps
+                deps=deps,
             )
-            deps.append(cmd)
-
+            set_provisioning_state(self, state)
         return deps
 
     def is_systemuser(self, username):
@@ -536,3 +610,123 @@ class Note(UUIDBaseModel):
     @property
     def server_name(self):
         return str(self.server)
+
+
+class ServerVisibility(models.Model):
+    """
+    Materialized visibility of servers for users, i.e., one row per user and
+    server that the user can see through memberships of the server's groups.
+    `role` is the highest role of the user among those groups.
+
+    Rows are maintained by `servers.signals` on membership and group changes.
+    Use `manage.py rebuild_server_visibility` to rebuild them from scratch.
+    """
+
+    ROLE_RANKS = {
+        'member': 0,
+        'manager': 1,
+        'owner': 2,
+    }
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name=_('user')
+    )
+    server = models.ForeignKey(
+        'servers.Server', on_delete=models.CASCADE,
+        related_name='visibilities',
+        verbose_name=_('server')
+    )
+    role = models.CharField(_('role'), max_length=16, choices=Membership.ROLES)
+
+    class Meta:
+        verbose_name = _('server visibility')
+        verbose_name_plural = _('server visibilities')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'server'],
+                name='servers_visibility_user_server',
+            ),
+        ]
+
+    @classmethod
+    def get_server_pks(cls, user):
+        """
+        Return a subquery of the pks of servers visible to `user`, to be used
+        as a semi-join, e.g., `Server.objects.filter(pk__in=...)`.
+        """
+        return cls.objects.filter(user__pk=user.pk).values('server')
+
+    @classmethod
+    def refresh(cls, servers=None, users=None):
+        """
+        Recompute rows of `servers` and `users` (lists of pks) from the
+        current memberships. If neither is given, all rows are recomputed.
+        """
+        memberships = Membership.objects.filter(group__server__isnull=False)
+        existing = cls.objects.all()
+        if servers is not None:
+            memberships = memberships.filter(group__server__pk__in=servers)
+            existing = existing.filter(server__pk__in=servers)
+        if users is not None:
+            memberships = memberships.filter(user__pk__in=users)
+            existing = existing.filter(user__pk__in=users)
+
+        roles = {}
+        for (user_pk, server_pk, role) in memberships.values_list('user', 'group__server', 'role').iterator():
+            key = (user_pk, server_pk)
+            if key not in roles or cls.ROLE_RANKS[role] > cls.ROLE_RANKS[roles[key]]:
+                roles[key] = role
+
+        with transaction.atomic():
+            current = {
+                (obj.user_id, obj.server_id): obj
+                for obj in existing.select_for_update()
+            }
+            stale = [obj.pk for (key, obj) in current.items() if key not in roles]
+            if stale:
+                cls.objects.filter(pk__in=stale).delete()
+
+            changed = []
+            for (key, obj) in current.items():
+                if key in roles and obj.role != roles[key]:
+                    obj.role = roles[key]
+                    changed.append(obj)
+            if changed:
+                cls.objects.bulk_update(changed, ['role'])
+
+            cls.objects.bulk_create([
+                cls(user_id=user_pk, server_id=server_pk, role=role)
+                for ((user_pk, server_pk), role) in roles.items()
+                if (user_pk, server_pk) not in current
+            ], ignore_conflicts=True)
+        logger.debug(
+            'Refreshed server visibility: %d stale, %d changed, %d total.',
+            len(stale), len(changed), len(roles)
+        )
+
+
+class PendingCommit(models.Model):
+    """
+    Commit of a server that has been accepted but not applied yet. (See
+    `servers.ingest`.) There is at most one row per server, as a newer commit
+    replaces the pending one, and the payload is stored compressed.
+    """
+
+    server = models.OneToOneField(
+        'servers.Server', on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='pending_commit',
+        verbose_name=_('server')
+    )
+    payload = models.BinaryField(_('payload'))
+    received_at = models.DateTimeField(_('received at'))
+    first_received_at = models.DateTimeField(_('first received at'))
+    coalesced = models.PositiveIntegerField(_('coalesced commits'), default=0)
+    failed_at = models.DateTimeField(_('failed at'), null=True, blank=True)
+    error = models.TextField(_('error'), blank=True, default='')
+
+    class Meta:
+        verbose_name = _('pending commit')
+        verbose_name_plural = _('pending commits')
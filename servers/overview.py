@@ -0,0 +1,111 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Exists, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from events.models import Command
+from proc.models import OsVersion
+from servers.models import Server
+from wsutils.models import WebSocketSession
+
+
+logger = logging.getLogger(__name__)
+
+OVERVIEW_VERSION_KEY = 'servers:overview:version'
+
+# Commands are considered stuck after this period. (See `Command.status`.)
+STUCK_COMMAND_TIMEOUT = timedelta(seconds=10*60)
+
+
+def invalidate_fleet_overview():
+    """
+    Invalidate all cached overviews by bumping the version of cache keys.
+    """
+    try:
+        cache.incr(OVERVIEW_VERSION_KEY)
+    except ValueError:
+        cache.set(OVERVIEW_VERSION_KEY, 1, None)
+
+
+def get_fleet_overview(queryset, scope, top=5):
+    """
+    Return aggregated facets of servers in `queryset`. Results are cached
+    for `SERVER_OVERVIEW_CACHE_TIMEOUT` seconds per `scope`, which should
+    identify the set of servers visible to the requester.
+    """
+    version = cache.get_or_set(OVERVIEW_VERSION_KEY, 1, None)
+    key = 'servers:overview:%(version)s:%(scope)s:%(top)d' % {
+        'version': version,
+        'scope': scope,
+        'top': top,
+    }
+    result = cache.get(key)
+    if result is None:
+        result = build_fleet_overview(queryset, top=top)
+        cache.set(key, result, settings.SERVER_OVERVIEW_CACHE_TIMEOUT)
+    return result
+
+
+def count_by(queryset, *fields):
+    return [
+        row for row in queryset.order_by().values(*fields).annotate(
+            count=Count('pk'),
+        ).order_by('-count')
+    ]
+
+
+def build_fleet_overview(queryset, top=5):
+    # Use a semi-join so that visibility joins never duplicate servers.
+    servers = Server.objects.filter(
+        pk__in=queryset.order_by().values('pk'),
+        deleted_at__isnull=True,
+    )
+
+    connected = servers.annotate(
+        connected=Exists(WebSocketSession.objects.filter(
+            client=OuterRef('pk'),
+            deleted_at__isnull=True,
+        )),
+    )
+    current_os = OsVersion.objects.filter(
+        server=OuterRef('pk'),
+        current=True,
+    )
+    os = servers.annotate(
+        os=Subquery(current_os.values('name')[:1]),
+        os_release=Subquery(current_os.values('version')[:1]),
+    )
+
+    threshold = timezone.now() - STUCK_COMMAND_TIMEOUT
+    stuck_commands = Command.objects.filter(
+        Q(handled_at__isnull=True)
+        & (
+            Q(acked_at__lt=threshold)
+            | (Q(acked_at__isnull=True) & Q(delivered_at__lt=threshold))
+        ),
+        server__in=servers,
+    )
+
+    status = count_by(servers, 'status_code')
+    return {
+        'total': sum(row['count'] for row in status),
+        'status': [
+            {'code': row['status_code'], 'count': row['count']}
+            for row in status
+        ],
+        'os': [
+            {'name': row['os'], 'version': row['os_release'], 'count': row['count']}
+            for row in count_by(os, 'os', 'os_release')
+        ],
+        'version': count_by(servers, 'version'),
+        'commissioned': count_by(servers, 'commissioned'),
+        'connected': count_by(connected, 'connected'),
+        'slowest': list(servers.filter(
+            delay__isnull=False,
+        ).order_by('-delay').values('id', 'name', 'status_code', 'delay')[:top]),
+        'stuck_commands': stuck_commands.count(),
+        'generated_at': timezone.now(),
+    }
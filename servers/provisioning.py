@@ -0,0 +1,153 @@
+import logging
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from iam.models import Group, Membership
+from utils.locks import CacheLock
+
+
+logger = logging.getLogger(__name__)
+
+STATE_KEY = 'servers:provisioning:%s'
+STATE_TIMEOUT = 10*60
+SCHEDULE_KEY = 'servers:provisioning:scheduled:%s'
+LOCK_KEY = 'servers:provisioning:lock:%s'
+LOCK_TIMEOUT = 30
+
+
+def load_provisioning_state(server):
+    return {
+        'users': set(server.systemuser_set.filter(
+            iam_user__isnull=False,
+        ).values_list('iam_user_id', flat=True)),
+        'groups': set(server.systemgroup_set.filter(
+            iam_group__isnull=False,
+        ).values_list('iam_group_id', flat=True)),
+        # Commands that have been issued but not reflected by commits yet, keyed by user or group.
+        'pending_users': {},
+        'pending_groups': {},
+    }
+
+
+def get_provisioning_state(server):
+    """
+    Return IAM users and groups that exist on `server`. The state is cached
+    until a commit of the server changes its users or groups.
+    """
+    state = cache.get(STATE_KEY % server.pk)
+    if state is None:
+        state = load_provisioning_state(server)
+        cache.set(STATE_KEY % server.pk, state, STATE_TIMEOUT)
+    return state
+
+
+def set_provisioning_state(server, state):
+    cache.set(STATE_KEY % server.pk, state, STATE_TIMEOUT)
+
+
+def invalidate_provisioning_state(server_pk):
+    cache.delete(STATE_KEY % server_pk)
+
+
+@contextmanager
+def provisioning_lock(server):
+    """
+    Serialize read-modify-write of the provisioning state of `server`, so
+    that concurrent calls do not add the same users or groups twice.
+    """
+    lock = CacheLock(LOCK_KEY % server.pk, LOCK_TIMEOUT)
+    if not lock.acquire(wait=LOCK_TIMEOUT):
+        logger.warning('Provisioning %s without the lock held by another worker.', server.name)
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+def provision_user(server, state, user, memberships, primary_group, requested_by=None, deps=None):
+    """
+    Add groups of `memberships` and `user` to `server` unless they exist or
+    are being added, and return commands to wait for. `state` is updated
+    with the new commands.
+    """
+    if deps is None:
+        deps = []
+    if user.pk in state['users']:
+        return deps
+
+    gids = []
+    for membership in memberships:
+        group = membership.group
+        gids.append(group.gid)
+        if group.pk in state['groups']:
+            continue
+        if group.pk not in state['pending_groups']:
+            state['pending_groups'][group.pk] = server.add_group(group, requested_by=requested_by).pk
+        deps.append(state['pending_groups'][group.pk])
+
+    if user.pk not in state['pending_users']:
+        state['pending_users'][user.pk] = server.add_user(
+            user,
+            primary_group.gid,
+            primary_group.name,
+            gids,
+            requested_by=requested_by,
+            run_after=list(deps),
+        ).pk
+    deps.append(state['pending_users'][user.pk])
+    return deps
+
+
+def provision_server(server):
+    """
+    Add all IAM users who can access `server` and their groups to the server
+    in a batch. Returns the number of users being provisioned.
+    """
+    if server.platform == 'darwin' or not server.enabled or server.deleted_at is not None:
+        return 0
+
+    memberships = {}
+    for membership in Membership.objects.filter(
+        user__in=Membership.objects.filter(group__servers=server).values('user'),
+    ).select_related('user', 'group').order_by('user', 'group__gid'):
+        memberships.setdefault(membership.user, []).append(membership)
+
+    with provisioning_lock(server):
+        state = get_provisioning_state(server)
+        users = [user for user in memberships if user.pk not in state['users']]
+        groups = {
+            membership.group.pk: membership.group
+            for user in memberships if user.pk in state['users']
+            for membership in memberships[user]
+            if membership.group.pk not in state['groups'] and membership.group.pk not in state['pending_groups']
+        }
+        if not (users or groups):
+            return 0
+
+        # New groups of existing users
+        for group in groups.values():
+            state['pending_groups'][group.pk] = server.add_group(group).pk
+        if users:
+            primary_group = Group.get_default()
+            for user in users:
+                provision_user(server, state, user, memberships[user], primary_group)
+        set_provisioning_state(server, state)
+    logger.info('Provisioning %d users and %d groups to %s.', len(users), len(groups), server.name)
+    return len(users)
+
+
+def schedule_provisioning(server_pks):
+    """
+    Provision `server_pks` in the background. Changes within
+    SERVER_PROVISION_DELAY are batched into a task per server.
+    """
+    from servers.tasks import provision_server as provision_server_task
+
+    for server_pk in server_pks:
+        if cache.add(SCHEDULE_KEY % server_pk, True, settings.SERVER_PROVISION_DELAY + 60):
+            transaction.on_commit(lambda server_pk=server_pk: provision_server_task.apply_async(
+                (str(server_pk),), countdown=settings.SERVER_PROVISION_DELAY,
+            ))
@@ -0,0 +1,56 @@
+import logging
+
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from iam.models import Membership
+from proc.signals import inventory_changed
+from servers.models import Server, ServerVisibility
+from servers.provisioning import schedule_provisioning, invalidate_provisioning_state
+
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Membership)
+@receiver(post_delete, sender=Membership)
+def membership_changed(sender, instance, **kwargs):
+    servers = list(Server.objects.filter(groups__pk=instance.group_id).values_list('pk', flat=True))
+    if servers:
+        ServerVisibility.refresh(servers=servers, users=[instance.user_id])
+        if kwargs.get('created', False):
+            schedule_provisioning(servers)
+
+
+def touch_servers(server_pks):
+    # Groups of servers are serialized with them, so changes should update conditional GET validators.
+    if server_pks:
+        Server.objects.filter(pk__in=server_pks).update(updated_at=timezone.now())
+
+
+@receiver(m2m_changed, sender=Server.groups.through)
+def server_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            ServerVisibility.refresh(servers=[instance.pk])
+            touch_servers([instance.pk])
+        if action == 'post_add':
+            schedule_provisioning([instance.pk])
+    elif action == 'pre_clear':
+        # `pk_set` is not given on clear, so remember the servers of the group before clearing it.
+        instance._cleared_servers = list(instance.servers.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        ServerVisibility.refresh(servers=getattr(instance, '_cleared_servers', []))
+        touch_servers(getattr(instance, '_cleared_servers', []))
+    elif action in ('post_add', 'post_remove'):
+        ServerVisibility.refresh(servers=list(pk_set))
+        touch_servers(list(pk_set))
+        if action == 'post_add':
+            schedule_provisioning(list(pk_set))
+
+
+@receiver(inventory_changed, sender=Server)
+def server_inventory_changed(sender, server, changes, **kwargs):
+    if 'users' in changes or 'groups' in changes:
+        invalidate_provisioning_state(server.pk)
@@ -1,49 +1,80 @@
 import logging
 from datetime import timedelta
 
+from django.core.cache import cache
 from django.utils import timezone
 
 from celery import shared_task
 
 from servers.models import Server, Installer
+from servers.ingest import apply_commit, get_stale_commits
+from servers.provisioning import SCHEDULE_KEY, provision_server as provision_users
+from utils.watchdog import dispatch_shards, run_shard
 
 
 logger = logging.getLogger(__name__)
 
 
-@shared_task(ignore_result=True, queue='watchdog')
-def ping_all_servers():
-    for obj in Server.objects.filter(
+def get_active_servers():
+    return Server.objects.filter(
         enabled=True,
         deleted_at__isnull=True,
-    ).exclude(session__isnull=True):
-        if obj.is_connected:
-            obj.execute('ping')
+    )
+
+
+def get_connected_server_pks():
+    return get_active_servers().filter(
+        session__deleted_at__isnull=True,
+    ).values_list('pk', flat=True).distinct()
+
+
+@shared_task(ignore_result=True, queue='watchdog')
+def ping_all_servers():
+    return dispatch_shards(ping_servers, get_connected_server_pks())
+
+
+@shared_task(ignore_result=True, queue='watchdog')
+def ping_servers(shard, server_pks):
+    return run_shard(
+        'ping_servers', shard,
+        lambda obj: obj.execute('ping'),
+        get_active_servers().filter(pk__in=server_pks),
+    )
 
 
 @shared_task(ignore_result=True, queue='watchdog')
 def debug_all_servers():
-    for obj in Server.objects.filter(
-        enabled=True,
-        deleted_at__isnull=True,
-    ).exclude(session__isnull=True):
-        if obj.is_connected:
-            obj.execute('debug')
+    return dispatch_shards(debug_servers, get_connected_server_pks())
+
+
+@shared_task(ignore_result=True, queue='watchdog')
+def debug_servers(shard, server_pks):
+    return run_shard(
+        'debug_servers', shard,
+        lambda obj: obj.execute('debug'),
+        get_active_servers().filter(pk__in=server_pks),
+    )
 
 
 @shared_task(ignore_result=True, queue='watchdog')
 def check_server_status(server_pk=None):
     if server_pk is None:
-        for obj in Server.objects.filter(
-            enabled=True,
-            deleted_at__isnull=True,
-        ):
-            obj.status = obj.get_current_status()
-            obj.save(update_fields=['status'])
+        return dispatch_shards(
+            check_servers_status,
+            get_active_servers().values_list('pk', flat=True),
+        )
     else:
         obj = Server.objects.get(pk=server_pk)
-        obj.status = obj.get_current_status()
-        obj.save(update_fields=['status'])
+        obj.update_status()
+
+
+@shared_task(ignore_result=True, queue='watchdog')
+def check_servers_status(shard, server_pks):
+    return run_shard(
+        'check_server_status', shard,
+        lambda obj: obj.update_status(),
+        get_active_servers().filter(pk__in=server_pks),
+    )
 
 
 @shared_task(ignore_result=True, queue='cleanup')
@@ -51,3 +82,29 @@ def cleanup_installers():
     Installer.objects.filter(
         added_at__lt=timezone.now()-timedelta(days=1)
     ).delete()
+
+
+@shared_task(ignore_result=True, queue='ingest')
+def apply_pending_commit(server_pk):
+    if apply_commit(server_pk) is None:
+        # Another commit of the server is being applied. Retry after it finishes.
+        apply_pending_commit.apply_async((server_pk,), countdown=1)
+
+
+@shared_task(ignore_result=True, queue='ingest')
+def apply_pending_commits():
+    # Dispatch commits that have been left pending, e.g., when workers have restarted.
+    for server_pk in get_stale_commits():
+        apply_pending_commit.delay(str(server_pk))
+
+
+@shared_task(ignore_result=True, queue='cmd')
+def provision_server(server_pk):
+    # Changes from now on are handled by another task.
+    cache.delete(SCHEDULE_KEY % server_pk)
+    try:
+        server = Server.objects.get(pk=server_pk)
+    except Server.DoesNotExist:
+        logger.debug('Server %s does not exist.', server_pk)
+        return 0
+    return provision_users(server)
@@ -1,16 +1,37 @@
+import uuid
+from io import StringIO
 from datetime import timedelta
+from collections import Counter
+from unittest import mock
 
 from django.test import TestCase, TransactionTestCase
+from django.core.management import call_command
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import get_random_string
 
 from channels.testing import WebsocketCommunicator
 from channels.routing import URLRouter
 from channels.db import database_sync_to_async
 
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APITestCase
+
 from wsutils.auth import APIAuthMiddlewareStack
-from servers.models import Server
+from servers.models import Server, ServerVisibility, PendingCommit
+from servers.ingest import enqueue_commit, apply_commit
+from servers.overview import build_fleet_overview, get_fleet_overview, invalidate_fleet_overview
+from servers.api.serializers import ServerMetaSerializer
+from servers.access import AccessEvaluator
+from servers.provisioning import provision_server, get_provisioning_state, invalidate_provisioning_state
 from servers.routing import websocket_urlpatterns
+from iam.models import Group
+from events.models import Command
+from proc.models import SystemUser
 
 from api.apiclient.tokens import JWTRefreshToken
 
@@ -30,9 +51,375 @@ class ServerModelTestCase(TestCase):
         server.save()
 
 
-class ServerAPIViewTestCase(TestCase):
+class AccessEvaluatorTestCase(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='testowner')
+        self.user = User.objects.create_user(username='testuser')
+        self.group = Group.objects.create(name='testgroup', display_name='Test group')
+        self.group.membership_set.create(user=self.user, role='member')
+        self.servers = []
+        for i in range(5):
+            server = Server.objects.create(name='testing-%d' % i, owner=self.owner)
+            server.groups.add(self.group)
+            self.servers.append(server)
+
+    def test_evaluate(self):
+        evaluator = AccessEvaluator(self.user)
+        with self.assertNumQueries(4):
+            results = evaluator.evaluate([
+                (server, username, 'testgroup')
+                for server in self.servers for username in ['testuser', 'testowner']
+            ])
+        for server in self.servers:
+            # Members can access servers only with their own accounts.
+            self.assertTrue(results[(server.pk, 'testuser', 'testgroup')])
+            self.assertFalse(results[(server.pk, 'testowner', 'testgroup')])
+
+        # Results are memoized.
+        with self.assertNumQueries(0):
+            self.assertTrue(evaluator.has_access(self.servers[0], 'testuser', 'testgroup'))
+
+
+class ServerVisibilityTestCase(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='testowner')
+        self.user = User.objects.create_user(username='testuser')
+        self.group = Group.objects.create(name='testgroup', display_name='Test group')
+        self.server = Server.objects.create(name='testing', owner=self.owner)
+
+    def get_role(self):
+        visibility = ServerVisibility.objects.filter(user=self.user, server=self.server).first()
+        return visibility.role if visibility else None
+
+    def test_maintenance(self):
+        self.server.groups.add(self.group)
+        self.assertIsNone(self.get_role())
+
+        membership = self.group.membership_set.create(user=self.user, role='member')
+        self.assertEqual(self.get_role(), 'member')
+
+        membership.role = 'manager'
+        membership.save()
+        self.assertEqual(self.get_role(), 'manager')
+
+        self.server.groups.remove(self.group)
+        self.assertIsNone(self.get_role())
+
+        self.group.servers.add(self.server)
+        self.assertEqual(self.get_role(), 'manager')
+
+        self.group.membership_set.filter(user=self.user).delete()
+        self.assertIsNone(self.get_role())
+
+
+class ProvisioningTestCase(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='testowner')
+        self.user = User.objects.create_user(username='testuser')
+        self.group = Group.objects.create(name='testgroup', display_name='Test group')
+        self.server = Server.objects.create(name='testing', owner=self.owner)
+        self.server.groups.add(self.group)
+        self.group.membership_set.create(user=self.user, role='member')
+
+    def test_provision(self):
+        invalidate_provisioning_state(self.server.pk)
+        self.assertEqual(provision_server(self.server), 1)
+        self.assertTrue(Command.objects.filter(server=self.server, line='addgroup testgroup').exists())
+        adduser = Command.objects.get(server=self.server, line='adduser testuser')
+
+        # Commands are issued only once, and terminals wait for them.
+        self.assertEqual(provision_server(self.server), 0)
+        self.assertEqual(self.server.prepare_user(self.user, Group.get_default(), []), [adduser.pk])
+
+        # Once the server has committed the user, opening terminals needs no queries.
+        SystemUser.objects.create(
+            server=self.server, uid=self.user.uid, gid=self.user.uid,
+            username='testuser', iam_user=self.user,
+        )
+        invalidate_provisioning_state(self.server.pk)
+        group = Group.get_default()
+        self.server.prepare_user(self.user, group, [])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.server.prepare_user(self.user, group, []), [])
+
+    def test_failure(self):
+        invalidate_provisioning_state(self.server.pk)
+        provision_server(self.server)
+        adduser = Command.objects.get(server=self.server, line='adduser testuser')
+        with mock.patch('servers.tasks.check_server_status.delay'):
+            adduser.fin(False, 'adduser: failed')
+
+        # A failed command is not waited for, but the user is added again.
+        deps = self.server.prepare_user(self.user, Group.get_default(), [])
+        self.assertNotIn(adduser.pk, deps)
+        self.assertEqual(Command.objects.filter(server=self.server, line='adduser testuser').count(), 2)
+
+    def test_relink(self):
+        get_provisioning_state(self.server)
+        SystemUser.objects.create(server=self.server, uid=self.user.uid, gid=self.user.uid, username='testuser')
+        call_command('relink_system_accounts', stdout=StringIO())
+        self.assertIn(self.user.pk, get_provisioning_state(self.server)['users'])
+
+
+class CommitIngestionTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser')
+        self.server = Server.objects.create(name='testing', owner=self.user)
+
+    def test_coalesce(self):
+        self.assertTrue(enqueue_commit(self.server, {'version': '1.0.0', 'pypackages': []}))
+        self.assertFalse(enqueue_commit(self.server, {'version': '1.0.1', 'pypackages': []}))
+        self.assertEqual(PendingCommit.objects.get(server=self.server).coalesced, 1)
+
+        self.assertTrue(apply_commit(self.server.pk))
+        self.assertFalse(PendingCommit.objects.filter(server=self.server).exists())
+        self.server.refresh_from_db()
+        self.assertEqual(self.server.version, '1.0.1')
+
+        # Nothing is left to apply.
+        self.assertFalse(apply_commit(self.server.pk))
+
+    def test_validate(self):
+        with self.assertRaises(ValidationError):
+            enqueue_commit(self.server, {'packages': {}})
+        self.assertFalse(PendingCommit.objects.filter(server=self.server).exists())
+
+    def test_failure(self):
+        enqueue_commit(self.server, {'version': '1.0.0', 'interfaces': [{'name': None}]})
+        self.assertFalse(apply_commit(self.server.pk))
+
+        # Invalid commits are kept as failed, and are not retried until a new one arrives.
+        pending = PendingCommit.objects.get(server=self.server)
+        self.assertIsNotNone(pending.failed_at)
+        self.assertFalse(apply_commit(self.server.pk))
+
+        enqueue_commit(self.server, {'version': '1.0.1'})
+        self.assertIsNone(PendingCommit.objects.get(server=self.server).failed_at)
+        self.assertTrue(apply_commit(self.server.pk))
+        self.assertFalse(PendingCommit.objects.filter(server=self.server).exists())
+
+
+class FleetOverviewTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser')
+        self.servers = []
+        for i in range(6):
+            server = Server.objects.create(
+                name='testing-%d' % i, owner=self.user,
+                version='1.%d.0' % (i % 2),
+                commissioned=i % 3 != 0,
+                status_code=['ok', 'warn', 'error'][i % 3],
+                delay=float(i),
+            )
+            server.osversion_set.create(name='Ubuntu', version=['20.04', '22.04'][i % 2], platform='ubuntu')
+            if i % 2 == 0:
+                server.sessions.create(remote_ip='127.0.0.1', channel_id='fake_channel%d' % i)
+            self.servers.append(server)
+        invalidate_fleet_overview()
+
+    def get_status(self, code, message):
+        return {'code': code, 'messages': [message], 'meta': {'delay_now': 0.0}}
+
+    def test_counts(self):
+        overview = build_fleet_overview(Server.objects.all(), top=3)
+
+        # The aggregated facets agree with computing each server one by one.
+        def counts(rows, *keys):
+            return {tuple(row[key] for key in keys): row['count'] for row in rows}
+
+        servers = [Server.objects.get(pk=server.pk) for server in self.servers]
+        self.assertEqual(overview['total'], len(servers))
+        self.assertEqual(counts(overview['status'], 'code'), Counter((obj.status_code,) for obj in servers))
+        self.assertEqual(
+            counts(overview['os'], 'name', 'version'),
+            Counter((obj.os_info.name, obj.os_info.version) for obj in servers),
+        )
+        self.assertEqual(counts(overview['version'], 'version'), Counter((obj.version,) for obj in servers))
+        self.assertEqual(
+            counts(overview['commissioned'], 'commissioned'),
+            Counter((obj.commissioned,) for obj in servers),
+        )
+        self.assertEqual(
+            counts(overview['connected'], 'connected'),
+            Counter((obj.is_connected,) for obj in servers),
+        )
+        self.assertEqual(
+            [item['name'] for item in overview['slowest']],
+            [obj.name for obj in sorted(servers, key=lambda obj: -obj.delay)[:3]],
+        )
+
+    def test_cache(self):
+        server = self.servers[0]
+        overview = get_fleet_overview(Server.objects.all(), 'all')
+        with mock.patch.object(Server, 'get_current_status', return_value=self.get_status('ok', 'Okay.')):
+            server.update_status()
+        self.assertEqual(get_fleet_overview(Server.objects.all(), 'all'), overview)
+
+        # Changes other than the status code keep the cache.
+        with mock.patch.object(Server, 'get_current_status', return_value=self.get_status('ok', 'Still okay.')):
+            server.update_status()
+        self.assertEqual(get_fleet_overview(Server.objects.all(), 'all'), overview)
+
+        with mock.patch.object(Server, 'get_current_status', return_value=self.get_status('error', 'Failed.')):
+            server.update_status()
+        result = get_fleet_overview(Server.objects.all(), 'all')
+        self.assertNotEqual(result['generated_at'], overview['generated_at'])
+        self.assertEqual(
+            {row['code']: row['count'] for row in result['status']},
+            {'ok': 1, 'warn': 2, 'error': 3},
+        )
+
+
+class ServerMetaSerializerTestCase(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser')
+        self.server = Server.objects.create(name='testing', owner=self.user)
+
+    def commit(self, data):
+        serializer = ServerMetaSerializer(instance=self.server, data=data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return serializer.changes
+
+    def test_skip_unchanged_sections(self):
+        data = {
+            'pypackages': [
+                {'name': 'requests', 'version': '2.31.0'},
+                {'name': 'six', 'version': '1.16.0'},
+            ],
+        }
+        changes = self.commit(data)
+        self.assertEqual(len(changes['pypackages'].created), 2)
+        self.server.refresh_from_db()
+        self.assertIn('pypackages', self.server.commit_hashes)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.commit(data), {})
+        self.assertFalse(any('proc_pythonpackage' in query['sql'] for query in queries.captured_queries))
+
+        data['pypackages'][0]['version'] = '2.32.0'
+        changes = self.commit(data)
+        self.assertEqual([obj.version for obj in changes['pypackages'].created], ['2.32.0'])
+        self.assertEqual([obj.version for obj in changes['pypackages'].deleted], ['2.31.0'])
+
+
+class ServerAPIViewTestCase(APITestCase):
+    def setUp(self):
+        self.password = get_random_string(16)
+        self.user = User.objects.create_user(username='testuser', password=self.password)
+        self.group = Group.objects.create(name='testgroup', display_name='Test group')
+        self.group.membership_set.create(user=self.user, role='member')
+        for i in range(5):
+            server = Server.objects.create(name='testing-%d' % i, owner=self.user)
+            server.groups.add(self.group)
+            server.systeminfo_set.create(
+                uuid=uuid.uuid4(),
+                cpu_physical_cores=4,
+                cpu_logical_cores=8,
+                physical_memory=8*1024**3,
+            )
+            server.osversion_set.create(name='Ubuntu', version='22.04', platform='ubuntu')
+            server.systemtime_set.create(
+                datetime=timezone.now(),
+                timezone='UTC',
+                uptime=3600,
+            )
+        self.client.login(username='testuser', password=self.password)
+
+    def get_list(self, page_size):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('api:servers:server-list'),
+                {'page_size': page_size},
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), page_size)
+        return response, len(queries)
+
+    def test_list_queries(self):
+        response, num_queries_1 = self.get_list(1)
+        response, num_queries_5 = self.get_list(5)
+        self.assertEqual(num_queries_1, num_queries_5)
+
+        item = response.data['results'][0]
+        self.assertEqual(item['cpu_physical_cores'], 4)
+        self.assertEqual(item['os_name'], 'Ubuntu')
+        self.assertEqual(item['groups_name'], ['Test group'])
+        self.assertFalse(item['is_connected'])
+        self.assertFalse(item['starred'])
+        self.assertEqual(
+            item['is_root'],
+            Server.objects.get(pk=item['id']).has_access(self.user, 'root', 'alpacon'),
+        )
+
+    def test_sparse_fieldsets(self):
+        response, num_queries = self.get_list(5)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('api:servers:server-list'),
+                {'page_size': 5, 'fields': 'id,name,is_connected'},
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'name', 'is_connected'})
+        self.assertLess(len(queries), num_queries)
+
+        response = self.client.get(
+            reverse('api:servers:server-list'),
+            {'omit': 'groups,groups_name,is_root'},
+        )
+        self.assertNotIn('groups_name', response.data['results'][0])
+        self.assertIn('os_name', response.data['results'][0])
+
+    def test_conditional_get(self):
+        url = reverse('api:servers:server-list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('ETag', response)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        server = Server.objects.get(name='testing-0')
+        server.save(update_fields=['updated_at'])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_conditional_uptime(self):
+        server = Server.objects.get(name='testing-0')
+        url = reverse('api:servers:server-detail', kwargs={'pk': server.pk})
+        response = self.client.get(url)
+        self.assertIsNotNone(response.data['uptime'])
+        self.assertNotIn('ETag', response)
+
+        response = self.client.get(url, {'omit': 'uptime'})
+        self.assertIn('ETag', response)
+        response = self.client.get(url, {'omit': 'uptime'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_conditional_dependencies(self):
+        url = reverse('api:servers:server-list')
+        etag = self.client.get(url)['ETag']
+
+        # Roles of the user decide `is_root`.
+        membership = self.group.membership_set.get(user=self.user)
+        membership.role = 'owner'
+        membership.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        self.group.display_name = 'Renamed group'
+        self.group.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        server = Server.objects.get(name='testing-0')
+        server.osversion_set.create(name='Ubuntu', version='24.04', platform='ubuntu')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
 
 
 class BackhaulConsumerTestCase(TransactionTestCase):
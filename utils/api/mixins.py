@@ -0,0 +1,163 @@
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from rest_framework.response import Response
+
+
+class ConditionalGetMixin:
+    """
+    A viewset mixin that supports conditional GET requests (`ETag` and
+    `Last-Modified`) for `list()` and `retrieve()`.
+
+    Validators are computed from watermarks of the queryset, i.e., the
+    latest values of `conditional_fields` and the number of objects, before
+    any serialization. If the client already has the same representation,
+    `304 Not Modified` is returned without building the response body.
+    Related fields (e.g., `session__updated_at`) are allowed and aggregated
+    separately to avoid multiplying joined rows. Values that are not stored
+    in the queryset, such as state of the requesting user, can be added to
+    the ETag by `get_conditional_dependencies()`.
+
+    Custom actions can use `get_conditional_response()` in the same way.
+    """
+
+    conditional_fields = ['updated_at']
+
+    def get_conditional_fields(self):
+        return self.conditional_fields
+
+    def is_conditional(self, request):
+        """
+        Return whether `list()` and `retrieve()` handle conditional requests.
+        Representations with values derived from the wall clock should not,
+        as they change on every request while the watermarks stay the same.
+        """
+        return True
+
+    def get_conditional_dependencies(self, request):
+        """
+        Return other values that representations of `list()` and `retrieve()` depend on.
+        """
+        return []
+
+    def get_watermark(self, queryset, fields):
+        """
+        Return the latest datetime of `fields` and the number of objects in `queryset`.
+        """
+        queryset = queryset.model._base_manager.filter(
+            pk__in=queryset.order_by().values('pk'),
+        )
+        local_fields = [field for field in fields if '__' not in field]
+        related_fields = {}
+        for field in fields:
+            if '__' in field:
+                related_fields.setdefault(field.split('__')[0], []).append(field)
+
+        result = queryset.aggregate(
+            count=Count('pk'),
+            **{'max_%d' % i: Max(field) for (i, field) in enumerate(local_fields)}
+        )
+        count = result.pop('count')
+        values = list(result.values())
+        for group in related_fields.values():
+            values.extend(queryset.aggregate(
+                **{'max_%d' % i: Max(field) for (i, field) in enumerate(group)}
+            ).values())
+        values = [value for value in values if value is not None]
+        return (max(values) if values else None, count)
+
+    def get_conditional_response(self, request, queryset, fields=None, dependencies=None):
+        """
+        Return `304 Not Modified` if the representation of `queryset` is not
+        modified since the client has fetched it, otherwise return None. The
+        validators are attached to the response later by `finalize_response()`.
+        """
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        if fields is None:
+            fields = self.get_conditional_fields()
+
+        (last_modified, count) = self.get_watermark(queryset, fields)
+        if count == 0:
+            return None
+        etag = quote_etag(hashlib.sha1(('%(user)s:%(path)s:%(format)s:%(last_modified)s:%(count)d:%(dependencies)r' % {
+            'user': request.user.pk,
+            'path': request.get_full_path(),
+            'format': getattr(request.accepted_renderer, 'format', ''),
+            'last_modified': last_modified.isoformat() if last_modified else '',
+            'count': count,
+            'dependencies': dependencies or [],
+        }).encode('utf-8')).hexdigest())
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+
+        self._conditional_validators = (etag, timestamp)
+        return get_conditional_response(request, etag=etag, last_modified=timestamp)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        validators = getattr(self, '_conditional_validators', None)
+        if validators is not None and response.status_code in (200, 304):
+            (etag, timestamp) = validators
+            response['ETag'] = etag
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+            # Make clients revalidate every time instead of guessing freshness from Last-Modified.
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        if self.is_conditional(request):
+            response = self.get_conditional_response(
+                request, self.filter_queryset(self.get_queryset()),
+                dependencies=self.get_conditional_dependencies(request),
+            )
+            if response is not None:
+                return response
+        return super().list(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        if self.is_conditional(request):
+            response = self.get_conditional_response(
+                request, self.get_queryset().filter(pk=instance.pk),
+                dependencies=self.get_conditional_dependencies(request),
+            )
+            if response is not None:
+                return response
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data)
+
+
+class SparseFieldsetsMixin:
+    """
+    A viewset mixin for serializers with `utils.api.serializers.SparseFieldsetsMixin`.
+    For `list()` and `retrieve()`, only the fields requested with `?fields=` or
+    `?omit=` are serialized, and annotations, joins, prefetches and columns
+    that are needed only by other fields are pruned from the queryset.
+    """
+
+    sparse_fieldsets_actions = ['list', 'retrieve']
+
+    def get_requested_fields(self):
+        if self.action not in self.sparse_fieldsets_actions:
+            return None
+        serializer_class = self.get_serializer_class()
+        if not hasattr(serializer_class, 'get_requested_fields'):
+            return None
+        return serializer_class.get_requested_fields(self.request)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = self.get_requested_fields()
+        return context
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in self.sparse_fieldsets_actions:
+            serializer_class = self.get_serializer_class()
+            if hasattr(serializer_class, 'prune_queryset'):
+                queryset = serializer_class.prune_queryset(queryset, self.request, self.get_requested_fields())
+        return queryset
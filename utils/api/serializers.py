@@ -0,0 +1,73 @@
+class SparseFieldsetsMixin:
+    """
+    A serializer mixin to serialize only the fields requested with
+    `?fields=a,b,c` or to exclude fields with `?omit=a,b,c`. Unknown field
+    names are ignored. Use with `utils.api.mixins.SparseFieldsetsMixin`, which
+    passes the requested fields in the serializer context and prunes the
+    queryset with `prune_queryset()`.
+
+    The queryset is pruned according to the following `Meta` options.
+
+    - `select_related_fields`: relations to join for each field.
+    - `prefetch_related_fields`: relations to prefetch for each field.
+    - `deferrable_fields`: columns that are not loaded unless the field is requested.
+    """
+
+    fields_query_param = 'fields'
+    omit_query_param = 'omit'
+
+    @classmethod
+    def get_requested_fields(cls, request):
+        """
+        Return the set of requested fields, or None if all fields are requested.
+        """
+        available = list(cls.Meta.fields)
+        fields = request.query_params.get(cls.fields_query_param, '')
+        omit = request.query_params.get(cls.omit_query_param, '')
+        if not fields and not omit:
+            return None
+
+        requested = set(available)
+        if fields:
+            requested &= {name.strip() for name in fields.split(',')}
+        if omit:
+            requested -= {name.strip() for name in omit.split(',')}
+        return requested or None
+
+    @classmethod
+    def prune_queryset(cls, queryset, request, fields=None):
+        """
+        Join, prefetch and defer related objects and columns for `fields`.
+        """
+        if fields is None:
+            fields = set(cls.Meta.fields)
+
+        select_related = set()
+        for (name, relations) in getattr(cls.Meta, 'select_related_fields', {}).items():
+            if name in fields:
+                select_related.update(relations)
+        if select_related:
+            queryset = queryset.select_related(*sorted(select_related))
+
+        prefetch_related = set()
+        for (name, relations) in getattr(cls.Meta, 'prefetch_related_fields', {}).items():
+            if name in fields:
+                prefetch_related.update(relations)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*sorted(prefetch_related))
+
+        deferred = set()
+        for (name, columns) in getattr(cls.Meta, 'deferrable_fields', {}).items():
+            if name not in fields:
+                deferred.update(columns)
+        if deferred:
+            queryset = queryset.defer(*sorted(deferred))
+        return queryset
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = self.context.get('fields', None)
+        if fields is not None:
+            for name in list(self.fields):
+                if name not in fields:
+                    self.fields.pop(name)
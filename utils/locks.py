@@ -0,0 +1,42 @@
+import time
+import uuid
+import logging
+
+from django.core.cache import cache
+
+
+logger = logging.getLogger(__name__)
+
+
+class CacheLock:
+    """
+    A lock on a cache key that expires after `timeout` seconds, so that a
+    crashed holder cannot keep it forever. The value of the key is a token
+    of the holder, and the lock is released only if the token still matches.
+    Thus a holder that outlived `timeout` does not release the lock that
+    has been acquired by another one in the meantime.
+    """
+
+    def __init__(self, key, timeout):
+        self.key = key
+        self.timeout = timeout
+        self.token = uuid.uuid4().hex
+
+    def acquire(self, wait=0, interval=0.05):
+        """
+        Acquire the lock, waiting up to `wait` seconds. Returns whether it has been acquired.
+        """
+        deadline = time.monotonic() + wait
+        while not cache.add(self.key, self.token, self.timeout):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(interval)
+        return True
+
+    def release(self):
+        if cache.get(self.key) == self.token:
+            cache.delete(self.key)
+
+    @property
+    def locked(self):
+        return cache.get(self.key) == self.token
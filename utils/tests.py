@@ -1,3 +1,106 @@
-from django.test import TestCase
+import uuid
 
-# Create your tests here.
+from django.test import SimpleTestCase
+from django.core.cache import cache
+from django.conf import settings
+
+from utils.versions import get_version_key
+from utils.locks import CacheLock
+from utils.watchdog import get_shard, dispatch_shards, run_shard, get_shard_stats
+
+
+class VersionKeyTestCase(SimpleTestCase):
+    def test_order(self):
+        # Each version is less than the next one, as `dpkg --compare-versions`.
+        versions = [
+            '0.9', '1', '1.0~~', '1.0~rc1', '1.0', '1.0-1', '1.0-2', '1.0a', '1.0+dfsg',
+            '1.0.0', '1.1.1f-1ubuntu2', '1.1.1f-1ubuntu2.1', '2.9', '2.10', '1:0.1',
+        ]
+        for (lower, higher) in zip(versions, versions[1:]):
+            self.assertLess(get_version_key(lower), get_version_key(higher), (lower, higher))
+
+    def test_equal(self):
+        self.assertEqual(get_version_key('1.0'), get_version_key('1.0-0'))
+        self.assertEqual(get_version_key('1.0'), get_version_key('0:1.0'))
+        self.assertEqual(get_version_key('1.01'), get_version_key('1.1'))
+
+
+class CacheLockTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.delete('test:lock')
+
+    def test_lock(self):
+        lock = CacheLock('test:lock', 60)
+        self.assertTrue(lock.acquire())
+        self.assertFalse(CacheLock('test:lock', 60).acquire())
+        lock.release()
+        self.assertTrue(CacheLock('test:lock', 60).acquire())
+        cache.delete('test:lock')
+
+    def test_expired(self):
+        # A holder whose lock has expired does not release the lock of the next holder.
+        lock = CacheLock('test:lock', 60)
+        self.assertTrue(lock.acquire())
+        cache.delete('test:lock')
+        other = CacheLock('test:lock', 60)
+        self.assertTrue(other.acquire())
+        lock.release()
+        self.assertTrue(other.locked)
+        other.release()
+        self.assertFalse(other.locked)
+
+
+class FakeTask:
+    def __init__(self):
+        self.calls = []
+
+    def delay(self, *args):
+        self.calls.append(args)
+
+
+class WatchdogTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.delete('watchdog:lock:test:0')
+
+    def test_dispatch(self):
+        pks = [uuid.uuid4() for i in range(100)]
+        task = FakeTask()
+        self.assertEqual(dispatch_shards(task, pks, shards=4), len(task.calls))
+        self.assertLessEqual(len(task.calls), 4)
+
+        # Every object is dispatched once, always to the same shard.
+        dispatched = {pk: shard for (shard, items) in task.calls for pk in items}
+        self.assertEqual(sum(len(items) for (shard, items) in task.calls), len(pks))
+        self.assertEqual(dispatched, {str(pk): get_shard(pk, 4) for pk in pks})
+
+    def test_run(self):
+        def func(obj):
+            if obj == 2:
+                raise ValueError(obj)
+
+        self.assertEqual(run_shard('test', 0, func, [1, 2, 3]), 2)
+        stats = [item for item in get_shard_stats('test') if item['shard'] == 0]
+        self.assertEqual(stats[0]['count'], 2)
+        self.assertTrue(CacheLock('watchdog:lock:test:0', 60).acquire())
+        cache.delete('watchdog:lock:test:0')
+
+    def test_overlap(self):
+        lock = CacheLock('watchdog:lock:test:0', 60)
+        self.assertTrue(lock.acquire())
+        called = []
+        self.assertIsNone(run_shard('test', 0, called.append, [1, 2, 3]))
+        self.assertEqual(called, [])
+        self.assertTrue(lock.locked)
+        lock.release()
+
+    def test_expired(self):
+        # The lock of a run expires, and the next run acquires it before the first run finishes.
+        following = CacheLock('watchdog:lock:test:0', settings.WATCHDOG_LOCK_TIMEOUT.total_seconds())
+
+        def func(obj):
+            cache.delete('watchdog:lock:test:0')
+            self.assertTrue(following.acquire())
+
+        self.assertEqual(run_shard('test', 0, func, [1]), 1)
+        self.assertTrue(following.locked)
+        following.release()
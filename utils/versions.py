@@ -0,0 +1,62 @@
+import re
+
+
+# Markers of version keys, ordered as `dpkg --compare-versions` does:
+# '~' sorts before the end of a part, which sorts before letters, which sort before other characters.
+TILDE = '!'
+END = '"'
+OTHER = '{'
+
+digits_regex = re.compile(r'\d+')
+
+
+def encode_number(value):
+    value = value.lstrip('0')
+    return '%02d%s' % (len(value), value)
+
+
+def encode_part(value):
+    """
+    Encode an upstream version or a Debian revision. The value is split into
+    alternating non-digit and digit parts, where non-digit parts are compared
+    by characters and digit parts are compared numerically.
+    """
+    key = []
+    pos = 0
+    while True:
+        match = digits_regex.search(value, pos)
+        text = value[pos:match.start()] if match else value[pos:]
+        for char in text:
+            if char == '~':
+                key.append(TILDE)
+            elif char.isascii() and char.isalpha():
+                key.append(char)
+            else:
+                key.append(OTHER + char)
+        key.append(END)
+        key.append(encode_number(match.group() if match else ''))
+        if match is None or match.end() == len(value):
+            break
+        pos = match.end()
+    key.append(END)
+    return ''.join(key)
+
+
+def get_version_key(version):
+    """
+    Return a key of a Debian-style version (`[epoch:]upstream[-revision]`),
+    of which byte-wise order (e.g., `COLLATE "C"`) is the same as the order
+    of `dpkg --compare-versions`. Versions of other package managers that
+    consist of numbers and dots, e.g., RPM and Python packages, are ordered
+    as expected as well.
+    """
+    version = (version or '').strip()
+    epoch = '0'
+    if ':' in version:
+        (head, rest) = version.split(':', 1)
+        if head.isdigit():
+            (epoch, version) = (head, rest)
+    revision = ''
+    if '-' in version:
+        (version, revision) = version.rsplit('-', 1)
+    return encode_number(epoch) + encode_part(version) + encode_part(revision)
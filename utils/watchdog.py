@@ -0,0 +1,79 @@
+import time
+import uuid
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from utils.locks import CacheLock
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_shard(pk, shards=None):
+    """
+    Return the shard number of `pk`. As the shard is derived from the
+    primary key, an object is always handled by the same shard.
+    """
+    if shards is None:
+        shards = settings.WATCHDOG_SHARDS
+    return uuid.UUID(str(pk)).int % shards
+
+
+def dispatch_shards(task, pks, shards=None):
+    """
+    Split `pks` into hash-based shards and run `task(shard, pks)` for each
+    shard as a separate subtask, so that workers can process them in parallel.
+    """
+    groups = defaultdict(list)
+    for pk in pks:
+        groups[get_shard(pk, shards)].append(str(pk))
+    for shard, items in groups.items():
+        task.delay(shard, items)
+    return len(groups)
+
+
+def run_shard(name, shard, func, objects):
+    """
+    Call `func` for each object of a shard while holding the shard lock.
+    If the previous run of the same shard is still in progress, this run is
+    skipped to avoid overlapping ticks. Duration of each run is logged and
+    kept in the cache (See `get_shard_stats`.)
+    """
+    lock = CacheLock('watchdog:lock:%s:%d' % (name, shard), settings.WATCHDOG_LOCK_TIMEOUT.total_seconds())
+    if not lock.acquire():
+        logger.warning('Skipped %s shard %d as the previous run is in progress.', name, shard)
+        return None
+
+    count = 0
+    started = time.monotonic()
+    try:
+        for obj in objects:
+            try:
+                func(obj)
+                count += 1
+            except Exception as e:
+                logger.exception(e)
+    finally:
+        duration = time.monotonic() - started
+        # If this run has outlived the lock, the lock may be held by the next run now.
+        lock.release()
+        cache.set('watchdog:stats:%s:%d' % (name, shard), {
+            'shard': shard,
+            'count': count,
+            'duration': duration,
+            'finished_at': timezone.now(),
+        }, None)
+        logger.info('Finished %s shard %d: %d objects in %.3fs.', name, shard, count, duration)
+    return count
+
+
+def get_shard_stats(name):
+    """
+    Return the statistics of the last run of each shard for watchdog `name`.
+    """
+    keys = ['watchdog:stats:%s:%d' % (name, shard) for shard in range(settings.WATCHDOG_SHARDS)]
+    return sorted(cache.get_many(keys).values(), key=lambda stats: stats['shard'])
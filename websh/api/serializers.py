@@ -9,22 +9,36 @@ from rest_framework.exceptions import ValidationError
 from websh.mixins import WebshValidationSerializer
 from websh.models import Session, UploadedFile, DownloadedFile, Channel, UserChannel, PtyChannel
 from servers.api.serializers import RelatedServerField
+from utils.api.serializers import SparseFieldsetsMixin
 
 
-class SessionSerializer(serializers.ModelSerializer):
+class SessionSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     server = RelatedServerField()
 
     class Meta:
         model = Session
         fields = ['id', 'rows', 'cols', 'server', 'server_name',
                   'user', 'user_name', 'username', 'groupname', 'user_agent', 'remote_ip',
-                  'record', 'added_at', 'updated_at', 'closed_at']
-        read_only_fields = ['id', 'record']
+                  'added_at', 'updated_at', 'closed_at']
+        read_only_fields = ['id']
+        select_related_fields = {
+            'server_name': ['server'],
+            'user_name': ['user'],
+        }
+
+
+class SessionRecordQuerySerializer(serializers.Serializer):
+    start = serializers.FloatField(min_value=0, required=False, label=_('start'))
+    end = serializers.FloatField(min_value=0, required=False, label=_('end'))
+
+    def validate(self, attrs):
+        if 'start' in attrs and 'end' in attrs and attrs['start'] > attrs['end']:
+            raise ValidationError(_('The start must not be later than the end.'))
+        return attrs
 
 
 class SessionListSerializer(SessionSerializer):
-    class Meta:
-        model = Session
+    class Meta(SessionSerializer.Meta):
         fields = ['id', 'server', 'server_name', 'user', 'user_name',
                   'username', 'groupname', 'user_agent', 'remote_ip', 'added_at', 'closed_at']
 
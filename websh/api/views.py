@@ -1,7 +1,9 @@
+import json
 import logging
 
+from django.conf import settings
 from django.utils import timezone
-from django.http.response import FileResponse
+from django.http.response import FileResponse, StreamingHttpResponse
 from django.db.models import Q
 
 from rest_framework import viewsets, status, permissions, serializers
@@ -12,12 +14,14 @@ from rest_framework.authentication import SessionAuthentication
 
 from api.apitoken.auth import APITokenAuthentication
 
+from utils.api.mixins import ConditionalGetMixin, SparseFieldsetsMixin
 from utils.api.viewsets import CreateListRetrieveViewSet, CreateUpdateListRetrieveViewSet
+from servers.models import ServerVisibility
 from websh.models import Session, UploadedFile, DownloadedFile, UserChannel
 from websh.api.serializers import (
     SessionSerializer, SessionListSerializer,
     SessionCreateSerializer, SessionUpdateSerializer,
-    SessionJoinSerializer, SessionShareSerializer,
+    SessionJoinSerializer, SessionShareSerializer, SessionRecordQuerySerializer,
     UploadedFileSerializer, DownloadedFileSerializer, DownloadedFileUploadSerializer,
 )
 from websh.api.permissions import SessionObjectPermission
@@ -25,8 +29,9 @@ from websh.api.permissions import SessionObjectPermission
 logger = logging.getLogger(__name__)
 
 
-class SessionViewSet(CreateUpdateListRetrieveViewSet):
-    queryset = Session.objects.all()
+class SessionViewSet(SparseFieldsetsMixin, ConditionalGetMixin, CreateUpdateListRetrieveViewSet):
+    # Records are fetched with `record` and `cast` actions, not with the session.
+    queryset = Session.objects.defer('legacy_record')
     serializer_class = SessionSerializer
     authentication_classes = [SessionAuthentication, APITokenAuthentication]
     permission_classes = [SessionObjectPermission]
@@ -36,14 +41,15 @@ class SessionViewSet(CreateUpdateListRetrieveViewSet):
         'user__first_name', 'user__last_name', 'user__username'
     ]
     ordering = ['-added_at']
+    conditional_fields = ['updated_at', 'closed_at']
 
     def get_queryset(self):
         queryset = super().get_queryset()
         if not (self.request.user.is_staff or self.request.user.is_superuser) and self.action != 'join':
             queryset = queryset.filter(
-                Q(server__groups__membership__user__pk=self.request.user.pk)
+                Q(server__pk__in=ServerVisibility.get_server_pks(self.request.user))
                 | Q(server__owner__pk=self.request.user.pk)
-            ).distinct()
+            )
         if self.action in ['update', 'partial_update', 'share']:
             queryset = queryset.filter(
                 user__pk=self.request.user.pk,
@@ -84,6 +90,68 @@ class SessionViewSet(CreateUpdateListRetrieveViewSet):
             'expiration': user_channel.token_expired_at,
         }, status=status.HTTP_201_CREATED)
 
+    # Viewers action returns connected channels of the session with metrics of their output queues.
+    # `lag` is the age of the oldest pending output in seconds, and `dropped` is the bytes dropped so far.
+    @action(detail=True, methods=['get'])
+    def viewers(self, request, pk=None):
+        instance = self.get_object()
+        channels = list(instance.userchannel_set.select_related('user').filter(
+            opened_at__isnull=False,
+            closed_at__isnull=True,
+        ).order_by('opened_at'))
+        metrics = UserChannel.get_metrics(channels)
+        viewers = [{
+            'id': channel.pk,
+            'user': channel.user_id,
+            'user_name': str(channel.user) if channel.user else None,
+            'remote_ip': channel.remote_ip,
+            'is_master': channel.is_master,
+            'read_only': channel.read_only,
+            'opened_at': channel.opened_at,
+            'metrics': metrics[channel.pk],
+        } for channel in channels]
+        return Response({
+            'lag': max([viewer['metrics']['lag'] for viewer in viewers if viewer['metrics']], default=0.0),
+            'dropped': sum(viewer['metrics']['dropped'] for viewer in viewers if viewer['metrics']),
+            'viewers': viewers,
+        }, status=status.HTTP_200_OK)
+
+    # Record action returns output events between `start` and `end` seconds. Long ranges are
+    # cut at about WEBSH_RECORD_PAGE_SIZE characters, and the rest can be fetched from `next`.
+    @action(detail=True, methods=['get'])
+    def record(self, request, pk=None):
+        instance = self.get_object()
+        serializer = SessionRecordQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        start = serializer.validated_data.get('start', None)
+        end = serializer.validated_data.get('end', None)
+
+        (events, next_offset) = instance.get_record_page(start=start, end=end)
+        return Response({
+            'header': instance.get_record_header(),
+            'duration': instance.duration,
+            'start': start or 0.0,
+            'end': end,
+            'next': next_offset,
+            'events': events,
+        }, status=status.HTTP_200_OK)
+
+    # Cast action streams the record in asciicast v2 format for playback.
+    @action(detail=True, methods=['get'])
+    def cast(self, request, pk=None):
+        instance = self.get_object()
+        serializer = SessionRecordQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+
+        def stream():
+            yield json.dumps(instance.get_record_header()) + '\n'
+            for event in instance.get_record_events(**serializer.validated_data):
+                yield json.dumps(event, ensure_ascii=False) + '\n'
+
+        response = StreamingHttpResponse(stream(), content_type='application/x-asciicast')
+        response['Content-Disposition'] = 'attachment; filename="%s.cast"' % instance.pk
+        return response
+
     # Join action returns a websocket URL, obtained via the shared_url provided by the share action
     @action(detail=True, methods=['post'], permission_classes=[permissions.AllowAny], serializer_class=SessionJoinSerializer)
     def join(self, request, pk=None):
@@ -101,9 +169,9 @@ class ServerQuerySetMixin:
         else:
             if not (self.request.user.is_staff or self.request.user.is_superuser):
                 queryset = queryset.filter(
-                    Q(server__groups__membership__user__pk=self.request.user.pk)
+                    Q(server__pk__in=ServerVisibility.get_server_pks(self.request.user))
                     | Q(server__owner__pk=self.request.user.pk)
-                ).distinct()
+                )
         return queryset
 
 
@@ -125,7 +193,7 @@ class FileDownloadMixin:
             raise NotFound('File does not exist.')
 
 
-class UploadedFileViewSet(ServerQuerySetMixin, FileDownloadMixin, CreateListRetrieveViewSet):
+class UploadedFileViewSet(ServerQuerySetMixin, FileDownloadMixin, ConditionalGetMixin, CreateListRetrieveViewSet):
     queryset = UploadedFile.objects.all()
     serializer_class = UploadedFileSerializer
     filterset_fields = ['server', 'user', 'username', 'groupname']
@@ -140,7 +208,7 @@ class UploadedFileViewSet(ServerQuerySetMixin, FileDownloadMixin, CreateListRetr
         obj.upload()
 
 
-class DownloadedFileViewSet(ServerQuerySetMixin, FileDownloadMixin, CreateListRetrieveViewSet):
+class DownloadedFileViewSet(ServerQuerySetMixin, FileDownloadMixin, ConditionalGetMixin, CreateListRetrieveViewSet):
     queryset = DownloadedFile.objects.all()
     serializer_class = DownloadedFileSerializer
     filterset_fields = ['server', 'user', 'username', 'groupname']
@@ -0,0 +1,197 @@
+import time
+import asyncio
+from collections import deque
+
+from django.conf import settings
+
+
+class RecordBuffer:
+    """
+    A bounded buffer of terminal output to be recorded. Raw output is appended
+    with its offset from the start of the session by `append()`, which returns
+    True once `chunk_size` bytes are buffered or `flush_interval` seconds
+    have passed since the first pending output. Then, the caller should
+    `take()` the `(offset, data)` frames and store them as a chunk.
+    """
+
+    def __init__(self, chunk_size=None, flush_interval=None):
+        self.chunk_size = chunk_size or settings.WEBSH_RECORD_CHUNK_SIZE
+        self.flush_interval = flush_interval or settings.WEBSH_RECORD_FLUSH_INTERVAL
+        self.frames = []
+        self.size = 0
+        self.since = None
+
+    def __len__(self):
+        return self.size
+
+    def append(self, data, offset):
+        if data:
+            if self.since is None:
+                self.since = time.monotonic()
+            self.frames.append((offset, data))
+            self.size += len(data)
+        return self.is_full() or self.is_due()
+
+    def is_full(self):
+        return self.size >= self.chunk_size
+
+    def is_due(self):
+        return self.since is not None and time.monotonic() - self.since >= self.flush_interval
+
+    def take(self):
+        frames = self.frames
+        self.frames = []
+        self.size = 0
+        self.since = None
+        return frames
+
+
+class OutputCoalescer:
+    """
+    Batch small writes of raw terminal output before sending them with `send`.
+    Output is sent `delay` seconds after the first pending write, or as soon
+    as `max_size` bytes are pending.
+
+    Batches are sent one at a time. A write that fills a batch waits until it
+    is sent, and the total rate is limited to `max_rate` bytes per second,
+    so that the caller stops reading the output of runaway processes instead
+    of flooding the channel layer.
+    """
+
+    def __init__(self, send, delay=None, max_size=None, max_rate=None):
+        self.send = send
+        self.delay = settings.WEBSH_OUTPUT_DELAY if delay is None else delay
+        self.max_size = max_size or settings.WEBSH_OUTPUT_MAX_SIZE
+        self.max_rate = settings.WEBSH_OUTPUT_MAX_RATE if max_rate is None else max_rate
+        self.parts = []
+        self.size = 0
+        self.lock = asyncio.Lock()
+        self.timer = None
+        self.window_started = time.monotonic()
+        self.window_size = 0
+
+    async def write(self, data):
+        if not data:
+            return
+        self.parts.append(data)
+        self.size += len(data)
+        if self.size >= self.max_size:
+            await self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.delay, self.schedule_flush)
+
+    def schedule_flush(self):
+        self.timer = None
+        asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        async with self.lock:
+            if not self.parts:
+                return
+            data = b''.join(self.parts)
+            self.parts = []
+            self.size = 0
+            await self.throttle(len(data))
+            await self.send(data)
+
+    async def throttle(self, size):
+        if not self.max_rate:
+            return
+        now = time.monotonic()
+        if now - self.window_started >= 1:
+            self.window_started = now
+            self.window_size = 0
+        self.window_size += size
+        if self.window_size > self.max_rate:
+            # Wait until the output in this window is within the rate.
+            await asyncio.sleep(self.window_size / self.max_rate - (now - self.window_started))
+            self.window_started = time.monotonic()
+            self.window_size = 0
+
+    async def close(self):
+        await self.flush()
+
+
+class ViewerQueue:
+    """
+    A bounded queue of output to be sent to a viewer of a session. When more
+    than `max_size` bytes are pending, `policy` decides what happens.
+
+    - `drop-oldest`: The oldest output is dropped to make room.
+    - `resync`: All pending output is dropped, and the viewer should be sent a
+      snapshot of the terminal instead.
+    - `disconnect`: The viewer should be disconnected.
+
+    In the latter two cases, `get()` returns None and `overflowed` is set
+    until the caller handles it with `reset()`.
+    """
+
+    POLICIES = ['drop-oldest', 'resync', 'disconnect']
+
+    def __init__(self, max_size=None, policy=None):
+        self.max_size = max_size or settings.WEBSH_VIEWER_QUEUE_SIZE
+        self.policy = policy or settings.WEBSH_VIEWER_POLICY
+        if self.policy not in self.POLICIES:
+            raise ValueError('Unknown policy: %s' % self.policy)
+        self.items = deque()
+        self.size = 0
+        self.dropped = 0
+        self.overflows = 0
+        self.overflowed = False
+        self.event = asyncio.Event()
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def lag(self):
+        """
+        Seconds since the oldest pending output was queued.
+        """
+        if not self.items:
+            return 0.0
+        return time.monotonic() - self.items[0][0]
+
+    def put(self, data):
+        if not data:
+            return
+        if self.size + len(data) > self.max_size:
+            self.overflows += 1
+            if self.policy == 'drop-oldest':
+                while self.items and self.size + len(data) > self.max_size:
+                    (queued_at, item) = self.items.popleft()
+                    self.size -= len(item)
+                    self.dropped += len(item)
+                if len(data) > self.max_size:
+                    self.dropped += len(data) - self.max_size
+                    data = data[-self.max_size:]
+            else:
+                self.dropped += self.size + len(data)
+                self.items.clear()
+                self.size = 0
+                self.overflowed = True
+                self.event.set()
+                return
+        self.items.append((time.monotonic(), data))
+        self.size += len(data)
+        self.event.set()
+
+    async def get(self):
+        """
+        Wait for and return all pending output, or None if the queue has overflowed.
+        """
+        while not self.items and not self.overflowed:
+            self.event.clear()
+            await self.event.wait()
+        if self.overflowed:
+            return None
+        data = b''.join(item for (queued_at, item) in self.items)
+        self.items.clear()
+        self.size = 0
+        return data
+
+    def reset(self):
+        self.overflowed = False
@@ -1,8 +1,12 @@
 import abc
+import time
+import codecs
+import asyncio
 import logging
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.utils import timezone
 from django.core.exceptions import ObjectDoesNotExist
 
@@ -12,11 +16,15 @@ from channels.db import database_sync_to_async
 from termcolor import colored
 
 from websh.models import UserChannel, PtyChannel
+from websh.buffers import RecordBuffer, OutputCoalescer, ViewerQueue
 
 User = get_user_model()
 
 logger = logging.getLogger(__name__)
 
+# Clients requesting this subprotocol exchange terminal I/O in binary frames. Otherwise, text frames are used.
+BINARY_SUBPROTOCOL = 'websh.binary'
+
 WELCOME_MESSAGE = '''
 
  (`-')  _           _  (`-') (`-')  _                      <-. (`-')_ 
@@ -32,6 +40,16 @@ WELCOME_MESSAGE = '''
 
 
 class SessionConsumer(AsyncWebsocketConsumer):
+    """
+    Terminal I/O is passed through the channel layer as raw bytes (`data`).
+    Each consumer converts it to the frame type negotiated with its client,
+    decoding UTF-8 incrementally for text clients so that characters split
+    across messages are kept.
+    """
+
+    binary = False
+    decoder = None
+
     def get_remote_ip(self):
         if 'client' in self.scope:
             remote_ip = self.scope['client'][0]
@@ -90,7 +108,30 @@ class SessionConsumer(AsyncWebsocketConsumer):
             # self.channel_name
             self.channel.channel_name
         )
-        await self.accept()
+        self.binary = BINARY_SUBPROTOCOL in self.scope.get('subprotocols', [])
+        if not self.binary:
+            self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        await self.accept(subprotocol=BINARY_SUBPROTOCOL if self.binary else None)
+
+    @staticmethod
+    def get_data(text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            return bytes_data
+        return (text_data or '').encode('utf-8')
+
+    async def send_data(self, data):
+        if self.binary:
+            await self.send(bytes_data=data)
+        else:
+            text = self.decoder.decode(data)
+            if text:
+                await self.send(text_data=text)
+
+    async def send_message(self, message):
+        if self.binary:
+            await self.send(bytes_data=message.encode('utf-8'))
+        else:
+            await self.send(text_data=message)
 
     async def disconnect(self, close_code):
         if hasattr(self, 'group_name'):
@@ -102,7 +143,8 @@ class SessionConsumer(AsyncWebsocketConsumer):
                 self.group_name,
                 {
                     'type': 'leave_message',
-                    'message': 'exit'
+                    'message': 'exit',
+                    'session': str(self.session.id),
                 }
             )
         if hasattr(self, 'channel'):
@@ -116,6 +158,11 @@ class SessionConsumer(AsyncWebsocketConsumer):
 class WebshConsumer(SessionConsumer):
     name = 'websh'
     channel_model = UserChannel
+    record_buffer = None
+    flush_task = None
+    queue = None
+    write_task = None
+    metrics_updated_at = 0
 
     @database_sync_to_async
     def get_channel(self):
@@ -139,9 +186,23 @@ class WebshConsumer(SessionConsumer):
         if not hasattr(self, 'session'):
             return
 
-        await self.send(text_data=(
-                'Please wait until ' + colored('[%s]' % self.session.server, 'green') + ' becomes connected...'
-        ))
+        # Only the master channel records the output, as all channels receive the same output.
+        if self.channel.is_master:
+            self.record_buffer = RecordBuffer()
+            self.flush_task = asyncio.create_task(self.flush_periodically())
+
+        # Output is sent from a queue per viewer, so that a slow viewer does not hold up the
+        # channel layer for others. The master is resynced instead of being disconnected.
+        policy = settings.WEBSH_VIEWER_POLICY
+        if self.channel.is_master and policy == 'disconnect':
+            policy = 'resync'
+        self.queue = ViewerQueue(policy=policy)
+        self.tail = bytearray()
+        self.write_task = asyncio.create_task(self.write_output())
+
+        await self.send_message(
+            'Please wait until ' + colored('[%s]' % self.session.server, 'green') + ' becomes connected...'
+        )
 
         pty_channel = await self.get_pty_channel()
         await database_sync_to_async(self.session.open_terminal)(pty_channel)
@@ -152,31 +213,87 @@ class WebshConsumer(SessionConsumer):
                 self.group_name,
                 {
                     'type': 'user_message',
-                    'message': text_data
+                    'data': self.get_data(text_data, bytes_data),
+                    'session': str(self.session.id),
                 }
             )
 
     async def disconnect(self, close_code):
+        if self.write_task is not None:
+            self.write_task.cancel()
+            await cache.adelete(self.channel.metrics_key)
         # Only Master User can disconnect the websh connection
         if self.channel.is_master:
             try:
+                if self.flush_task is not None:
+                    self.flush_task.cancel()
                 if hasattr(self, 'session'):
+                    await self.flush_record()
                     self.session.closed_at = timezone.now()
                     logger.debug('%s left websh for %s.', self.session.user, self.session.server)
                     await database_sync_to_async(
                         self.session.save
                     )(
-                        update_fields=['record', 'updated_at', 'closed_at']
+                        update_fields=['updated_at', 'closed_at']
                     )
             except Exception as e:
                 logger.exception(e)
             await super().disconnect(close_code)
 
+    async def flush_record(self):
+        if self.record_buffer is not None and len(self.record_buffer) > 0:
+            await database_sync_to_async(self.session.append_record)(self.record_buffer.take())
+
+    async def flush_periodically(self):
+        # Flush output even if the terminal becomes idle.
+        while True:
+            await asyncio.sleep(self.record_buffer.flush_interval)
+            try:
+                if self.record_buffer.is_due():
+                    await self.flush_record()
+            except Exception as e:
+                logger.exception(e)
+
     async def pty_message(self, event):
-        message = event['message']
-        if hasattr(self, 'session'):
-            self.session.record += event['message']
-        await self.send(text_data=message)
+        data = event['data']
+        if self.record_buffer is not None and self.record_buffer.append(data, self.session.get_record_offset()):
+            await self.flush_record()
+        if self.queue is not None:
+            self.tail.extend(data)
+            del self.tail[:-settings.WEBSH_VIEWER_RESYNC_SIZE]
+            overflows = self.queue.overflows
+            self.queue.put(data)
+            await self.update_metrics(force=self.queue.overflows != overflows)
+
+    async def write_output(self):
+        while True:
+            data = await self.queue.get()
+            if data is not None:
+                await self.send_data(data)
+            elif self.queue.policy == 'resync':
+                # Reset the terminal and redraw it from the recent output.
+                logger.info('Resyncing a slow viewer of %s.', self.session)
+                self.queue.reset()
+                if self.decoder is not None:
+                    self.decoder.reset()
+                await self.send_data(b'\x1bc' + bytes(self.tail))
+            else:
+                logger.info('Disconnecting a slow viewer of %s.', self.session)
+                await self.close(code=4008)
+                return
+
+    async def update_metrics(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.metrics_updated_at < 1:
+            return
+        self.metrics_updated_at = now
+        await cache.aset(self.channel.metrics_key, {
+            'queued': len(self.queue),
+            'lag': round(self.queue.lag, 3),
+            'dropped': self.queue.dropped,
+            'overflows': self.queue.overflows,
+            'policy': self.queue.policy,
+        }, settings.WEBSH_VIEWER_METRICS_TIMEOUT)
 
     async def user_message(self, event):
         pass
@@ -189,19 +306,26 @@ class WebshConsumer(SessionConsumer):
                 break
         if hasattr(self, 'session'):
             record_url = url_prefix + self.session.get_absolute_url()
-            await self.send(text_data=(
-                    '\r\nSession closed. Terminal became inactive.\r\n'
-                    'Please ' + colored('reload', 'yellow')
-                    + ' this page to open the terminal again.\r\n\r\n'
+            if self.queue is not None and len(self.queue) > 0:
+                # Send pending output before the notice.
+                self.write_task.cancel()
+                data = await self.queue.get()
+                if data:
+                    await self.send_data(data)
+            await self.send_message(
+                '\r\nSession closed. Terminal became inactive.\r\n'
+                'Please ' + colored('reload', 'yellow')
+                + ' this page to open the terminal again.\r\n\r\n'
                 # + 'Checkout '
                 # + colored(record_url, 'cyan')
                 # + ' for the websh history.'
-            ))
+            )
         await self.close()
 
 
 class PtyConsumer(SessionConsumer):
     channel_model = PtyChannel
+    output = None
 
     @database_sync_to_async
     def get_session(self):
@@ -217,33 +341,46 @@ class PtyConsumer(SessionConsumer):
             return
 
         logger.debug('%s connected to the pty.', self.session.server)
+        self.output = OutputCoalescer(self.send_output)
         await self.channel_layer.group_send(
             self.group_name,
             {
                 'type': 'pty_message',
-                'message': WELCOME_MESSAGE
+                'data': WELCOME_MESSAGE.encode('utf-8')
             }
         )
         await self.channel_layer.group_send(
             self.group_name,
             {
                 'type': 'pty_message',
-                'message': 'Websh for ' + colored('[%s]' % self.session.server, 'green') + ' became ready.\r\n'
+                'data': ('Websh for ' + colored('[%s]' % self.session.server, 'green') + ' became ready.\r\n').encode('utf-8')
             }
         )
 
     async def receive(self, text_data=None, bytes_data=None):
+        # PTY output often comes in frames of a few bytes, so it is batched before being sent to the group.
+        if self.output is not None:
+            await self.output.write(self.get_data(text_data, bytes_data))
+
+    async def send_output(self, data):
         await self.channel_layer.group_send(
             self.group_name,
             {
                 'type': 'pty_message',
-                'message': text_data
+                'data': data
             }
         )
 
+    async def disconnect(self, close_code):
+        if self.output is not None:
+            try:
+                await self.output.close()
+            except Exception as e:
+                logger.exception(e)
+        await super().disconnect(close_code)
+
     async def user_message(self, event):
-        message = event['message']
-        await self.send(text_data=message)
+        await self.send_data(event['data'])
 
     async def pty_message(self, event):
         pass
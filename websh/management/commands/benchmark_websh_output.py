@@ -0,0 +1,77 @@
+import time
+import uuid
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from channels.layers import get_channel_layer
+
+from websh.buffers import OutputCoalescer
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the throughput of PTY output through the channel layer to a websh viewer, '
+        'with a group message per frame (unbatched) and with OutputCoalescer (batched).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--frames', type=int, default=20000, help='Number of frames from the PTY.')
+        parser.add_argument('--frame-size', type=int, default=64, help='Size of each frame in bytes.')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds to wait for the viewer.')
+
+    def handle(self, *args, **options):
+        for name in ('unbatched', 'batched'):
+            result = asyncio.run(self.run(name == 'batched', options['frames'], options['frame_size'], options['timeout']))
+            self.stdout.write(
+                '%(name)-9s %(elapsed).2fs, %(rate).1f KB/s, %(messages)d messages, %(dropped)d bytes dropped' % {
+                    'name': name,
+                    **result,
+                }
+            )
+
+    async def run(self, batched, frames, frame_size, timeout):
+        channel_layer = get_channel_layer()
+        group_name = 'websh-benchmark-%s' % uuid.uuid4().hex
+        channel_name = await channel_layer.new_channel()
+        await channel_layer.group_add(group_name, channel_name)
+
+        total = frames * frame_size
+        received = 0
+        messages = 0
+
+        async def send(data):
+            nonlocal messages
+            messages += 1
+            await channel_layer.group_send(group_name, {'type': 'pty_message', 'data': data})
+
+        async def drain():
+            nonlocal received
+            while received < total:
+                event = await channel_layer.receive(channel_name)
+                received += len(event['data'])
+
+        frame = b'x' * (frame_size - 2) + b'\r\n'
+        task = asyncio.create_task(drain())
+        started = time.perf_counter()
+        if batched:
+            output = OutputCoalescer(send, max_rate=0)
+            for _ in range(frames):
+                await output.write(frame)
+            await output.close()
+        else:
+            for _ in range(frames):
+                await send(frame)
+        try:
+            # Messages to full channels are dropped by the channel layer, so the viewer may never receive all.
+            await asyncio.wait_for(task, timeout)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - started
+        await channel_layer.group_discard(group_name, channel_name)
+        return {
+            'elapsed': elapsed,
+            'rate': received / elapsed / 1024,
+            'messages': messages,
+            'dropped': total - received,
+        }
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.9 on 2026-10-19 10:00
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('websh', '0014_remove_session_root_downloadedfile_command_and_more'),
+    ]
+
+    operations = [
+        # Keep the existing `record` column for sessions recorded before chunks.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RemoveField(
+                    model_name='session',
+                    name='record',
+                ),
+                migrations.AddField(
+                    model_name='session',
+                    name='legacy_record',
+                    field=models.TextField(db_column='record', default='', editable=False, verbose_name='legacy record'),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SessionRecordChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveIntegerField(verbose_name='sequence')),
+                ('started', models.FloatField(default=0.0, verbose_name='started')),
+                ('ended', models.FloatField(default=0.0, verbose_name='ended')),
+                ('data', models.BinaryField(verbose_name='data')),
+                ('size', models.PositiveIntegerField(default=0, verbose_name='size')),
+                ('added_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='added at')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='record_chunks', to='websh.session', verbose_name='session')),
+            ],
+            options={
+                'verbose_name': 'session record chunk',
+                'verbose_name_plural': 'session record chunks',
+                'indexes': [models.Index(fields=['session', 'ended'], name='websh_record_chunk_ended')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='sessionrecordchunk',
+            constraint=models.UniqueConstraint(fields=('session', 'seq'), name='websh_record_chunk_session_seq'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.9 on 2024-03-11 10:20
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('websh', '0015_sessionrecordchunk'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='session',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('username'), name='gin_trgm_ops'), name='websh_session_username_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='session',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('groupname'), name='gin_trgm_ops'), name='websh_session_groupname_trgm'),
+        ),
+    ]
@@ -4,6 +4,8 @@ from rest_framework.exceptions import ValidationError
 
 from rest_framework import serializers
 
+from servers.access import AccessEvaluator
+
 class WebshValidationSerializer(serializers.ModelSerializer):
     def validate(self, attrs):
         attrs = super().validate(attrs)
@@ -38,8 +40,8 @@ class WebshValidationSerializer(serializers.ModelSerializer):
                     _('Username or groupname is not registered or you do not have permission.')
                 )
 
-        if not attrs['server'].has_access(
-                user=user,
+        if not AccessEvaluator.for_request(self.context['request']).has_access(
+                attrs['server'],
                 username=attrs['username'],
                 groupname=attrs['groupname'],
         ):
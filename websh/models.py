@@ -1,10 +1,16 @@
 import os
 import json
+import zlib
+import codecs
+import struct
 import logging
 from datetime import timedelta
 
 from django.db import models
+from django.db.models.functions import Upper
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.conf import settings
+from django.core.cache import cache
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.crypto import get_random_string
@@ -23,7 +29,8 @@ class Session(UUIDBaseModel):
     rows = models.PositiveSmallIntegerField(_('terminal rows'), default=0)
     cols = models.PositiveSmallIntegerField(_('terminal cols'), default=0)
 
-    record = models.TextField(_('record'), default='')
+    # Records of sessions before chunked recording. New output is appended to `record_chunks`.
+    legacy_record = models.TextField(_('legacy record'), default='', editable=False, db_column='record')
 
     server = models.ForeignKey(
         'servers.Server', on_delete=models.CASCADE,
@@ -42,10 +49,17 @@ class Session(UUIDBaseModel):
     closed_at = models.DateTimeField(_('closed_at'), null=True, editable=False)
 
     _user_channel = None
+    _record = None
+    _record_seq = None
 
     class Meta:
         verbose_name = _('session')
         verbose_name_plural = _('sessions')
+        indexes = [
+            # Trigram indexes for `icontains` lookups. (See `api.filters.IndexedSearchFilter`.)
+            GinIndex(OpClass(Upper('username'), name='gin_trgm_ops'), name='websh_session_username_trgm'),
+            GinIndex(OpClass(Upper('groupname'), name='gin_trgm_ops'), name='websh_session_groupname_trgm'),
+        ]
 
     def __str__(self):
         return '%(server)s-%(date)s by %(user)s' % {
@@ -63,6 +77,121 @@ class Session(UUIDBaseModel):
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
 
+    @property
+    def record(self):
+        """
+        The whole terminal output of this session, assembled from the chunks on first access.
+        """
+        if self._record is None:
+            self._record = b''.join(data for (offset, data) in self.get_record_frames()).decode('utf-8', 'replace')
+        return self._record
+
+    @property
+    def duration(self):
+        """
+        The offset of the last recorded output in seconds.
+        """
+        return self.record_chunks.aggregate(duration=models.Max('ended'))['duration'] or 0.0
+
+    def get_record_offset(self, when=None):
+        """
+        Return the offset of `when` (default: now) from the start of this session in seconds.
+        """
+        return round(((when or timezone.now()) - self.added_at).total_seconds(), 6)
+
+    def get_record_header(self):
+        """
+        Return the header of this record in asciicast v2 format.
+        """
+        return {
+            'version': 2,
+            'width': self.cols,
+            'height': self.rows,
+            'timestamp': int(self.added_at.timestamp()),
+        }
+
+    def get_record_frames(self, start=None, end=None):
+        """
+        Yield `(offset, data)` frames of raw output between `start` and `end`
+        seconds. Only the chunks overlapping the range are loaded. Records
+        before chunked recording have no timing and are yielded at 0.
+        """
+        if self.legacy_record and (start is None or start <= 0):
+            yield (0.0, self.legacy_record.encode('utf-8'))
+
+        chunks = self.record_chunks.order_by('seq')
+        if start is not None:
+            chunks = chunks.filter(ended__gte=start)
+        if end is not None:
+            chunks = chunks.filter(started__lte=end)
+        # Fetch a few chunks at a time, as pages usually need only the first ones.
+        for chunk in chunks.iterator(chunk_size=16):
+            for (offset, data) in chunk.get_frames():
+                if start is not None and offset < start:
+                    continue
+                if end is not None and offset > end:
+                    return
+                yield (offset, data)
+
+    def get_record_events(self, start=None, end=None):
+        """
+        Yield `(offset, 'o', text)` output events in asciicast v2 format between
+        `start` and `end` seconds. Characters split across frames are decoded
+        together, and invalid byte sequences are replaced.
+        """
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        for (offset, data) in self.get_record_frames(start=start, end=end):
+            text = decoder.decode(data)
+            if text:
+                yield (offset, 'o', text)
+        text = decoder.decode(b'', final=True)
+        if text:
+            yield (offset, 'o', text)
+
+    def get_record_page(self, start=None, end=None, size=None):
+        """
+        Return output events from `start` as `get_record_events()` does, up to
+        about `size` characters, and the offset of the next page or None.
+        Pages are cut only where no bytes of a split character are pending,
+        so that the next page decodes to the same text.
+        """
+        if size is None:
+            size = settings.WEBSH_RECORD_PAGE_SIZE
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        events = []
+        total = 0
+        for (offset, data) in self.get_record_frames(start=start, end=end):
+            if total >= size and offset > events[-1][0] and not decoder.getstate()[0]:
+                return (events, offset)
+            text = decoder.decode(data)
+            if text:
+                events.append((offset, 'o', text))
+                total += len(text)
+        text = decoder.decode(b'', final=True)
+        if text:
+            events.append((offset, 'o', text))
+        return (events, None)
+
+    def append_record(self, frames):
+        """
+        Append `(offset, data)` frames of raw output to the record of this session as a new chunk.
+        """
+        if not frames:
+            return None
+        if self._record_seq is None:
+            self._record_seq = self.record_chunks.aggregate(seq=models.Max('seq'))['seq'] or 0
+        self._record_seq += 1
+        chunk = SessionRecordChunk.objects.create(
+            session=self,
+            seq=self._record_seq,
+            started=frames[0][0],
+            ended=frames[-1][0],
+            data=SessionRecordChunk.encode_frames(frames),
+            size=sum(len(data) for (offset, data) in frames),
+        )
+        self._record = None
+        return chunk
+
     @property
     def user_agent(self):
         if self._user_channel is None:
@@ -100,6 +229,9 @@ class Session(UUIDBaseModel):
             'cols': self.cols,
         }
 
+        # Agents supporting multiplexing open a stream of this session on the backhaul instead of `url`.
+        if settings.WEBSH_MULTIPLEX:
+            data['stream'] = True
         data['username'] = self.username
         data['groupname'] = self.groupname
         # Due to macOS not supporting adduser
@@ -129,6 +261,58 @@ class Session(UUIDBaseModel):
         )
 
 
+class SessionRecordChunk(models.Model):
+    """
+    An append-only chunk of the terminal output of a session. Consumers buffer
+    output and flush it as a chunk by size or time (See `websh.buffers.RecordBuffer`),
+    so that recordings are not kept in memory and are not lost on crashes.
+
+    Output is stored as raw bytes in frames of an offset, a length and data,
+    and `started` and `ended` index the chunk by the offsets of its first and
+    last frames.
+    """
+
+    session = models.ForeignKey(
+        'websh.Session', on_delete=models.CASCADE,
+        related_name='record_chunks',
+        verbose_name=_('session')
+    )
+    seq = models.PositiveIntegerField(_('sequence'))
+    started = models.FloatField(_('started'), default=0.0)
+    ended = models.FloatField(_('ended'), default=0.0)
+    data = models.BinaryField(_('data'))  # zlib-compressed frames
+    size = models.PositiveIntegerField(_('size'), default=0)
+    added_at = models.DateTimeField(_('added at'), default=timezone.now)
+
+    class Meta:
+        verbose_name = _('session record chunk')
+        verbose_name_plural = _('session record chunks')
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'seq'], name='websh_record_chunk_session_seq'),
+        ]
+        indexes = [
+            models.Index(fields=['session', 'ended'], name='websh_record_chunk_ended'),
+        ]
+
+    FRAME_HEADER = struct.Struct('!dI')  # offset in seconds, length of data
+
+    @classmethod
+    def encode_frames(cls, frames):
+        return zlib.compress(b''.join(
+            cls.FRAME_HEADER.pack(offset, len(data)) + data
+            for (offset, data) in frames
+        ))
+
+    def get_frames(self):
+        buffer = zlib.decompress(bytes(self.data))
+        position = 0
+        while position < len(buffer):
+            (offset, length) = self.FRAME_HEADER.unpack_from(buffer, position)
+            position += self.FRAME_HEADER.size
+            yield (offset, buffer[position:position + length])
+            position += length
+
+
 class Channel(UUIDBaseModel):
     CHANNEL_TOKEN_LENGTH = 32
 
@@ -201,6 +385,18 @@ class UserChannel(Channel):
     def is_password_valid(self, password):
         return self.password == password
 
+    @property
+    def metrics_key(self):
+        return 'websh:viewer:%s' % self.pk
+
+    @classmethod
+    def get_metrics(cls, channels):
+        """
+        Return the output queue metrics of connected `channels` reported by their consumers.
+        """
+        metrics = cache.get_many([channel.metrics_key for channel in channels])
+        return {channel.pk: metrics.get(channel.metrics_key, None) for channel in channels}
+
 
 class PtyChannel(Channel):
     class Meta:
@@ -0,0 +1,246 @@
+import uuid
+import struct
+import asyncio
+import logging
+from collections import deque
+
+from django.conf import settings
+
+from channels.db import database_sync_to_async
+
+from termcolor import colored
+
+from websh.models import Session
+from websh.buffers import OutputCoalescer
+from websh.consumer import WELCOME_MESSAGE
+
+
+logger = logging.getLogger(__name__)
+
+# Binary frames on the backhaul: a frame type, the session ID as a stream ID, and the payload.
+FRAME_HEADER = struct.Struct('!B16s')
+CREDIT = struct.Struct('!I')
+(FRAME_OPEN, FRAME_DATA, FRAME_CREDIT, FRAME_CLOSE) = range(4)
+
+# Maximum bytes sent to a stream in a round of scheduling.
+QUANTUM = 16*1024
+
+
+def pack_frame(kind, stream_id, payload=b''):
+    return FRAME_HEADER.pack(kind, stream_id.bytes) + payload
+
+
+def unpack_frame(data):
+    if len(data) < FRAME_HEADER.size:
+        raise ValueError('Frame of %d bytes is shorter than its header.' % len(data))
+    (kind, stream_id) = FRAME_HEADER.unpack_from(data)
+    return (kind, uuid.UUID(bytes=stream_id), data[FRAME_HEADER.size:])
+
+
+class Stream:
+    """
+    A PTY of a websh session carried over the backhaul of its server. This
+    takes the place of `PtyConsumer` for the session.
+
+    Both sides may send WEBSH_STREAM_WINDOW bytes of data per stream, and
+    return credits for data as they consume it with `FRAME_CREDIT`.
+    """
+
+    def __init__(self, multiplexer, session):
+        self.multiplexer = multiplexer
+        self.session = session
+        self.id = session.id
+        self.group_name = 'websh-%s' % session.id
+        self.output = OutputCoalescer(self.send_output)
+        self.inbound = asyncio.Queue()
+        self.inbound_window = settings.WEBSH_STREAM_WINDOW
+        self.pending = deque()
+        self.credit = settings.WEBSH_STREAM_WINDOW
+        self.task = asyncio.create_task(self.forward())
+
+    @property
+    def channel_layer(self):
+        return self.multiplexer.consumer.channel_layer
+
+    async def send_output(self, data):
+        await self.channel_layer.group_send(self.group_name, {
+            'type': 'pty_message',
+            'data': data,
+        })
+
+    def receive(self, data):
+        self.inbound_window -= len(data)
+        if self.inbound_window < 0:
+            raise ValueError('Stream %s has exceeded its window.' % self.id)
+        self.inbound.put_nowait(data)
+
+    async def forward(self):
+        # Output is forwarded per stream so that a busy stream does not hold up the others.
+        try:
+            while True:
+                data = await self.inbound.get()
+                await self.output.write(data)
+                self.inbound_window += len(data)
+                await self.multiplexer.send_frame(FRAME_CREDIT, self.id, CREDIT.pack(len(data)))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Credits would not be returned anymore, so close the stream instead of stalling it.
+            logger.exception(e)
+            await self.multiplexer.close(self.id)
+
+    def take_input(self):
+        size = min(QUANTUM, self.credit)
+        parts = []
+        while self.pending and size > 0:
+            data = self.pending.popleft()
+            if len(data) > size:
+                self.pending.appendleft(data[size:])
+                data = data[:size]
+            parts.append(data)
+            size -= len(data)
+        data = b''.join(parts)
+        self.credit -= len(data)
+        return data
+
+    async def close(self):
+        if self.task is not asyncio.current_task():
+            self.task.cancel()
+        try:
+            await self.output.close()
+        except Exception as e:
+            logger.exception(e)
+
+
+class StreamMultiplexer:
+    """
+    Carry PTY streams of websh sessions as sub-channels of the backhaul
+    connection of a server, instead of a websocket per terminal.
+
+    The agent opens a stream for the session ID given by `openpty` with
+    `FRAME_OPEN`. Output from the PTY is sent to viewers as `PtyConsumer`
+    does, and input from users is sent to streams in round robin, at most
+    `QUANTUM` bytes at a time, as far as credits of the streams allow.
+    """
+
+    def __init__(self, consumer):
+        self.consumer = consumer
+        self.streams = {}
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    async def send_frame(self, kind, stream_id, payload=b''):
+        await self.consumer.send(bytes_data=pack_frame(kind, stream_id, payload))
+
+    @database_sync_to_async
+    def get_session(self, stream_id):
+        return Session.objects.select_related('server').defer('legacy_record').filter(
+            pk=stream_id,
+            server__pk=self.consumer.scope['wsclient'].pk,
+            closed_at__isnull=True,
+        ).first()
+
+    async def receive(self, data):
+        # A malformed frame is dropped, or closes its stream, without affecting other streams.
+        try:
+            (kind, stream_id, payload) = unpack_frame(data)
+        except ValueError as e:
+            logger.warning('Dropped a frame from %s: %s', self.consumer.scope['wsclient'], e)
+            return
+        stream = self.streams.get(stream_id, None)
+        if kind == FRAME_OPEN:
+            if stream is None:
+                await self.open(stream_id)
+        elif stream is None:
+            if kind != FRAME_CLOSE:
+                await self.send_frame(FRAME_CLOSE, stream_id)
+        elif kind == FRAME_DATA:
+            try:
+                stream.receive(payload)
+            except ValueError as e:
+                logger.warning(str(e))
+                await self.close(stream_id)
+        elif kind == FRAME_CREDIT:
+            if len(payload) == CREDIT.size:
+                stream.credit += CREDIT.unpack(payload)[0]
+                self.wakeup.set()
+            else:
+                logger.warning('Stream %s has sent a malformed credit.', stream_id)
+                await self.close(stream_id)
+        elif kind == FRAME_CLOSE:
+            await self.close(stream_id, notify=False)
+
+    async def open(self, stream_id):
+        session = await self.get_session(stream_id)
+        if session is None:
+            logger.debug('Rejected a stream for unknown session %s.', stream_id)
+            await self.send_frame(FRAME_CLOSE, stream_id)
+            return
+        stream = Stream(self, session)
+        self.streams[stream_id] = stream
+        await self.consumer.channel_layer.group_add(stream.group_name, self.consumer.channel_name)
+        if self.task is None:
+            self.task = asyncio.create_task(self.schedule())
+        logger.debug('%s opened a multiplexed pty.', session.server)
+        await stream.send_output(WELCOME_MESSAGE.encode('utf-8'))
+        await stream.send_output(
+            ('Websh for ' + colored('[%s]' % session.server, 'green') + ' became ready.\r\n').encode('utf-8')
+        )
+
+    async def close(self, stream_id, notify=True):
+        """
+        Close a stream, and let viewers leave the session. If `notify` is set, the agent is notified.
+        """
+        stream = self.streams.pop(stream_id, None)
+        if stream is None:
+            return
+        await stream.close()
+        await self.consumer.channel_layer.group_discard(stream.group_name, self.consumer.channel_name)
+        await self.consumer.channel_layer.group_send(stream.group_name, {
+            'type': 'leave_message',
+            'message': 'exit',
+            'session': str(stream_id),
+        })
+        if notify:
+            await self.send_frame(FRAME_CLOSE, stream_id)
+
+    async def close_all(self):
+        if self.task is not None:
+            self.task.cancel()
+        for stream_id in list(self.streams):
+            await self.close(stream_id, notify=False)
+
+    def write_input(self, stream_id, data):
+        stream = self.streams.get(stream_id, None)
+        if stream is not None and data:
+            stream.pending.append(data)
+            self.wakeup.set()
+
+    def take_input(self):
+        """
+        Return `(stream, data)` pairs of a round, taking input from each stream with credits.
+        """
+        return [
+            (stream, stream.take_input())
+            for stream in list(self.streams.values())
+            if stream.pending and stream.credit > 0
+        ]
+
+    async def schedule(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while True:
+                frames = self.take_input()
+                if not frames:
+                    break
+                for (stream, data) in frames:
+                    await self.send_frame(FRAME_DATA, stream.id, data)
+
+    async def user_message(self, event):
+        self.write_input(uuid.UUID(event['session']), event['data'])
+
+    async def leave_message(self, event):
+        # The session has been closed by the master user.
+        if 'session' in event:
+            await self.close(uuid.UUID(event['session']))
@@ -1,4 +1,7 @@
+import uuid
+import asyncio
 from datetime import timedelta
+from types import SimpleNamespace
 
 from asgiref.sync import sync_to_async
 from termcolor import colored
@@ -10,7 +13,7 @@ from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.utils.crypto import get_random_string
-from django.test import TransactionTestCase
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
 
 from rest_framework import status
 from rest_framework.test import APITestCase, APIClient
@@ -20,7 +23,12 @@ from servers.models import Server
 from iam.models import Group
 from iam.test_user import get_random_username
 from websh.models import Session, UserChannel, PtyChannel
+from websh.buffers import RecordBuffer, OutputCoalescer, ViewerQueue
 from websh.routing import websocket_urlpatterns
+from websh.consumer import BINARY_SUBPROTOCOL
+from websh.multiplex import (
+    Stream, StreamMultiplexer, QUANTUM, FRAME_DATA, FRAME_CREDIT, FRAME_CLOSE, pack_frame, unpack_frame,
+)
 from wsutils.auth import APIAuthMiddlewareStack
 
 
@@ -337,6 +345,196 @@ class SessionPermissionTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
 
+class SessionRecordTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username=get_random_username())
+        self.server = Server.objects.create(name='testing', owner=self.user)
+        self.session = Session.objects.create(
+            server=self.server,
+            user=self.user,
+            username='root',
+            legacy_record='legacy\r\n',
+        )
+
+    def test_chunks(self):
+        buffer = RecordBuffer(chunk_size=8, flush_interval=60)
+        for (offset, data) in [(0.5, b'ls\r\n'), (1.0, b'foo bar\r\n'), (2.5, b'$ ')]:
+            if buffer.append(data, offset):
+                self.session.append_record(buffer.take())
+        self.session.append_record(buffer.take())
+
+        self.assertEqual(
+            list(self.session.record_chunks.values_list('seq', 'started', 'ended')),
+            [(1, 0.5, 1.0), (2, 2.5, 2.5)]
+        )
+        session = Session.objects.get(pk=self.session.pk)
+        self.assertEqual(session.record, 'legacy\r\nls\r\nfoo bar\r\n$ ')
+        session.append_record([(3.0, b'exit\r\n')])
+        self.assertEqual(Session.objects.get(pk=self.session.pk).record, session.record)
+
+    def test_raw_bytes(self):
+        data = '가'.encode('utf-8')
+        self.session.append_record([(0.5, data[:2]), (0.6, data[2:] + b'\xff')])
+        self.assertEqual(
+            [data for (offset, data) in self.session.get_record_frames(start=0.5)],
+            [b'\xea\xb0', b'\x80\xff']
+        )
+        self.assertEqual(self.session.record, 'legacy\r\n가\ufffd')
+
+    def test_pages(self):
+        # A character is split across frames, so a page cannot end between them.
+        data = '가'.encode('utf-8')
+        self.session.append_record([(1.0, b'ab'), (2.0, data[:1]), (3.0, data[1:]), (4.0, b'cd')])
+        (events, next_offset) = self.session.get_record_page(start=1.0, size=2)
+        self.assertEqual((events, next_offset), ([(1.0, 'o', 'ab')], 2.0))
+        (events, next_offset) = self.session.get_record_page(start=next_offset, size=1)
+        self.assertEqual((events, next_offset), ([(3.0, 'o', '가')], 4.0))
+        (events, next_offset) = self.session.get_record_page(start=next_offset, size=1)
+        self.assertEqual((events, next_offset), ([(4.0, 'o', 'cd')], None))
+
+    def test_replay(self):
+        self.session.append_record([(0.5, b'ls\r\n'), (1.0, b'foo\r\n')])
+        self.session.append_record([(2.0, b'bar\r\n'), (3.0, b'$ ')])
+        self.assertEqual(
+            [event[0] for event in self.session.get_record_events(start=1.0, end=2.0)],
+            [1.0, 2.0]
+        )
+
+        self.client.force_login(self.user)
+        response = self.client.get(
+            reverse('api:websh:session-record', kwargs={'pk': self.session.pk}),
+            {'start': 1.5},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['duration'], 3.0)
+        self.assertEqual([event[2] for event in response.data['events']], ['bar\r\n', '$ '])
+
+        response = self.client.get(reverse('api:websh:session-cast', kwargs={'pk': self.session.pk}))
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(lines[-1], '[3.0, "o", "$ "]')
+
+
+class OutputCoalescerTestCase(SimpleTestCase):
+    async def test_batching(self):
+        sent = []
+
+        async def send(data):
+            sent.append(data)
+
+        output = OutputCoalescer(send, delay=0.01, max_size=8, max_rate=0)
+        for data in [b'a', b'b', b'c']:
+            await output.write(data)
+        self.assertEqual(sent, [])
+        await asyncio.sleep(0.05)
+        self.assertEqual(sent, [b'abc'])
+
+        # Full batches are sent immediately.
+        await output.write(b'0123456789')
+        self.assertEqual(sent, [b'abc', b'0123456789'])
+        await output.write(b'd')
+        await output.close()
+        self.assertEqual(sent, [b'abc', b'0123456789', b'd'])
+
+
+class ViewerQueueTestCase(SimpleTestCase):
+    async def test_drop_oldest(self):
+        queue = ViewerQueue(max_size=8, policy='drop-oldest')
+        for data in [b'abc', b'def', b'ghi']:
+            queue.put(data)
+        self.assertEqual((len(queue), queue.dropped), (6, 3))
+        self.assertEqual(await queue.get(), b'defghi')
+
+        queue.put(b'0123456789')
+        self.assertEqual(await queue.get(), b'23456789')
+        self.assertEqual(queue.dropped, 5)
+
+    async def test_resync(self):
+        queue = ViewerQueue(max_size=8, policy='resync')
+        for data in [b'abc', b'def', b'ghi']:
+            queue.put(data)
+        self.assertTrue(queue.overflowed)
+        self.assertIsNone(await queue.get())
+        self.assertEqual((len(queue), queue.dropped), (0, 9))
+
+        queue.reset()
+        queue.put(b'jkl')
+        self.assertEqual(await queue.get(), b'jkl')
+
+
+class FakeBackhaulConsumer:
+    def __init__(self):
+        self.scope = {'wsclient': 'testing'}
+        self.channel_name = 'backhaul'
+        self.channel_layer = SimpleNamespace(group_discard=self.ignore, group_send=self.ignore)
+        self.frames = []
+
+    async def send(self, bytes_data=None):
+        self.frames.append(unpack_frame(bytes_data))
+
+    async def ignore(self, *args):
+        pass
+
+
+class StreamMultiplexerTestCase(SimpleTestCase):
+    def test_frames(self):
+        stream_id = uuid.uuid4()
+        self.assertEqual(unpack_frame(pack_frame(FRAME_DATA, stream_id, b'ls')), (FRAME_DATA, stream_id, b'ls'))
+        with self.assertRaises(ValueError):
+            unpack_frame(b'\x01')
+
+    async def test_malformed_frames(self):
+        consumer = FakeBackhaulConsumer()
+        multiplexer = StreamMultiplexer(consumer)
+        streams = [Stream(multiplexer, SimpleNamespace(id=uuid.uuid4())) for i in range(2)]
+        for stream in streams:
+            multiplexer.streams[stream.id] = stream
+
+        # Short frames are dropped, and a malformed credit closes only its stream.
+        await multiplexer.receive(b'\x01')
+        self.assertEqual(consumer.frames, [])
+        await multiplexer.receive(pack_frame(FRAME_CREDIT, streams[0].id, b'\x00'))
+        self.assertEqual(list(multiplexer.streams), [streams[1].id])
+        self.assertEqual(consumer.frames, [(FRAME_CLOSE, streams[0].id, b'')])
+
+        await multiplexer.close_all()
+
+    async def test_forward_failure(self):
+        consumer = FakeBackhaulConsumer()
+        multiplexer = StreamMultiplexer(consumer)
+        stream = Stream(multiplexer, SimpleNamespace(id=uuid.uuid4()))
+        multiplexer.streams[stream.id] = stream
+
+        async def write(data):
+            raise RuntimeError('write failed')
+        stream.output.write = write
+        stream.receive(b'ls')
+        await stream.task
+        self.assertEqual(multiplexer.streams, {})
+        self.assertEqual(consumer.frames, [(FRAME_CLOSE, stream.id, b'')])
+
+    async def test_round_robin(self):
+        multiplexer = StreamMultiplexer(consumer=None)
+        streams = [Stream(multiplexer, SimpleNamespace(id=uuid.uuid4())) for i in range(2)]
+        for stream in streams:
+            multiplexer.streams[stream.id] = stream
+        multiplexer.write_input(streams[0].id, b'x' * (QUANTUM * 2))
+        multiplexer.write_input(streams[1].id, b'y' * 10)
+        streams[1].credit = 4
+
+        # Each stream gets a quantum in a round as far as its credits allow.
+        rounds = []
+        while True:
+            frames = multiplexer.take_input()
+            if not frames:
+                break
+            rounds.append([(streams.index(stream), len(data)) for (stream, data) in frames])
+        self.assertEqual(rounds, [[(0, QUANTUM), (1, 4)], [(0, QUANTUM)]])
+
+        for stream in streams:
+            stream.task.cancel()
+
+
 class ConsumerTestCase(TransactionTestCase):
 
     def setUp(self):
@@ -418,6 +616,33 @@ class ConsumerTestCase(TransactionTestCase):
         await user_communicator.disconnect()
         await pty_communicator.disconnect()
 
+    async def test_binary_frames(self):
+        user_communicator = WebsocketCommunicator(
+            WsApp,
+            'ws/websh/{}/{}/'.format(self.user_channel.id, self.user_channel.token),
+            subprotocols=[BINARY_SUBPROTOCOL],
+        )
+        connected, subprotocol = await user_communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, BINARY_SUBPROTOCOL)
+        self.assertIsInstance(await user_communicator.receive_from(), bytes)
+
+        self.pty_channel = await sync_to_async(PtyChannel.objects.first)()
+        pty_communicator = WebsocketCommunicator(WsApp, self.pty_channel.get_server_ws_url())
+        connected, _ = await pty_communicator.connect()
+        self.assertTrue(connected)
+        await user_communicator.receive_from()
+        await user_communicator.receive_from()
+
+        # Binary input reaches the text pty as decoded text, and raw output reaches the user as is.
+        await user_communicator.send_to(bytes_data='가'.encode('utf-8'))
+        self.assertEqual(await pty_communicator.receive_from(), '가')
+        await pty_communicator.send_to(text_data='\xff')
+        self.assertEqual(await user_communicator.receive_from(), '\xff'.encode('utf-8'))
+
+        await user_communicator.disconnect()
+        await pty_communicator.disconnect()
+
 
 class SessionShareTestCase(APITestCase):
     def setUp(self):
@@ -23,6 +23,8 @@ class WebSocketClient(APIClient):
 
     @property
     def is_connected(self) -> bool:
+        if hasattr(self, '_is_connected'):
+            return self._is_connected
         return self.sessions.filter(deleted_at__isnull=True).exists()
 
     @property
@@ -36,6 +38,8 @@ class WebSocketClient(APIClient):
 
     @property
     def remote_ip(self):
+        if hasattr(self, '_remote_ip'):
+            return self._remote_ip
         try:
             return self.last_session.remote_ip
         except Exception as e:
@@ -43,6 +47,8 @@ class WebSocketClient(APIClient):
 
     @property
     def last_connectivity(self):
+        if hasattr(self, '_last_connectivity'):
+            return self._last_connectivity
         try:
             return self.last_session.updated_at
         except:
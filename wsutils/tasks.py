@@ -6,24 +6,42 @@ from django.db import transaction
 from celery import shared_task
 
 from wsutils.models import WebSocketSession
+from utils.watchdog import dispatch_shards, run_shard
 
 
 @shared_task(ignore_results=True, queue='watchdog')
 def clear_stale_sessions():
-    sessions = WebSocketSession.objects.select_for_update(of=('self',)).filter(
-        updated_at__lt=timezone.now()-timedelta(minutes=15),
-        deleted_at__isnull=True,
+    return dispatch_shards(
+        clear_stale_sessions_shard,
+        WebSocketSession.objects.filter(
+            updated_at__lt=timezone.now()-timedelta(minutes=15),
+            deleted_at__isnull=True,
+        ).values_list('pk', flat=True),
     )
 
-    with transaction.atomic():
-        for session in sessions:
-            session.deleted_at = timezone.now()
-            session.save(update_fields=['deleted_at'])
 
-    for session in sessions:
-        session.close(quit=False)
-
-    return len(sessions)
+@shared_task(ignore_results=True, queue='watchdog')
+def clear_stale_sessions_shard(shard, session_pks):
+    """
+    Retire stale sessions of a shard. We update deleted_at field atomically
+    first, and close the session only if it has not been retired elsewhere.
+    """
+    def clear_session(session):
+        if WebSocketSession.objects.filter(
+            pk=session.pk,
+            deleted_at__isnull=True,
+        ).update(deleted_at=timezone.now()) == 1:
+            session.close(quit=False)
+
+    return run_shard(
+        'clear_stale_sessions', shard,
+        clear_session,
+        WebSocketSession.objects.filter(
+            pk__in=session_pks,
+            updated_at__lt=timezone.now()-timedelta(minutes=15),
+            deleted_at__isnull=True,
+        ),
+    )
 
 
 @shared_task(ignore_results=True, queue='cleanup')